@@ -0,0 +1,246 @@
+"""Пакетная обработка без Telegram: оценка записанных ответов кандидатов и генерация наборов вопросов.
+
+Оценка ответов (CSV или JSONL с полями question, reference_answer, user_answer и, по желанию, id, scope, difficulty):
+    python batch.py grade answers.csv -o graded.jsonl
+Генерация вопросов (поля scope, difficulty, count):
+    python batch.py generate plan.jsonl -o questions.jsonl
+
+Результаты дописываются в выходной JSONL по мере готовности; при повторном запуске с тем же файлом уже
+обработанные записи пропускаются, записи с ошибкой обрабатываются заново.
+"""
+import argparse
+import asyncio
+import csv
+import json
+import os
+import sys
+import time
+
+from src.agent_factory import (EXCLUDED_QUESTIONS_LIMIT, LLM_MAX_CONCURRENCY, MAX_QUESTION_ATTEMPTS, create_rag_agent,
+                               get_question_reliable)
+from src.asked_questions import AskedQuestionIndex
+from src.interview_profile import InterviewProfile
+
+# Сколько раз запись ждет, пока разомкнутый размыкатель Mistral снова пропустит запросы, прежде чем
+# записаться с ошибкой: без ожидания при сбое сервиса все оставшиеся записи мгновенно завершились бы ошибкой
+MAX_CIRCUIT_WAITS = 5
+
+# Допустимые названия полей входного файла
+FIELD_ALIASES = {
+    "question": ("question",),
+    "reference_answer": ("reference_answer", "rag_answer", "answer"),
+    "user_answer": ("user_answer", "candidate_answer"),
+    "scope": ("scope", "position", "interview_scope"),
+    "difficulty": ("difficulty", "level"),
+    "count": ("count",),
+}
+
+
+def read_records(path: str):
+    """Записи входного CSV или JSONL по одной, без чтения всего файла в память"""
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        if path.lower().endswith(".csv"):
+            yield from csv.DictReader(f)
+            return
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError as e:
+                raise ValueError(f"{path}:{line_number}: некорректный JSON: {e}") from None
+
+
+def field(record: dict, name: str, default=None):
+    for alias in FIELD_ALIASES[name]:
+        value = record.get(alias)
+        if value not in (None, ""):
+            return value
+    return default
+
+
+def read_checkpoint(path: str) -> list[dict]:
+    """Уже записанные результаты; оборванная при аварийном завершении последняя строка пропускается"""
+    if not os.path.exists(path):
+        return []
+    results = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                results.append(json.loads(line))
+            except ValueError:
+                continue
+    return results
+
+
+def create_agent(args):
+    """RagAgent с настройками из окружения, как у бота"""
+    return create_rag_agent(response_cache=None) if args.no_cache else create_rag_agent()
+
+
+class BatchRunner:
+    """Очередь задач ограниченного размера и concurrency обработчиков; результат каждой задачи сразу
+    дописывается в выходной файл"""
+
+    def __init__(self, output: str, concurrency: int):
+        self._output = open(output, "a", encoding="utf-8", buffering=1)
+        self._concurrency = concurrency
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=concurrency * 2)
+        self.done = 0
+        self.failed = 0
+        self._started = time.monotonic()
+
+    def write(self, result: dict) -> None:
+        self._output.write(json.dumps(result, ensure_ascii=False) + "\n")
+        if "error" in result:
+            self.failed += 1
+        else:
+            self.done += 1
+        if (self.done + self.failed) % 50 == 0:
+            self.report()
+
+    def report(self) -> None:
+        elapsed = time.monotonic() - self._started
+        print(f"Обработано {self.done + self.failed} (ошибок {self.failed}), "
+              f"{(self.done + self.failed) / elapsed if elapsed else 0:.1f} в секунду")
+
+    async def _process(self, process, key, payload) -> dict:
+        from src.resilience import CircuitOpenError, retry_budget
+
+        for _ in range(MAX_CIRCUIT_WAITS):
+            try:
+                with retry_budget():
+                    return await process(key, payload)
+            except CircuitOpenError as e:
+                await asyncio.sleep(e.retry_in)
+        with retry_budget():
+            return await process(key, payload)
+
+    async def _worker(self, process) -> None:
+        while True:
+            key, payload = await self._queue.get()
+            try:
+                result = await self._process(process, key, payload)
+            except Exception as e:
+                result = {"key": key, "error": f"{type(e).__name__}: {e}"}
+            finally:
+                self._queue.task_done()
+            self.write(result)
+
+    async def run(self, tasks, process) -> None:
+        """tasks - итератор (ключ, данные), process(ключ, данные) -> dict с результатом"""
+        workers = [asyncio.create_task(self._worker(process)) for _ in range(self._concurrency)]
+        try:
+            for task in tasks:
+                await self._queue.put(task)
+            await self._queue.join()
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            self._output.close()
+            self.report()
+
+
+def grading_tasks(args, completed: set):
+    for index, record in enumerate(read_records(args.input)):
+        key = str(record.get("id") or index)
+        if key in completed:
+            continue
+        question = field(record, "question")
+        user_answer = field(record, "user_answer")
+        if not question or user_answer is None:
+            print(f"Запись {key}: нет question или user_answer, пропускаю")
+            continue
+        profile = InterviewProfile(interview_scope=field(record, "scope", args.scope),
+                                   difficulty=field(record, "difficulty", args.difficulty))
+        yield key, (profile, question, field(record, "reference_answer", ""), user_answer)
+
+
+async def grade(args) -> None:
+    completed = {result["key"] for result in read_checkpoint(args.output) if "error" not in result}
+    if completed:
+        print(f"Уже оценено {len(completed)} ответов, продолжаю")
+    agent = await asyncio.to_thread(create_agent, args)
+
+    async def process(key, payload):
+        profile, question, reference_answer, user_answer = payload
+        if not reference_answer:
+            # Эталона нет во входном файле - берем развернутый ответ агента, как в боте
+            reference_answer = await agent.get_detailed_answer(profile, question)
+        analysis = await agent.check_answer_correctness(profile, question, reference_answer, user_answer)
+        return {"key": key, "scope": profile.interview_scope, "difficulty": profile.difficulty,
+                "question": question, "user_answer": user_answer, "analysis": analysis}
+
+    await BatchRunner(args.output, args.concurrency).run(grading_tasks(args, completed), process)
+
+
+def generation_tasks(args, completed: set):
+    for index, record in enumerate(read_records(args.input)):
+        profile = InterviewProfile(interview_scope=field(record, "scope", args.scope),
+                                   difficulty=field(record, "difficulty", args.difficulty))
+        for number in range(int(field(record, "count", 1))):
+            key = f"{index}:{number}"
+            if key not in completed:
+                yield key, profile
+
+
+async def generate(args) -> None:
+    results = [result for result in read_checkpoint(args.output) if "error" not in result]
+    if results:
+        print(f"Уже сгенерировано {len(results)} вопросов, продолжаю")
+    agent = await asyncio.to_thread(create_agent, args)
+    # Уже сгенерированные вопросы по каждой паре (тема, сложность), чтобы в наборе не было повторов
+    asked: dict[tuple[str, str], AskedQuestionIndex] = {}
+    for result in results:
+        asked.setdefault((result["scope"], result["difficulty"]), AskedQuestionIndex()).add(result["question"])
+
+    async def process(key, profile):
+        index = asked.setdefault((profile.interview_scope, profile.difficulty), AskedQuestionIndex())
+        for _ in range(MAX_QUESTION_ATTEMPTS):
+            # Ответ модели в неверном формате перезапрашивается, как в боте
+            item = await get_question_reliable(agent, profile, exclude=index.recent(EXCLUDED_QUESTIONS_LIMIT))
+            embedding = await agent.embed_text(item["question"])
+            if index.find_duplicate(item["question"], embedding) is None:
+                index.add(item["question"], embedding)
+                return {"key": key, "scope": profile.interview_scope, "difficulty": profile.difficulty,
+                        "question": item["question"], "answer": item["answer"]}
+        raise RuntimeError(f"не удалось получить неповторяющийся вопрос за {MAX_QUESTION_ATTEMPTS} попытки")
+
+    completed = {result["key"] for result in results}
+    await BatchRunner(args.output, args.concurrency).run(generation_tasks(args, completed), process)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Пакетная оценка ответов и генерация вопросов без Telegram")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    for name, help_text in (("grade", "оценить ответы кандидатов"), ("generate", "сгенерировать наборы вопросов")):
+        command = subparsers.add_parser(name, help=help_text)
+        command.add_argument("input", help="входной файл .csv или .jsonl")
+        command.add_argument("-o", "--output", required=True,
+                             help="выходной .jsonl; при повторном запуске обработка продолжается с места остановки")
+        command.add_argument("--concurrency", type=int, default=LLM_MAX_CONCURRENCY * 2,
+                             help="сколько записей обрабатывается одновременно (запросы к Mistral дополнительно "
+                                  "ограничены LLM_MAX_CONCURRENCY и MISTRAL_TOKENS_PER_MINUTE)")
+        command.add_argument("--scope", default="Data Science", help="тема для записей без поля scope")
+        command.add_argument("--difficulty", default="Junior", help="сложность для записей без поля difficulty")
+        command.add_argument("--no-cache", action="store_true", help="не использовать семантический кеш ответов")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    try:
+        asyncio.run(grade(args) if args.command == "grade" else generate(args))
+    except KeyboardInterrupt:
+        print("\nОстановлено, обработанные записи сохранены; повторный запуск продолжит с места остановки")
+        return 1
+    except (OSError, ValueError) as e:
+        print(f"Ошибка: {e}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
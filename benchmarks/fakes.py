@@ -0,0 +1,214 @@
+"""Локальные заглушки внешних сервисов для нагрузочного теста: Mistral, arxiv, эмбеддинги и Telegram Bot API"""
+import asyncio
+import itertools
+import json
+import random
+import re
+import time
+import zlib
+from collections import Counter
+from typing import Any, List
+
+import httpx
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import EditMessageText, SendMessage
+from llama_index.embeddings.base import BaseEmbedding
+from mistralai import models
+
+from src.external_docs import ExternalDocsBackend
+
+_WORD = re.compile(r"\w+")
+VOCABULARY = (
+    "регрессия классификация градиент бустинг переобучение регуляризация кросс-валидация выборка признак "
+    "нейросеть attention transformer embedding индекс транзакция нормализация кеш очередь поток процесс "
+    "хеш-таблица дерево граф сортировка сложность метрика precision recall bias variance dropout batch"
+).split()
+
+
+def _words(count: int) -> str:
+    return " ".join(random.choice(VOCABULARY) for _ in range(count))
+
+
+class HashEmbedding(BaseEmbedding):
+    """Детерминированные эмбеддинги по хешам слов: тексты с общими словами близки, модель не нужна"""
+
+    embed_dim: int = 768
+    latency: float = 0.0
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "HashEmbedding"
+
+    def _vector(self, text: str) -> List[float]:
+        if self.latency:
+            time.sleep(self.latency)
+        vector = [0.0] * self.embed_dim
+        for word in _WORD.findall(text.lower()):
+            bucket = zlib.crc32(word.encode("utf-8"))
+            vector[bucket % self.embed_dim] += 1.0 if bucket & 1 << 31 else -1.0
+        return vector
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        return self._vector(query)
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return self._vector(text)
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        return self._vector(query)
+
+
+class FakeEventStream:
+    """Аналог EventStreamAsync из mistralai: асинхронный итератор CompletionEvent"""
+
+    def __init__(self, chat: "FakeMistralChat", model: str, text: str):
+        self._chat = chat
+        self._model = model
+        self._text = text
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return None
+
+    def __aiter__(self):
+        return self._events()
+
+    async def _events(self):
+        try:
+            await asyncio.sleep(self._chat.first_token_delay())
+            words = self._text.split(" ")
+            for start in range(0, len(words), 4):
+                chunk = " ".join(words[start:start + 4]) + (" " if start + 4 < len(words) else "")
+                await asyncio.sleep(self._chat.token_latency * 4)
+                choice = models.CompletionResponseStreamChoice(
+                    index=0, delta=models.DeltaMessage(content=chunk), finish_reason=None
+                )
+                yield models.CompletionEvent(data=models.CompletionChunk(id="fake", model=self._model,
+                                                                          choices=[choice]))
+        finally:
+            self._chat.release()
+
+
+class FakeMistralChat:
+    """chat.complete_async / chat.stream_async с настраиваемой задержкой и долей ошибок"""
+
+    def __init__(self, latency: float = 0.8, token_latency: float = 0.005, reply_words: int = 150,
+                 failure_rate: float = 0.0, rate_limit_rate: float = 0.0, empty_answer_rate: float = 0.2):
+        self.latency = latency
+        self.token_latency = token_latency
+        self.reply_words = reply_words
+        self.failure_rate = failure_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.empty_answer_rate = empty_answer_rate
+        self._question_ids = itertools.count(1)
+        self.calls = Counter()
+        self.failures = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+
+    def first_token_delay(self) -> float:
+        return self.latency * random.uniform(0.5, 1.5)
+
+    def _acquire(self, kind: str) -> None:
+        self.calls[kind] += 1
+        roll = random.random()
+        if roll < self.rate_limit_rate:
+            self.failures += 1
+            raise models.SDKError("Rate limit exceeded", httpx.Response(429, headers={"Retry-After": "1"}), "")
+        if roll < self.rate_limit_rate + self.failure_rate:
+            self.failures += 1
+            raise models.SDKError("Service unavailable", httpx.Response(503), "")
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+
+    def release(self) -> None:
+        self.in_flight -= 1
+
+    def _reply(self, messages: list[dict]) -> str:
+        text = "\n".join(str(message["content"]) for message in messages)
+        if "ФОРМАТ: json" in text:
+            answer = "" if random.random() < self.empty_answer_rate else _words(40)
+            question = f"Вопрос {next(self._question_ids)}: {_words(8)}?"
+            return json.dumps({"question": question, "answer": answer}, ensure_ascii=False)
+        if "резюме" in str(messages[0]["content"]):
+            return _words(40)
+        return _words(self.reply_words)
+
+    async def complete_async(self, model: str, messages: list[dict], **kwargs: Any):
+        self._acquire("complete")
+        try:
+            reply = self._reply(messages)
+            await asyncio.sleep(self.first_token_delay() + self.token_latency * len(reply.split()))
+        finally:
+            self.release()
+        prompt_tokens = sum(len(str(message["content"])) for message in messages) // 4
+        completion_tokens = len(reply) // 4
+        return models.ChatCompletionResponse(
+            id="fake", object="chat.completion", model=model, created=int(time.time()),
+            usage=models.UsageInfo(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens,
+                                   total_tokens=prompt_tokens + completion_tokens),
+            choices=[models.ChatCompletionChoice(index=0, message=models.AssistantMessage(content=reply),
+                                                 finish_reason="stop")]
+        )
+
+    async def stream_async(self, model: str, messages: list[dict], **kwargs: Any) -> FakeEventStream:
+        self._acquire("stream")
+        return FakeEventStream(self, model, self._reply(messages))
+
+
+class FakeMistral:
+    """Замена клиента mistralai.Mistral"""
+
+    def __init__(self, **options):
+        self.chat = FakeMistralChat(**options)
+
+
+class FakeDocsBackend(ExternalDocsBackend):
+    """Замена arxiv: синхронный поиск с задержкой, как у ArxivRetriever"""
+    name = "fake"
+
+    def __init__(self, latency: float = 1.0, failure_rate: float = 0.0):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.calls = 0
+
+    def search(self, query: str) -> list[str]:
+        self.calls += 1
+        time.sleep(self.latency * random.uniform(0.5, 1.5))
+        if random.random() < self.failure_rate:
+            raise ConnectionError("arxiv недоступен")
+        return [_words(120), _words(120)]
+
+
+class FakeTelegramSession(BaseSession):
+    """Сессия Bot API без сети: отправка и редактирование сообщений возвращают правдоподобные Message"""
+
+    def __init__(self, latency: float = 0.05, **kwargs: Any):
+        super().__init__(**kwargs)
+        self.latency = latency
+        self.requests = Counter()
+        self.error_replies = 0
+        self._message_ids = itertools.count(1)
+
+    async def make_request(self, bot, method, timeout: int | None = None):
+        self.requests[type(method).__name__] += 1
+        await asyncio.sleep(self.latency * random.uniform(0.5, 1.5))
+        result: Any = True
+        if isinstance(method, (SendMessage, EditMessageText)):
+            if "техническая ошибка" in method.text or "сейчас перегружен или недоступен" in method.text:
+                self.error_replies += 1
+            message_id = method.message_id if isinstance(method, EditMessageText) else next(self._message_ids)
+            result = {"message_id": message_id, "date": int(time.time()),
+                      "chat": {"id": method.chat_id, "type": "private"}, "text": method.text}
+        return self.check_response(bot, method, 200, json.dumps({"ok": True, "result": result})).result
+
+    async def stream_content(self, url: str, headers=None, timeout: int = 30, chunk_size: int = 65536,
+                             raise_for_status: bool = True):
+        """Загрузка файлов в бенчмарке не используется: пустой поток"""
+        return
+        yield b""
+
+    async def close(self) -> None:
+        pass
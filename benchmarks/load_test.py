@@ -0,0 +1,308 @@
+"""Нагрузочный тест бота: синтетические кандидаты проходят собеседование через настоящие хендлеры aiogram
+(start_interview_command, next_question_handler, handle_all_messages), а Mistral, arxiv, эмбеддинги
+и Telegram Bot API заменены локальными заглушками из benchmarks/fakes.py.
+
+Пример: python -m benchmarks.load_test --users 100 --rounds 3 --output result.json
+Сравнение с прошлым прогоном: python -m benchmarks.load_test --users 100 --baseline result.json
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+BENCHMARK_BOT_TOKEN = "123456:BENCHMARK"
+THEORY_QUESTIONS = [
+    "Что такое переобучение и как с ним бороться?",
+    "Чем отличается L1 от L2 регуляризации?",
+    "Как работает градиентный бустинг?",
+    "Что такое attention в трансформерах?",
+    "Зачем нужна кросс-валидация?",
+    "Как устроена хеш-таблица?",
+    "Что такое уровни изоляции транзакций?",
+    "Чем процесс отличается от потока?",
+]
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Нагрузочный тест бота с локальными заглушками внешних сервисов")
+    parser.add_argument("--users", type=int, default=10, help="число одновременных кандидатов")
+    parser.add_argument("--rounds", type=int, default=3, help="ответов на вопросы за собеседование")
+    parser.add_argument("--ask-rate", type=float, default=0.3, help="доля раундов с теоретическим вопросом")
+    parser.add_argument("--think-time", type=float, default=0.5, help="средняя пауза кандидата между сообщениями, с")
+    parser.add_argument("--ramp-up", type=float, default=5.0, help="за сколько секунд подключаются все кандидаты")
+    parser.add_argument("--llm-latency", type=float, default=0.8, help="задержка Mistral до первого токена, с")
+    parser.add_argument("--llm-token-latency", type=float, default=0.005, help="задержка на токен, с")
+    parser.add_argument("--llm-failure-rate", type=float, default=0.0, help="доля ответов Mistral с ошибкой 503")
+    parser.add_argument("--llm-rate-limit-rate", type=float, default=0.0, help="доля ответов Mistral с ошибкой 429")
+    parser.add_argument("--docs-latency", type=float, default=1.0, help="задержка поиска arxiv, с")
+    parser.add_argument("--docs-failure-rate", type=float, default=0.0, help="доля ошибок поиска arxiv")
+    parser.add_argument("--embed-latency", type=float, default=0.01, help="задержка эмбеддинга одного текста, с")
+    parser.add_argument("--telegram-latency", type=float, default=0.05, help="задержка запроса к Bot API, с")
+    parser.add_argument("--no-pool", action="store_true", help="не запускать фоновое пополнение пула вопросов")
+    parser.add_argument("--workdir", help="каталог для storage/ (по умолчанию временный; индекс строится заново)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="сохранить результаты в JSON")
+    parser.add_argument("--baseline", help="JSON прошлого прогона для сравнения")
+    parser.add_argument("--max-regression", type=float, default=0.2,
+                        help="допустимый рост p95 относительно baseline (0.2 = 20%%)")
+    return parser.parse_args(argv)
+
+
+def percentile(values: list[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))]
+
+
+def rss_mb() -> float:
+    """Текущий RSS процесса; вне Linux - пиковый"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except OSError:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 2 ** 20 if sys.platform == "darwin" else peak / 2 ** 10
+
+
+class LoopLagMonitor:
+    """Задержка event loop: насколько позже запланированного просыпается короткий sleep"""
+
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self.lags: list[float] = []
+        self.peak_rss = 0.0
+
+    async def run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            self.lags.append(max(0.0, loop.time() - started - self.interval))
+            self.peak_rss = max(self.peak_rss, rss_mb())
+
+
+class Benchmark:
+    def __init__(self, args: argparse.Namespace, tg_bot, bot):
+        self.args = args
+        self.tg_bot = tg_bot
+        self.bot = bot
+        self.latencies: dict[str, list[float]] = defaultdict(list)
+        self.errors: dict[str, int] = defaultdict(int)
+        self.completed_users = 0
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+
+    def make_update(self, user_id: int, text: str):
+        from aiogram.types import Update
+        return Update.model_validate({
+            "update_id": next(self._update_ids),
+            "message": {
+                "message_id": next(self._message_ids),
+                "date": int(datetime.now().timestamp()),
+                "chat": {"id": user_id, "type": "private"},
+                "from": {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"},
+                "text": text,
+            },
+        }, context={"bot": self.bot})
+
+    async def send(self, action: str, user_id: int, text: str) -> None:
+        started = time.perf_counter()
+        try:
+            await self.tg_bot.dp.feed_update(self.bot, self.make_update(user_id, text))
+        except Exception as e:
+            self.errors[action] += 1
+            print(f"{action}: {type(e).__name__}: {e}")
+        self.latencies[action].append(time.perf_counter() - started)
+
+    async def think(self) -> None:
+        await asyncio.sleep(random.uniform(0, 2 * self.args.think_time))
+
+    async def run_user(self, user_id: int, delay: float) -> None:
+        await asyncio.sleep(delay)
+        await self.send("start", user_id, "/start")
+        await self.think()
+        await self.send("name", user_id, f"Кандидат {user_id}")
+        await self.send("position", user_id, random.choice(self.tg_bot.POSITIONS))
+        await self.send("start_interview", user_id, random.choice(self.tg_bot.LEVELS))
+        for _ in range(self.args.rounds):
+            await self.think()
+            await self.send("answer", user_id, "Я думаю, что " + " ".join(random.sample(THEORY_QUESTIONS, 2)))
+            if random.random() < self.args.ask_rate:
+                await self.think()
+                await self.send("ask_question", user_id, "Задать вопрос ❓")
+                await self.send("theory_question", user_id, random.choice(THEORY_QUESTIONS))
+            await self.think()
+            await self.send("next_question", user_id, "Следующий вопрос ➡️")
+        await self.send("finish", user_id, "Закончить интервью 🏁")
+        self.completed_users += 1
+
+
+async def run_benchmark(args: argparse.Namespace) -> dict:
+    random.seed(args.seed)
+    os.environ["TELEGRAM_BOT_TOKEN"] = BENCHMARK_BOT_TOKEN
+    os.environ["MISTRAL_API_KEY"] = "benchmark"
+    workdir = os.path.abspath(args.workdir or tempfile.mkdtemp(prefix="bot-benchmark-"))
+    os.makedirs(workdir, exist_ok=True)
+    # Все файлы storage/ (индекс, кеши, сессии, пул вопросов) пишутся в рабочий каталог бенчмарка,
+    # чтобы эмбеддинги заглушки не попали в хранилище настоящего бота
+    os.chdir(workdir)
+
+    from aiogram import Bot
+    from src import agent_factory, tg_bot
+    from benchmarks.fakes import FakeDocsBackend, FakeMistral, FakeTelegramSession, HashEmbedding
+
+    telegram = FakeTelegramSession(args.telegram_latency)
+    bot = Bot(token=BENCHMARK_BOT_TOKEN, session=telegram)
+    mistral = FakeMistral(latency=args.llm_latency, token_latency=args.llm_token_latency,
+                          failure_rate=args.llm_failure_rate, rate_limit_rate=args.llm_rate_limit_rate)
+    docs = FakeDocsBackend(args.docs_latency, args.docs_failure_rate)
+
+    agent_factory.RAG_DATA_DIR = os.path.join(REPO_ROOT, "rag_data")
+    started = time.perf_counter()
+    agent = await asyncio.to_thread(tg_bot.InterviewAgent, embed_model=HashEmbedding(latency=args.embed_latency),
+                                    mistral_client=mistral, docs_backend=docs)
+    init_seconds = time.perf_counter() - started
+    tg_bot.interview_agent = agent
+    tg_bot.agent_ready.set()
+
+    background = [asyncio.create_task(tg_bot.sessions.run())]
+    if not args.no_pool:
+        background.append(asyncio.create_task(agent.question_pool.run()))
+    monitor = LoopLagMonitor()
+    background.append(asyncio.create_task(monitor.run()))
+
+    benchmark = Benchmark(args, tg_bot, bot)
+    rss_before = rss_mb()
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        benchmark.run_user(1000 + i, random.uniform(0, args.ramp_up)) for i in range(args.users)
+    ))
+    wall_seconds = time.perf_counter() - started
+    rss_after = rss_mb()
+
+    for task in background:
+        task.cancel()
+    await asyncio.gather(*background, return_exceptions=True)
+    await tg_bot.sessions.close()
+
+    from src.metrics import STAGE_SECONDS
+    stages = {}
+    for key, (count, total) in STAGE_SECONDS.totals().items():
+        labels = dict(key)
+        stage = stages.setdefault(labels["stage"], {"count": 0, "errors": 0, "total_seconds": 0.0})
+        stage["count"] += count
+        stage["total_seconds"] += total
+        if labels["status"] != "ok":
+            stage["errors"] += count
+
+    updates = sum(len(values) for values in benchmark.latencies.values())
+    return {
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "baseline")},
+        "init_seconds": init_seconds,
+        "wall_seconds": wall_seconds,
+        "updates": updates,
+        "updates_per_second": updates / wall_seconds,
+        "interviews_per_minute": benchmark.completed_users / wall_seconds * 60,
+        "handlers": {
+            action: {
+                "count": len(values),
+                "errors": benchmark.errors[action],
+                "p50": percentile(values, 50),
+                "p95": percentile(values, 95),
+                "p99": percentile(values, 99),
+                "max": max(values),
+            }
+            for action, values in benchmark.latencies.items()
+        },
+        "stages": dict(sorted(stages.items(), key=lambda item: -item[1]["total_seconds"])),
+        "loop_lag": {"p50": percentile(monitor.lags, 50), "p99": percentile(monitor.lags, 99),
+                     "max": max(monitor.lags, default=0.0)},
+        "memory_mb": {"before": rss_before, "after": rss_after, "peak": max(monitor.peak_rss, rss_after),
+                      "growth": rss_after - rss_before},
+        "upstream": {
+            "mistral_calls": dict(mistral.chat.calls),
+            "mistral_failures": mistral.chat.failures,
+            "mistral_peak_concurrency": mistral.chat.peak_in_flight,
+            "docs_calls": docs.calls,
+            "telegram_requests": dict(telegram.requests),
+            "error_replies": telegram.error_replies,
+        },
+        "question_pool": agent.question_pool.stats(),
+        "response_cache": agent.rag_agent.response_cache.stats() if agent.rag_agent.response_cache else None,
+        "sessions": tg_bot.sessions.stats(),
+        "singleflight": agent.rag_agent.singleflight_stats(),
+    }
+
+
+def print_report(results: dict) -> None:
+    print(f"\nКандидатов: {results['config']['users']}, обновлений: {results['updates']}, "
+          f"время: {results['wall_seconds']:.1f} с (инициализация {results['init_seconds']:.1f} с)")
+    print(f"Пропускная способность: {results['updates_per_second']:.1f} обновлений/с, "
+          f"{results['interviews_per_minute']:.1f} собеседований/мин\n")
+    print(f"{'хендлер':<18}{'count':>7}{'errors':>8}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}")
+    for action, stats in results["handlers"].items():
+        print(f"{action:<18}{stats['count']:>7}{stats['errors']:>8}{stats['p50']:>9.3f}{stats['p95']:>9.3f}"
+              f"{stats['p99']:>9.3f}{stats['max']:>9.3f}")
+    print(f"\n{'этап':<34}{'count':>7}{'errors':>8}{'mean':>9}{'total':>10}")
+    for stage, stats in results["stages"].items():
+        print(f"{stage:<34}{stats['count']:>7}{stats['errors']:>8}"
+              f"{stats['total_seconds'] / stats['count']:>9.3f}{stats['total_seconds']:>10.1f}")
+    lag = results["loop_lag"]
+    memory = results["memory_mb"]
+    print(f"\nЗадержка event loop: p50 {lag['p50'] * 1000:.1f} мс, p99 {lag['p99'] * 1000:.1f} мс, "
+          f"max {lag['max'] * 1000:.1f} мс")
+    print(f"Память (RSS): {memory['before']:.0f} -> {memory['after']:.0f} МБ "
+          f"(рост {memory['growth']:+.0f} МБ, пик {memory['peak']:.0f} МБ)")
+    for key in ("upstream", "question_pool", "response_cache", "sessions", "singleflight"):
+        print(f"{key}: {json.dumps(results[key], ensure_ascii=False)}")
+
+
+def find_regressions(results: dict, baseline: dict, max_regression: float, min_delta: float = 0.05) -> list[str]:
+    """Хендлеры, у которых p95 вырос больше допустимого относительно baseline; рост меньше min_delta секунд
+    у быстрых хендлеров считается шумом"""
+    regressions = []
+    for action, stats in results["handlers"].items():
+        previous = baseline.get("handlers", {}).get(action)
+        if previous and stats["p95"] > previous["p95"] * (1 + max_regression) \
+                and stats["p95"] - previous["p95"] > min_delta:
+            regressions.append(f"{action}: p95 {previous['p95']:.3f} -> {stats['p95']:.3f} с")
+    return regressions
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+    output = os.path.abspath(args.output) if args.output else None
+
+    results = asyncio.run(run_benchmark(args))
+    print_report(results)
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"\nРезультаты сохранены в {output}")
+    if baseline is not None:
+        regressions = find_regressions(results, baseline, args.max_regression)
+        if regressions:
+            print("\nРегрессии относительно baseline:\n" + "\n".join(regressions))
+            return 1
+        print("\nРегрессий относительно baseline нет")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,96 @@
+"""Настройки RagAgent из окружения и сборка агента: общие для бота (src.tg_bot), пакетной обработки (batch.py)
+и пересборки индекса (start.py --rebuild-index)"""
+import os
+import time
+
+from dotenv import load_dotenv
+
+from src.external_docs import create_docs_backend
+from src.metrics import record_retry, record_startup
+from src.resilience import configure_retry_budget
+from src.response_cache import SemanticCache
+
+load_dotenv()
+
+MISTRAL_API_KEY = os.getenv('MISTRAL_API_KEY')
+RAG_DATA_DIR = "rag_data"
+LLM_MAX_CONCURRENCY = int(os.getenv('LLM_MAX_CONCURRENCY', '8'))
+# Квота Mistral по токенам в минуту, общая для всех пользователей; 0 - без ограничения
+MISTRAL_TOKENS_PER_MINUTE = int(os.getenv('MISTRAL_TOKENS_PER_MINUTE', '500000'))
+# Источник справочных документов: arxiv или local (офлайн-каталог LOCAL_DOCS_DIR с .txt/.md файлами)
+EXTERNAL_DOCS_BACKEND = os.getenv('EXTERNAL_DOCS_BACKEND', 'arxiv')
+LOCAL_DOCS_DIR = os.getenv('LOCAL_DOCS_DIR', 'local_docs')
+EXTERNAL_DOCS_TIMEOUT = float(os.getenv('EXTERNAL_DOCS_TIMEOUT', '15'))
+EXTERNAL_DOCS_CACHE_TTL = float(os.getenv('EXTERNAL_DOCS_CACHE_TTL', str(7 * 24 * 3600)))
+# Режим поиска по rag_data: hybrid (фильтр по теме/сложности, BM25 + вектор) или vector (query engine llama_index)
+RETRIEVAL_MODE = os.getenv('RETRIEVAL_MODE', 'hybrid')
+# Хранилище эмбеддингов: memory (индекс llama_index в памяти) или mmap (float16/int8 массив на диске, только hybrid)
+VECTOR_BACKEND = os.getenv('VECTOR_BACKEND', 'memory')
+EMBEDDING_DTYPE = os.getenv('EMBEDDING_DTYPE', 'float16')
+# Семантический кеш ответов get_detailed_answer и check_answer_correctness
+RESPONSE_CACHE_ENABLED = os.getenv('RESPONSE_CACHE', '1') == '1'
+RESPONSE_CACHE_THRESHOLD = float(os.getenv('RESPONSE_CACHE_THRESHOLD', '0.92'))
+RESPONSE_CACHE_TTL = float(os.getenv('RESPONSE_CACHE_TTL', str(7 * 24 * 3600)))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv('RESPONSE_CACHE_MAX_ENTRIES', '5000'))
+# Эталонные ответы из строк rag_data для сгенерированных вопросов, совпадающих с вопросами датасетов
+DATASET_ANSWERS_ENABLED = os.getenv('DATASET_ANSWERS', '1') == '1'
+# Сколько кандидатов (из пула или сгенерированных) можно отбросить как повторы на один вопрос
+MAX_QUESTION_ATTEMPTS = int(os.getenv('MAX_QUESTION_ATTEMPTS', '3'))
+# Сколько раз перезапрашивать вопрос, если модель вернула невалидный JSON
+QUESTION_FORMAT_ATTEMPTS = int(os.getenv('QUESTION_FORMAT_ATTEMPTS', '2'))
+# Сколько последних заданных вопросов передается модели как исключения
+EXCLUDED_QUESTIONS_LIMIT = 20
+# Бюджет на одно сообщение пользователя (в batch.py - на одну запись), общий для всех вызовов Mistral:
+# число повторов и время, в течение которого повтор еще может начаться
+RETRY_BUDGET = int(os.getenv('RETRY_BUDGET', '4'))
+RETRY_TIME_BUDGET = float(os.getenv('RETRY_TIME_BUDGET', '30'))
+# Попыток на один вызов Mistral (внутри бюджета)
+LLM_MAX_ATTEMPTS = int(os.getenv('LLM_MAX_ATTEMPTS', '3'))
+# Сколько ошибок подряд размыкают Mistral или arxiv и на сколько секунд запросы к ним приостанавливаются
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv('CIRCUIT_FAILURE_THRESHOLD', '5'))
+CIRCUIT_RESET_TIMEOUT = float(os.getenv('CIRCUIT_RESET_TIMEOUT', '30'))
+
+configure_retry_budget(RETRY_BUDGET, RETRY_TIME_BUDGET)
+
+
+def create_rag_agent(**rag_options):
+    """RagAgent с настройками из окружения; rag_options переопределяют их (например, response_cache=None
+    или rebuild_index=True)"""
+    if not MISTRAL_API_KEY:
+        raise ValueError("MISTRAL_API_KEY не найден в .env файле")
+    options = dict(max_concurrency=LLM_MAX_CONCURRENCY, tokens_per_minute=MISTRAL_TOKENS_PER_MINUTE,
+                   docs_timeout=EXTERNAL_DOCS_TIMEOUT,
+                   retrieval_mode=RETRIEVAL_MODE, vector_backend=VECTOR_BACKEND, embedding_dtype=EMBEDDING_DTYPE,
+                   dataset_answers=DATASET_ANSWERS_ENABLED, llm_max_attempts=LLM_MAX_ATTEMPTS,
+                   circuit_failure_threshold=CIRCUIT_FAILURE_THRESHOLD,
+                   circuit_reset_timeout=CIRCUIT_RESET_TIMEOUT)
+    options.update(rag_options)
+    if "docs_backend" not in options:
+        options["docs_backend"] = create_docs_backend(EXTERNAL_DOCS_BACKEND, LOCAL_DOCS_DIR,
+                                                      ttl_seconds=EXTERNAL_DOCS_CACHE_TTL)
+    if "response_cache" not in options:
+        options["response_cache"] = SemanticCache(
+            threshold=RESPONSE_CACHE_THRESHOLD, ttl_seconds=RESPONSE_CACHE_TTL,
+            max_entries=RESPONSE_CACHE_MAX_ENTRIES
+        ) if RESPONSE_CACHE_ENABLED else None
+    started = time.monotonic()
+    # llama_index, langchain и mistralai импортируются несколько секунд, поэтому не на уровне модуля
+    from src.rag_agent import RagAgent
+    record_startup("import_rag_agent", time.monotonic() - started)
+    started = time.monotonic()
+    agent = RagAgent(RAG_DATA_DIR, MISTRAL_API_KEY, **options)
+    record_startup("rag_agent", time.monotonic() - started)
+    return agent
+
+
+async def get_question_reliable(rag_agent, profile, message_history="", exclude=()):
+    """Ошибки сети и Mistral повторяются внутри RagAgent; здесь перезапрашивается только ответ модели
+    в неверном формате"""
+    for attempt in range(1, QUESTION_FORMAT_ATTEMPTS + 1):
+        try:
+            return await rag_agent.get_next_interview_question(profile, message_history=message_history,
+                                                               exclude=exclude)
+        except (ValueError, KeyError, TypeError) as e:
+            if attempt == QUESTION_FORMAT_ATTEMPTS:
+                raise
+            record_retry("question_format", attempt, e)
@@ -0,0 +1,84 @@
+import hashlib
+import os
+
+import numpy as np
+
+from src.asked_questions import normalize_question
+from src.embedding_store import EmbeddingStore
+from src.ingestion import is_placeholder_answer, iter_directory_records
+
+DEFAULT_LOOKUP_PATH = os.path.join("storage", "answer_lookup")
+
+
+class DatasetAnswerLookup:
+    """Эталонные ответы из строк rag_data: точный поиск по нормализованному тексту вопроса,
+    при промахе - ближайший сосед по эмбеддингам вопросов"""
+
+    def __init__(self, answers: dict[str, str], by_question: dict[str, str], store: EmbeddingStore | None,
+                 embed_model=None, threshold: float = 0.9):
+        # answers: doc_id -> ответ; by_question: нормализованный вопрос -> doc_id
+        self._answers = answers
+        self._by_question = by_question
+        self._store = store
+        self._embed_model = embed_model
+        self.threshold = threshold
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._answers)
+
+    @staticmethod
+    def _records(data_dir: str) -> list:
+        # Заглушку вместо ответа нельзя отдавать как эталон: по ней оценивался бы ответ кандидата
+        return [record for record in iter_directory_records(data_dir) if not is_placeholder_answer(record.answer)]
+
+    @staticmethod
+    def _digest(records: list) -> str:
+        return hashlib.sha256("\n".join(f"{record.doc_id}\t{record.question}" for record in records)
+                              .encode("utf-8")).hexdigest()
+
+    @classmethod
+    def _is_current(cls, records: list, path: str, dtype: str) -> bool:
+        meta = EmbeddingStore.read_meta(path)
+        return meta is not None and meta.get("source_digest") == cls._digest(records) and meta.get("dtype") == dtype
+
+    @classmethod
+    def is_current(cls, data_dir: str, path: str = DEFAULT_LOOKUP_PATH, dtype: str = "float16") -> bool:
+        """Эмбеддинги вопросов на диске соответствуют rag_data"""
+        records = cls._records(data_dir)
+        return not records or cls._is_current(records, path, dtype)
+
+    @classmethod
+    def load_or_build(cls, data_dir: str, embed_model=None, path: str = DEFAULT_LOOKUP_PATH,
+                      threshold: float = 0.9, dtype: str = "float16") -> "DatasetAnswerLookup":
+        records = cls._records(data_dir)
+        answers = {record.doc_id: record.answer for record in records}
+        by_question = {normalize_question(record.question): record.doc_id for record in records}
+        if embed_model is None or not records:
+            return cls(answers, by_question, None, threshold=threshold)
+
+        if not cls._is_current(records, path, dtype):
+            print(f"Считаю эмбеддинги {len(records)} вопросов датасетов для поиска эталонных ответов")
+            embeddings = embed_model.get_text_embedding_batch([record.question for record in records])
+            EmbeddingStore.write(path, [record.doc_id for record in records], np.asarray(embeddings), dtype,
+                                 extra_meta={"source_digest": cls._digest(records)})
+        return cls(answers, by_question, EmbeddingStore.open(path), embed_model, threshold)
+
+    def find(self, question: str) -> str | None:
+        """Эталонный ответ датасета на вопрос или None"""
+        doc_id = self._by_question.get(normalize_question(question))
+        if doc_id is not None:
+            self.exact_hits += 1
+            return self._answers[doc_id]
+        if self._store is not None:
+            rows, scores = self._store.search(self._embed_model.get_text_embedding(question), 1)
+            if len(rows) and scores[0] >= self.threshold:
+                self.semantic_hits += 1
+                return self._answers[self._store.node_ids[rows[0]]]
+        self.misses += 1
+        return None
+
+    def stats(self) -> dict:
+        return {"exact_hits": self.exact_hits, "semantic_hits": self.semantic_hits, "misses": self.misses}
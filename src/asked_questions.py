@@ -0,0 +1,88 @@
+import base64
+import re
+
+import numpy as np
+
+_PUNCTUATION = re.compile(r"[^\w\s]")
+_SPACES = re.compile(r"\s+")
+
+
+def normalize_question(text: str) -> str:
+    """Нормализация текста вопроса для точного сравнения: регистр, пунктуация, пробелы"""
+    text = _PUNCTUATION.sub(" ", text.lower())
+    return _SPACES.sub(" ", text).strip()
+
+
+class AskedQuestionIndex:
+    """Заданные в сессии вопросы: поиск точных повторов по хешу и перефразировок по эмбеддингам"""
+
+    def __init__(self, threshold: float = 0.9):
+        self.threshold = threshold
+        self.questions: list[str] = []
+        self._keys: set[str] = set()
+        # Эмбеддинги есть не у всех вопросов: храним номер вопроса для каждой строки матрицы
+        self._vectors: list[np.ndarray] = []
+        self._vector_owners: list[int] = []
+        self._matrix = None
+
+    def __len__(self) -> int:
+        return len(self.questions)
+
+    def __iter__(self):
+        return iter(self.questions)
+
+    def __contains__(self, question) -> bool:
+        return isinstance(question, str) and normalize_question(question) in self._keys
+
+    @staticmethod
+    def _unit(embedding) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def find_duplicate(self, question: str, embedding=None) -> str | None:
+        """Уже заданный вопрос, совпадающий с question или близкий к нему по смыслу"""
+        if question in self:
+            return question
+        if embedding is None or not self._vectors:
+            return None
+        if self._matrix is None:
+            self._matrix = np.vstack(self._vectors)
+        similarities = self._matrix @ self._unit(embedding)
+        best = int(np.argmax(similarities))
+        if similarities[best] >= self.threshold:
+            return self.questions[self._vector_owners[best]]
+        return None
+
+    def add(self, question: str, embedding=None) -> None:
+        self.questions.append(question)
+        self._keys.add(normalize_question(question))
+        if embedding is not None:
+            self._vectors.append(self._unit(embedding))
+            self._vector_owners.append(len(self.questions) - 1)
+            self._matrix = None
+
+    def to_dict(self) -> dict:
+        # Эмбеддинги в float16: для поиска повторов точности хватает, а сессия занимает вдвое меньше
+        vectors = np.vstack(self._vectors).astype(np.float16) if self._vectors else np.empty((0, 0), np.float16)
+        return {
+            "threshold": self.threshold,
+            "questions": self.questions,
+            "vector_owners": self._vector_owners,
+            "dim": int(vectors.shape[1]),
+            "vectors": base64.b64encode(vectors.tobytes()).decode("ascii"),
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "AskedQuestionIndex":
+        index = cls(data["threshold"])
+        for question in data["questions"]:
+            index.add(question)
+        if data["vector_owners"]:
+            vectors = np.frombuffer(base64.b64decode(data["vectors"]), dtype=np.float16)
+            index._vectors = list(vectors.reshape(-1, data["dim"]).astype(np.float32))
+            index._vector_owners = list(data["vector_owners"])
+        return index
+
+    def recent(self, limit: int) -> list[str]:
+        return self.questions[-limit:] if limit > 0 else []
@@ -0,0 +1,118 @@
+import json
+import os
+
+import numpy as np
+
+VECTORS_NAME = "vectors.npy"
+SCALES_NAME = "scales.npy"
+META_NAME = "meta.json"
+SUPPORTED_DTYPES = ("float32", "float16", "int8")
+
+
+def _normalize(embeddings: np.ndarray) -> np.ndarray:
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return embeddings / np.where(norms == 0, 1, norms)
+
+
+def quantize(embeddings: np.ndarray, dtype: str) -> tuple[np.ndarray, np.ndarray | None]:
+    """Нормированные векторы в заданном типе; для int8 - еще масштаб каждой строки"""
+    if dtype not in SUPPORTED_DTYPES:
+        raise ValueError(f"Неподдерживаемый тип эмбеддингов: {dtype}")
+    embeddings = _normalize(embeddings)
+    if dtype != "int8":
+        return embeddings.astype(dtype), None
+    scales = np.abs(embeddings).max(axis=1) / 127.0
+    scales = np.where(scales == 0, 1, scales).astype(np.float32)
+    return np.round(embeddings / scales[:, None]).astype(np.int8), scales
+
+
+class EmbeddingStore:
+    """Эмбеддинги узлов в непрерывном массиве NumPy; с диска открываются через memory map только для чтения,
+    так что несколько процессов делят одну копию в page cache"""
+
+    def __init__(self, node_ids: list[str], vectors: np.ndarray, scales: np.ndarray | None = None,
+                 meta: dict | None = None, batch_size: int = 8192):
+        self.node_ids = node_ids
+        self.meta = meta or {}
+        self._vectors = vectors
+        self._scales = scales
+        self._batch_size = batch_size
+
+    def __len__(self) -> int:
+        return len(self.node_ids)
+
+    @property
+    def dtype(self) -> str:
+        return str(self._vectors.dtype)
+
+    @classmethod
+    def from_embeddings(cls, node_ids: list[str], embeddings: np.ndarray, dtype: str = "float32") -> "EmbeddingStore":
+        vectors, scales = quantize(embeddings, dtype)
+        return cls(list(node_ids), vectors, scales)
+
+    @staticmethod
+    def write(path: str, node_ids: list[str], embeddings: np.ndarray, dtype: str = "float16",
+              extra_meta: dict | None = None) -> None:
+        vectors, scales = quantize(embeddings, dtype)
+        os.makedirs(path, exist_ok=True)
+        # Сначала во временные файлы: процессы, уже открывшие старый memory map, продолжают с ним работать
+        for name, array in ((VECTORS_NAME, vectors), (SCALES_NAME, scales)):
+            target = os.path.join(path, name)
+            if array is None:
+                if os.path.exists(target):
+                    os.remove(target)
+                continue
+            with open(target + ".tmp", "wb") as f:
+                np.save(f, array)
+            os.replace(target + ".tmp", target)
+        meta = {"dtype": dtype, "dim": int(vectors.shape[1]) if vectors.ndim == 2 else 0,
+                "node_ids": list(node_ids), **(extra_meta or {})}
+        with open(os.path.join(path, META_NAME + ".tmp"), "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(os.path.join(path, META_NAME + ".tmp"), os.path.join(path, META_NAME))
+
+    @staticmethod
+    def read_meta(path: str) -> dict | None:
+        meta_path = os.path.join(path, META_NAME)
+        if not os.path.exists(meta_path):
+            return None
+        with open(meta_path, encoding="utf-8") as f:
+            return json.load(f)
+
+    @classmethod
+    def open(cls, path: str) -> "EmbeddingStore":
+        meta = cls.read_meta(path)
+        if meta is None:
+            raise FileNotFoundError(f"Хранилище эмбеддингов не найдено: {path}")
+        vectors = np.load(os.path.join(path, VECTORS_NAME), mmap_mode="r")
+        scales = None
+        if meta["dtype"] == "int8":
+            scales = np.load(os.path.join(path, SCALES_NAME), mmap_mode="r")
+        return cls(meta.pop("node_ids"), vectors, scales, meta)
+
+    def similarities(self, query, rows: np.ndarray | None = None) -> np.ndarray:
+        """Косинусная близость запроса к строкам rows (или ко всем), батчами фиксированного размера"""
+        query = _normalize(np.asarray(query, dtype=np.float32)[None, :])[0]
+        total = len(self) if rows is None else len(rows)
+        result = np.empty(total, dtype=np.float32)
+        for start in range(0, total, self._batch_size):
+            stop = min(start + self._batch_size, total)
+            index = slice(start, stop) if rows is None else rows[start:stop]
+            block = np.asarray(self._vectors[index], dtype=np.float32)
+            scores = block @ query
+            if self._scales is not None:
+                scores *= self._scales[index]
+            result[start:stop] = scores
+        return result
+
+    def search(self, query, top_k: int, rows: np.ndarray | None = None) -> tuple[np.ndarray, np.ndarray]:
+        """Номера строк и оценки top_k ближайших векторов"""
+        scores = self.similarities(query, rows)
+        top_k = min(top_k, len(scores))
+        if top_k == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        best = np.argpartition(-scores, top_k - 1)[:top_k]
+        best = best[np.argsort(-scores[best], kind="stable")]
+        found = best if rows is None else np.asarray(rows)[best]
+        return found, scores[best]
@@ -0,0 +1,142 @@
+import json
+from abc import ABC, abstractmethod
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from src.asked_questions import normalize_question
+
+DEFAULT_CACHE_PATH = os.path.join("storage", "external_docs.sqlite")
+_WORD = re.compile(r"\w+")
+
+
+class ExternalDocsBackend(ABC):
+    """Источник справочных текстов для get_detailed_answer"""
+    name = "base"
+
+    @abstractmethod
+    def search(self, query: str) -> list[str]:
+        """Справочные тексты по запросу; вызывается из пула потоков"""
+
+
+class ArxivDocsBackend(ExternalDocsBackend):
+    """Поиск статей на arxiv"""
+    name = "arxiv"
+
+    def __init__(self, load_max_docs: int = 2):
+        # langchain_community импортируется долго, поэтому только когда источник действительно создается
+        from langchain_community.retrievers import ArxivRetriever
+        self._retriever = ArxivRetriever(load_max_docs=load_max_docs)
+
+    def search(self, query: str) -> list[str]:
+        return [doc.page_content for doc in self._retriever.invoke(query)]
+
+
+class LocalDocsBackend(ExternalDocsBackend):
+    """Офлайн-замена arxiv: поиск по абзацам текстовых файлов локального каталога"""
+    name = "local"
+
+    def __init__(self, docs_dir: str, max_docs: int = 2):
+        self._max_docs = max_docs
+        self._paragraphs = []
+        for root, _, files in os.walk(docs_dir):
+            for file_name in sorted(files):
+                if not file_name.endswith((".txt", ".md")):
+                    continue
+                with open(os.path.join(root, file_name), encoding="utf-8", errors="ignore") as f:
+                    for paragraph in re.split(r"\n\s*\n", f.read()):
+                        paragraph = paragraph.strip()
+                        if paragraph:
+                            self._paragraphs.append((paragraph, set(_WORD.findall(paragraph.lower()))))
+
+    def search(self, query: str) -> list[str]:
+        query_words = set(_WORD.findall(query.lower()))
+        if not query_words:
+            return []
+        scored = [(len(query_words & words), paragraph) for paragraph, words in self._paragraphs]
+        scored = [item for item in scored if item[0] > 0]
+        scored.sort(key=lambda item: item[0], reverse=True)
+        return [paragraph for _, paragraph in scored[:self._max_docs]]
+
+
+class CachedDocsBackend(ExternalDocsBackend):
+    """Дисковый кеш поверх другого источника: ключ - нормализованный запрос, TTL и LRU-вытеснение"""
+
+    def __init__(self, backend: ExternalDocsBackend, path: str = DEFAULT_CACHE_PATH,
+                 ttl_seconds: float = 7 * 24 * 3600, max_entries: int = 2000):
+        self.backend = backend
+        self.name = backend.name
+        self._ttl = ttl_seconds
+        self._max_entries = max_entries
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # search вызывается из пула потоков RagAgent, доступ к соединению защищен блокировкой
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        # WAL: файл пишут несколько процессов-обработчиков (start.py --workers)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS docs_cache ("
+            "key TEXT PRIMARY KEY, docs TEXT NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._db.commit()
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, query: str) -> str:
+        return f"{self.backend.name}:{normalize_question(query)}"
+
+    def _get(self, key: str) -> list[str] | None:
+        now = time.time()
+        with self._lock:
+            row = self._db.execute("SELECT docs, created FROM docs_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if now - row[1] > self._ttl:
+                self._db.execute("DELETE FROM docs_cache WHERE key = ?", (key,))
+                self._db.commit()
+                return None
+            self._db.execute("UPDATE docs_cache SET accessed = ? WHERE key = ?", (now, key))
+            self._db.commit()
+        return json.loads(row[0])
+
+    def _put(self, key: str, docs: list[str]) -> None:
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO docs_cache (key, docs, created, accessed) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(docs, ensure_ascii=False), now, now)
+            )
+            self._db.execute(
+                "DELETE FROM docs_cache WHERE key IN ("
+                "SELECT key FROM docs_cache ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+                (self._max_entries,)
+            )
+            self._db.commit()
+
+    def search(self, query: str) -> list[str]:
+        key = self._key(query)
+        docs = self._get(key)
+        if docs is not None:
+            self.hits += 1
+            return docs
+        self.misses += 1
+        docs = self.backend.search(query)
+        self._put(key, docs)
+        return docs
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / lookups if lookups else 0.0}
+
+
+def create_docs_backend(kind: str = "arxiv", local_dir: str = "", cache_path: str = DEFAULT_CACHE_PATH,
+                        ttl_seconds: float = 7 * 24 * 3600, max_entries: int = 2000) -> ExternalDocsBackend:
+    if kind == "local":
+        backend = LocalDocsBackend(local_dir)
+    elif kind == "arxiv":
+        backend = ArxivDocsBackend(load_max_docs=2)
+    else:
+        raise ValueError(f"Неизвестный источник справочных документов: {kind}")
+    return CachedDocsBackend(backend, cache_path, ttl_seconds=ttl_seconds, max_entries=max_entries)
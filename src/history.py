@@ -0,0 +1,112 @@
+ROLE_LABELS = {"interviewer": "Интервьюер", "candidate": "Кандидат"}
+
+
+def estimate_tokens(text: str) -> int:
+    """Грубая оценка числа токенов (~4 символа на токен) без загрузки токенизатора"""
+    return len(text) // 4 + 1
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    max_chars = max_tokens * 4
+    return text if len(text) <= max_chars else text[:max_chars].rstrip() + "…"
+
+
+def turn_title(turn: dict) -> str | None:
+    """Текст вопроса, если реплика - вопрос интервьюера"""
+    content = turn.get("content")
+    if turn.get("role") == "interviewer" and isinstance(content, dict):
+        return content.get("question")
+    return None
+
+
+def render_turn(turn: dict) -> str:
+    content = turn.get("content")
+    title = turn_title(turn)
+    if title is not None:
+        content = f"Вопрос: {title}"
+    role = ROLE_LABELS.get(turn.get("role"), turn.get("role"))
+    return f"{role}: {content}"
+
+
+class ConversationHistory:
+    """История диалога: последние реплики дословно в пределах бюджета токенов, старые - в сжатом резюме"""
+
+    def __init__(self, budget_tokens: int = 2000, summary_budget_tokens: int = 400, max_titles: int = 30):
+        self.budget_tokens = budget_tokens
+        self.summary_budget_tokens = summary_budget_tokens
+        self.max_titles = max_titles
+        self.turns: list[dict] = []
+        self.summary = ""
+        self.asked_titles: list[str] = []
+        # Вытесненные реплики, которые еще не вошли в резюме
+        self._pending: list[dict] = []
+
+    def __len__(self) -> int:
+        return len(self.turns)
+
+    def __iter__(self):
+        return iter(self.turns)
+
+    def to_dict(self) -> dict:
+        return {
+            "budget_tokens": self.budget_tokens,
+            "summary_budget_tokens": self.summary_budget_tokens,
+            "max_titles": self.max_titles,
+            "turns": self.turns,
+            "summary": self.summary,
+            "asked_titles": self.asked_titles,
+            "pending": self._pending,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "ConversationHistory":
+        history = cls(data["budget_tokens"], data["summary_budget_tokens"], data["max_titles"])
+        history.turns = data["turns"]
+        history.summary = data["summary"]
+        history.asked_titles = data["asked_titles"]
+        history._pending = data["pending"]
+        return history
+
+    def append(self, turn: dict) -> None:
+        self.turns.append(turn)
+        self._trim()
+
+    def _turns_tokens(self, turns) -> int:
+        return sum(estimate_tokens(render_turn(turn)) for turn in turns)
+
+    def _trim(self) -> None:
+        while len(self.turns) > 1 and self._turns_tokens(self.turns) > self.budget_tokens:
+            turn = self.turns.pop(0)
+            title = turn_title(turn)
+            if title:
+                self.asked_titles = (self.asked_titles + [title])[-self.max_titles:]
+            self._pending.append(turn)
+        # Если резюмирование недоступно, очередь не должна расти бесконечно
+        while len(self._pending) > 1 and self._turns_tokens(self._pending) > self.budget_tokens:
+            self._pending.pop(0)
+
+    async def compact(self, summarize) -> None:
+        """Дописать вытесненные реплики в резюме: summarize(previous_summary, new_turns_text) -> str"""
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, []
+        new_turns = "\n".join(render_turn(turn) for turn in pending)
+        try:
+            summary = await summarize(self.summary, new_turns)
+        except Exception as e:
+            print(f"Не удалось обновить резюме истории: {e}")
+            self._pending = pending + self._pending
+            return
+        self.summary = truncate_to_tokens(summary.strip(), self.summary_budget_tokens)
+
+    def render(self) -> str:
+        """Текст истории для промпта, размер ограничен независимо от длины сессии"""
+        parts = []
+        if self.summary:
+            parts.append(f"Краткое резюме начала собеседования: {self.summary}")
+        if self.asked_titles:
+            parts.append("Заданные ранее вопросы: " + "; ".join(self.asked_titles))
+        if self.turns:
+            recent = "\n".join(truncate_to_tokens(render_turn(turn), self.budget_tokens) for turn in self.turns)
+            parts.append(f"Последние реплики:\n{recent}")
+        return "\n\n".join(parts)
@@ -0,0 +1,165 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+from llama_index import SimpleDirectoryReader, StorageContext, VectorStoreIndex, load_index_from_storage
+from llama_index.ingestion import run_transformations
+from llama_index.storage.docstore import SimpleDocumentStore
+
+from src.embedding_store import EmbeddingStore
+from src.ingestion import documents_digest, load_directory_documents
+
+DEFAULT_PERSIST_DIR = os.path.join("storage", "index")
+MANIFEST_NAME = "manifest.json"
+# Версия 2: построчная загрузка CSV, отпечаток считается по документам файла
+MANIFEST_VERSION = 2
+EMBEDDINGS_DIR_NAME = "embeddings"
+
+
+def list_source_files(data_dir: str) -> list[str]:
+    return sorted(
+        os.path.join(data_dir, name)
+        for name in os.listdir(data_dir)
+        if not name.startswith(".") and os.path.isfile(os.path.join(data_dir, name))
+    )
+
+
+def load_source_documents(data_dir: str) -> dict[str, list]:
+    """Документы по файлам: CSV построчно в общей схеме, остальные файлы целиком"""
+    documents = load_directory_documents(data_dir)
+    for path in list_source_files(data_dir):
+        name = os.path.basename(path)
+        if not name.lower().endswith(".csv"):
+            documents[name] = SimpleDirectoryReader(input_files=[path], filename_as_id=True).load_data()
+    return documents
+
+
+def _read_manifest(persist_dir: str) -> dict:
+    path = os.path.join(persist_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get("version") != MANIFEST_VERSION:
+        return {}
+    return manifest
+
+
+def load_manifest(persist_dir: str) -> dict:
+    return _read_manifest(persist_dir).get("files", {})
+
+
+def save_manifest(persist_dir: str, files: dict, nodes: str) -> None:
+    os.makedirs(persist_dir, exist_ok=True)
+    path = os.path.join(persist_dir, MANIFEST_NAME)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"version": MANIFEST_VERSION, "files": files, "nodes_digest": nodes}, f, ensure_ascii=False,
+                  indent=2)
+    os.replace(tmp_path, path)
+
+
+def manifest_digest(files: dict) -> str:
+    digests = sorted((name, entry["sha256"]) for name, entry in files.items())
+    return hashlib.sha256(json.dumps(digests).encode("utf-8")).hexdigest()
+
+
+def nodes_digest(node_ids) -> str:
+    """Отпечаток набора узлов docstore: после полной пересборки те же документы получают новые id узлов"""
+    return hashlib.sha256("\n".join(sorted(node_ids)).encode("utf-8")).hexdigest()
+
+
+def embeddings_path(persist_dir: str) -> str:
+    return os.path.join(persist_dir, EMBEDDINGS_DIR_NAME)
+
+
+def embeddings_are_current(persist_dir: str, files: dict, dtype: str) -> bool:
+    """Выгруженные эмбеддинги построены по тем же файлам и тем же узлам docstore, что и индекс на диске"""
+    meta = EmbeddingStore.read_meta(embeddings_path(persist_dir))
+    nodes = _read_manifest(persist_dir).get("nodes_digest")
+    return meta is not None and meta.get("dtype") == dtype and meta.get("source_digest") == manifest_digest(files) \
+        and nodes is not None and meta.get("nodes_digest") == nodes
+
+
+def export_embeddings(index: VectorStoreIndex, persist_dir: str, files: dict, dtype: str) -> None:
+    """Выгрузка эмбеддингов индекса в компактный массив для memory map"""
+    node_ids = list(index.docstore.docs.keys())
+    embeddings = np.asarray([index.vector_store.get(node_id) for node_id in node_ids], dtype=np.float32)
+    EmbeddingStore.write(embeddings_path(persist_dir), node_ids, embeddings, dtype,
+                         extra_meta={"source_digest": manifest_digest(files), "nodes_digest": nodes_digest(node_ids)})
+    print(f"Эмбеддинги ({dtype}) выгружены в {embeddings_path(persist_dir)}")
+
+
+def index_is_current(data_dir: str, persist_dir: str = DEFAULT_PERSIST_DIR, embedding_dtype: str | None = None) -> bool:
+    """Индекс на диске соответствует rag_data (и, если задан тип, выгруженные эмбеддинги тоже)"""
+    manifest = load_manifest(persist_dir)
+    if not manifest:
+        return False
+    documents = load_source_documents(data_dir)
+    if {name: documents_digest(docs) for name, docs in documents.items()} != \
+            {name: entry["sha256"] for name, entry in manifest.items()}:
+        return False
+    return embedding_dtype is None or embeddings_are_current(persist_dir, manifest, embedding_dtype)
+
+
+def load_embedding_store(persist_dir: str = DEFAULT_PERSIST_DIR) -> tuple[SimpleDocumentStore, EmbeddingStore]:
+    """Узлы и memory-mapped эмбеддинги без загрузки векторного хранилища llama_index в память"""
+    return SimpleDocumentStore.from_persist_dir(persist_dir), EmbeddingStore.open(embeddings_path(persist_dir))
+
+
+def load_or_build_index(data_dir: str, service_context, persist_dir: str = DEFAULT_PERSIST_DIR,
+                        rebuild: bool = False, embedding_dtype: str | None = None) -> VectorStoreIndex:
+    """Загрузка индекса с диска, переэмбеддинг только добавленных/измененных файлов"""
+    manifest = {} if rebuild else load_manifest(persist_dir)
+    index = None
+    if manifest:
+        try:
+            storage_context = StorageContext.from_defaults(persist_dir=persist_dir)
+            index = load_index_from_storage(storage_context, service_context=service_context)
+        except Exception as e:
+            print(f"Не удалось загрузить индекс из {persist_dir}, строю заново: {e}")
+            manifest = {}
+    if index is None:
+        index = VectorStoreIndex([], service_context=service_context)
+
+    # Разбор CSV дешевый, дорогое только эмбеддинг: переэмбеддим файлы, чьи документы изменились
+    documents = load_source_documents(data_dir)
+    digests = {name: documents_digest(docs) for name, docs in documents.items()}
+    changed = False
+
+    for name in list(manifest):
+        if digests.get(name) == manifest[name]["sha256"]:
+            continue
+        print(f"Удаляю из индекса устаревший файл {name}")
+        for doc_id in manifest.pop(name)["doc_ids"]:
+            index.delete_ref_doc(doc_id, delete_from_docstore=True)
+        changed = True
+
+    for name, digest in digests.items():
+        if name in manifest:
+            continue
+        print(f"Добавляю в индекс файл {name}")
+        docs = documents[name]
+        # Узлы всего файла вставляются одним пакетом, чтобы эмбеддинги считались батчами
+        index.insert_nodes(run_transformations(docs, service_context.transformations))
+        for doc in docs:
+            index.docstore.set_document_hash(doc.get_doc_id(), doc.hash)
+        manifest[name] = {"sha256": digest, "doc_ids": [doc.doc_id for doc in docs]}
+        changed = True
+
+    nodes = nodes_digest(index.docstore.docs.keys())
+    if changed:
+        index.storage_context.persist(persist_dir=persist_dir)
+        save_manifest(persist_dir, manifest, nodes)
+        print(f"Индекс сохранен в {persist_dir}")
+    else:
+        print(f"Индекс загружен из {persist_dir} без изменений")
+        if _read_manifest(persist_dir).get("nodes_digest") != nodes:
+            # Манифест, записанный до появления отпечатка узлов
+            save_manifest(persist_dir, manifest, nodes)
+
+    if embedding_dtype is not None and (changed or not embeddings_are_current(persist_dir, manifest, embedding_dtype)):
+        export_embeddings(index, persist_dir, manifest, embedding_dtype)
+
+    return index
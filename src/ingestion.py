@@ -0,0 +1,181 @@
+import csv
+import hashlib
+import os
+import re
+from dataclasses import asdict, dataclass
+
+from llama_index import Document
+
+from src.asked_questions import normalize_question
+
+# Колонки исходных CSV, из которых заполняется каждое поле общей схемы
+COLUMN_ALIASES = {
+    "question": ("question",),
+    "answer": ("answer",),
+    "difficulty": ("difficulty",),
+    "category": ("category", "topic"),
+    "role": ("role",),
+}
+
+# Значения по умолчанию для файлов, в которых нет соответствующих колонок
+SOURCE_DEFAULTS = {
+    "1170_data_science_concepts.csv": {"category": "Data Science"},
+    "dataset.csv": {"category": "Machine Learning"},
+}
+
+DIFFICULTY_ALIASES = {
+    "easy": "easy", "dễ": "easy", "👶": "easy",
+    "medium": "medium", "trung bình": "medium", "⭐": "medium",
+    "hard": "hard", "khó": "hard", "🚀": "hard",
+}
+
+CATEGORY_ALIASES = {"General Program": "General Programming"}
+ROLE_ALIASES = {"Cả hai": "Any"}
+
+DEFAULT_LANGUAGES = ("en", "ru")
+
+# Заглушки вместо ответа в строках датасетов (dataset.csv: "Answer here"); такие ответы считаются пустыми
+PLACEHOLDER_ANSWERS = {"", "-", "answer here", "n/a", "tbd", "todo"}
+
+# UTF-8, ошибочно прочитанный как latin-1: "itâ\x80\x99s" -> "it’s", "ð\x9f\x91¶" -> "👶"
+_MOJIBAKE = re.compile(r"[\xc2-\xf4][\x80-\xbf]{1,3}")
+# Эмодзи-метки сложности в конце вопросов dataset.csv
+_DIFFICULTY_MARKS = re.compile(r"[\u200d\ufe0f]*(👶|⭐|🚀)[\u200d\ufe0f]*")
+_SAMPLE_SUFFIX = re.compile(r"\s*\(Sample \d+\)\s*$")
+_VIETNAMESE = re.compile(r"[ăđơưạảấầẩẫậắằẳẵặẹẻẽếềểễệỉịọỏốồổỗộớờởỡợụủứừửữựỳỵỷỹ]")
+_CYRILLIC = re.compile(r"[а-яё]")
+
+
+@dataclass
+class QARecord:
+    """Строка любого датасета rag_data в общей схеме"""
+    question: str
+    answer: str
+    difficulty: str
+    category: str
+    role: str
+    language: str
+    source: str
+    row_id: int
+
+    @property
+    def doc_id(self) -> str:
+        return f"{self.source}:{self.row_id}"
+
+
+def repair_encoding(text: str) -> str:
+    def fix(match):
+        try:
+            return match.group().encode("latin-1").decode("utf-8")
+        except UnicodeDecodeError:
+            return match.group()
+    return _MOJIBAKE.sub(fix, text)
+
+
+def detect_language(text: str) -> str:
+    lowered = text.lower()
+    if _VIETNAMESE.search(lowered):
+        return "vi"
+    if _CYRILLIC.search(lowered):
+        return "ru"
+    return "en"
+
+
+def normalize_difficulty(value: str) -> str:
+    return DIFFICULTY_ALIASES.get(value.strip().lower(), "")
+
+
+def is_placeholder_answer(text: str) -> bool:
+    return text.strip().strip(".").lower() in PLACEHOLDER_ANSWERS
+
+
+def normalize_answer(text: str) -> str:
+    return "" if is_placeholder_answer(text) else text
+
+
+def _pick(row: dict, field: str) -> str:
+    for alias in COLUMN_ALIASES[field]:
+        value = row.get(alias)
+        if value:
+            return value.strip()
+    return ""
+
+
+def iter_records(path: str):
+    """Потоковое чтение CSV: одна запись QARecord на строку с вопросом"""
+    source = os.path.basename(path)
+    defaults = SOURCE_DEFAULTS.get(source, {})
+    with open(path, encoding="utf-8", errors="replace", newline="") as f:
+        reader = csv.DictReader(f)
+        reader.fieldnames = [name.strip().lower() for name in reader.fieldnames or []]
+        for row_id, row in enumerate(reader, start=1):
+            question = repair_encoding(_pick(row, "question"))
+            if not question:
+                continue
+            difficulty = normalize_difficulty(_pick(row, "difficulty"))
+            marks = _DIFFICULTY_MARKS.findall(question)
+            if marks and not difficulty:
+                difficulty = normalize_difficulty(marks[-1])
+            question = _SAMPLE_SUFFIX.sub("", _DIFFICULTY_MARKS.sub(" ", question)).strip()
+            answer = normalize_answer(repair_encoding(_pick(row, "answer")))
+            category = _pick(row, "category") or defaults.get("category", "")
+            role = _pick(row, "role") or defaults.get("role", "")
+            yield QARecord(
+                question=question,
+                answer=answer,
+                difficulty=difficulty,
+                category=CATEGORY_ALIASES.get(category, category),
+                role=ROLE_ALIASES.get(role, role),
+                language=detect_language(question + " " + answer),
+                source=source,
+                row_id=row_id,
+            )
+
+
+def iter_directory_records(data_dir: str, languages=DEFAULT_LANGUAGES):
+    """Записи всех CSV каталога без повторов вопросов между датасетами"""
+    seen = set()
+    for name in sorted(os.listdir(data_dir)):
+        if not name.lower().endswith(".csv"):
+            continue
+        for record in iter_records(os.path.join(data_dir, name)):
+            if languages and record.language not in languages:
+                continue
+            key = normalize_question(record.question)
+            if key in seen:
+                continue
+            seen.add(key)
+            yield record
+
+
+def record_to_document(record: QARecord) -> Document:
+    text = f"Question: {record.question}"
+    if record.answer:
+        text += f"\nAnswer: {record.answer}"
+    metadata = asdict(record)
+    del metadata["question"], metadata["answer"]
+    return Document(
+        text=text,
+        doc_id=record.doc_id,
+        metadata=metadata,
+        excluded_embed_metadata_keys=["language", "source", "row_id"],
+        excluded_llm_metadata_keys=["language", "source", "row_id"],
+    )
+
+
+def load_directory_documents(data_dir: str, languages=DEFAULT_LANGUAGES) -> dict[str, list[Document]]:
+    """Документы rag_data, сгруппированные по исходному файлу"""
+    documents = {}
+    for record in iter_directory_records(data_dir, languages):
+        documents.setdefault(record.source, []).append(record_to_document(record))
+    return documents
+
+
+def documents_digest(documents: list[Document]) -> str:
+    """Отпечаток набора документов файла: меняется и при правке файла, и при смене дедупликации"""
+    sha = hashlib.sha256()
+    for doc in documents:
+        sha.update(doc.doc_id.encode("utf-8"))
+        sha.update(doc.text.encode("utf-8"))
+        sha.update(repr(sorted(doc.metadata.items())).encode("utf-8"))
+    return sha.hexdigest()
@@ -0,0 +1,17 @@
+from dataclasses import dataclass
+
+
+@dataclass(frozen=True)
+class InterviewProfile:
+    """Параметры собеседования одной сессии, передаются в каждый вызов RagAgent"""
+    name: str = ""
+    interview_scope: str = "Data Science"
+    difficulty: str = "Junior"
+
+    @classmethod
+    def from_user_data(cls, user_data: dict) -> "InterviewProfile":
+        return cls(
+            name=user_data.get('name', ''),
+            interview_scope=user_data.get('position', 'Data Science'),
+            difficulty=user_data.get('level', 'Junior')
+        )
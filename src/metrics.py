@@ -0,0 +1,280 @@
+import asyncio
+import contextvars
+import json
+import sys
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Callable
+
+from aiohttp import web
+
+# Границы корзин гистограмм длительности, секунды
+DEFAULT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 60)
+
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+               for value in labels.values())
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + "}"
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help = help_text
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = tuple(sorted(labels.items()))
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(tuple(sorted(labels.items())), 0)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for key, value in self._values.items():
+            lines.append(f"{self.name}{_format_labels(dict(key))} {value:g}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        # метки -> (счетчики корзин, сумма, количество)
+        self._values: dict[tuple, tuple[list[int], float, int]] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(sorted(labels.items()))
+        counts, total, count = self._values.get(key, ([0] * len(self.buckets), 0.0, 0))
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[i] += 1
+        self._values[key] = (counts, total + value, count + 1)
+
+    def totals(self) -> dict[tuple, tuple[int, float]]:
+        """Количество наблюдений и их сумма по каждому набору меток"""
+        return {key: (count, total) for key, (_, total, count) in self._values.items()}
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total, count) in self._values.items():
+            labels = dict(key)
+            for bound, bucket_count in zip(self.buckets, counts):
+                lines.append(f"{self.name}_bucket{_format_labels({**labels, 'le': f'{bound:g}'})} {bucket_count}")
+            lines.append(f"{self.name}_bucket{_format_labels({**labels, 'le': '+Inf'})} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {total:g}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """Метрики в текстовом формате Prometheus без зависимости от prometheus_client"""
+
+    def __init__(self, prefix: str = "bot"):
+        self.prefix = prefix
+        self._metrics: list = []
+        # Источники готовой статистики (пул вопросов, кеши, сессии): имя -> функция, возвращающая dict
+        self._collectors: dict[str, Callable[[], dict]] = {}
+
+    def counter(self, name: str, help_text: str) -> Counter:
+        metric = Counter(f"{self.prefix}_{name}", help_text)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help_text: str, buckets=DEFAULT_BUCKETS) -> Histogram:
+        metric = Histogram(f"{self.prefix}_{name}", help_text, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def register_collector(self, name: str, stats) -> None:
+        """stats() -> dict: числа становятся gauge, вложенные словари чисел - gauge с меткой key"""
+        self._collectors[name] = stats
+
+    def _render_collector(self, name: str, stats: dict) -> list[str]:
+        lines = []
+        for key, value in stats.items():
+            metric = f"{self.prefix}_{name}_{key}"
+            if isinstance(value, bool) or value is None:
+                continue
+            if isinstance(value, (int, float)):
+                lines += [f"# TYPE {metric} gauge", f"{metric} {value:g}"]
+            elif isinstance(value, dict):
+                lines.append(f"# TYPE {metric} gauge")
+                lines += [f"{metric}{_format_labels({'key': label})} {number:g}"
+                          for label, number in value.items() if isinstance(number, (int, float))]
+        return lines
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines += metric.render()
+        for name, stats in self._collectors.items():
+            try:
+                lines += self._render_collector(name, stats())
+            except Exception as e:
+                print(f"Не удалось собрать метрики {name}: {e}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+STAGE_SECONDS = REGISTRY.histogram("stage_seconds", "Длительность этапов обработки запроса")
+RETRIES = REGISTRY.counter("retries_total", "Повторы вызовов после ошибки")
+LLM_TOKENS = REGISTRY.counter("llm_tokens_total", "Токены запросов к LLM")
+LLM_COST = REGISTRY.counter("llm_cost_usd_total", "Оценка стоимости запросов к LLM в долларах")
+CACHE_LOOKUPS = REGISTRY.counter("cache_lookups_total", "Обращения к кешам")
+
+# Длительность этапов запуска (импорт бота, загрузка агента, время до первого обработанного сообщения)
+STARTUP: dict[str, float] = {}
+_process_started = time.monotonic()
+REGISTRY.register_collector("startup", lambda: {"seconds": STARTUP})
+
+
+def mark_process_start(started: float) -> None:
+    """Момент старта процесса (time.monotonic()), от которого отсчитывается время до первого сообщения"""
+    global _process_started
+    _process_started = started
+
+
+def startup_elapsed() -> float:
+    return time.monotonic() - _process_started
+
+
+def record_startup(stage: str, seconds: float) -> None:
+    STARTUP[stage] = seconds
+    print(f"Запуск, {stage}: {seconds:.2f} с")
+
+# Цена за миллион токенов (входных, выходных), по умолчанию - mistral-small
+_prices = {"prompt": 0.1, "completion": 0.3}
+
+
+def configure_prices(prompt_per_million: float, completion_per_million: float) -> None:
+    _prices.update(prompt=prompt_per_million, completion=completion_per_million)
+
+
+class Trace:
+    """Этапы обработки одного обновления для структурированного лога"""
+
+    def __init__(self, name: str, **fields):
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.fields = fields
+        self.started = time.monotonic()
+        self.spans: list[dict] = []
+        self.tokens = {"prompt": 0, "completion": 0}
+
+    def to_dict(self) -> dict:
+        return {"trace_id": self.trace_id, "name": self.name, **self.fields,
+                "total_ms": round((time.monotonic() - self.started) * 1000, 1),
+                "tokens": self.tokens, "spans": self.spans}
+
+
+_current_trace: contextvars.ContextVar[Trace | None] = contextvars.ContextVar("current_trace", default=None)
+_trace_output = None
+
+
+def configure_trace_log(path: str | None) -> None:
+    """Куда писать трассы запросов (JSON по строке на обновление): путь к файлу, "-" для stdout, None - не писать"""
+    global _trace_output
+    if not path:
+        _trace_output = None
+    elif path == "-":
+        _trace_output = sys.stdout
+    else:
+        _trace_output = open(path, "a", encoding="utf-8", buffering=1)
+
+
+@contextmanager
+def trace(name: str, **fields):
+    """Трасса обработки одного обновления; этапы внутри нее (в том числе в дочерних задачах) попадают в лог"""
+    current = Trace(name, **fields)
+    token = _current_trace.set(current)
+    try:
+        with timed(name):
+            yield current
+    finally:
+        _current_trace.reset(token)
+        if _trace_output is not None:
+            _trace_output.write(json.dumps(current.to_dict(), ensure_ascii=False) + "\n")
+
+
+def record_span(stage: str, seconds: float, status: str = "ok", **fields) -> None:
+    """Длительность этапа, измеренная вызывающим кодом"""
+    STAGE_SECONDS.observe(seconds, stage=stage, status=status)
+    current = _current_trace.get()
+    if current is not None:
+        current.spans.append({"stage": stage, "ms": round(seconds * 1000, 1), "status": status, **fields})
+
+
+@contextmanager
+def timed(stage: str):
+    """Замер этапа: гистограмма bot_stage_seconds{stage, status} и запись в текущую трассу"""
+    started = time.monotonic()
+    status = "ok"
+    try:
+        yield
+    except BaseException as e:
+        status = "cancelled" if isinstance(e, (asyncio.CancelledError, GeneratorExit)) else "error"
+        raise
+    finally:
+        record_span(stage, time.monotonic() - started, status)
+
+
+def record_event(stage: str, **fields) -> None:
+    """Событие без длительности в текущей трассе (попадание в кеш, повтор и т.п.)"""
+    current = _current_trace.get()
+    if current is not None:
+        current.spans.append({"stage": stage, **fields})
+
+
+def record_cache(cache: str, hit: bool) -> None:
+    result = "hit" if hit else "miss"
+    CACHE_LOOKUPS.inc(cache=cache, result=result)
+    record_event(f"cache.{cache}", result=result)
+
+
+def record_retry(operation: str, attempt: int, error: BaseException) -> None:
+    RETRIES.inc(operation=operation)
+    record_event("retry", operation=operation, attempt=attempt, error=type(error).__name__)
+
+
+def record_usage(operation: str, usage) -> None:
+    """Токены из usage ответа Mistral (prompt_tokens / completion_tokens) и оценка стоимости"""
+    if usage is None:
+        return
+    prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+    completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+    LLM_TOKENS.inc(prompt_tokens, operation=operation, type="prompt")
+    LLM_TOKENS.inc(completion_tokens, operation=operation, type="completion")
+    LLM_COST.inc((prompt_tokens * _prices["prompt"] + completion_tokens * _prices["completion"]) / 1e6,
+                 operation=operation)
+    current = _current_trace.get()
+    if current is not None:
+        current.tokens["prompt"] += prompt_tokens
+        current.tokens["completion"] += completion_tokens
+
+
+async def handle_metrics(request: web.Request) -> web.Response:
+    return web.Response(text=REGISTRY.render(), content_type="text/plain", charset="utf-8")
+
+
+async def start_metrics_server(host: str, port: int) -> web.AppRunner | None:
+    """Отдельный HTTP-сервер с GET /metrics (для режима polling и для локального доступа). Если порт занят,
+    бот работает без него: метрики не стоят остановки бота"""
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, host, port).start()
+    except OSError as e:
+        await runner.cleanup()
+        print(f"Предупреждение: сервер метрик на {host}:{port} не запущен: {e}")
+        return None
+    print(f"Метрики доступны на http://{host}:{port}/metrics")
+    return runner
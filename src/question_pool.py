@@ -0,0 +1,150 @@
+import asyncio
+import json
+import os
+from collections import deque
+
+DEFAULT_POOL_PATH = os.path.join("storage", "question_pool.json")
+
+
+def is_valid_question(item) -> bool:
+    """Пул хранит только пары с непустым вопросом и ответом"""
+    if not isinstance(item, dict):
+        return False
+    question = item.get("question")
+    answer = item.get("answer")
+    return (isinstance(question, str) and question.strip() != ""
+            and isinstance(answer, str) and answer.strip() not in ("", "Не удалось получить ответ"))
+
+
+class QuestionPool:
+    """Буфер готовых пар вопрос+ответ для каждой пары (тема, сложность) с фоновым пополнением"""
+
+    def __init__(self, generate, keys, path: str = DEFAULT_POOL_PATH, target_size: int = 5,
+                 low_watermark: int = 2, retry_delay: float = 30.0, attempts_per_item: int = 3):
+        # generate(scope, difficulty, exclude) -> dict с полями question и answer
+        self._generate = generate
+        self._keys = list(keys)
+        self._path = path
+        self._target_size = target_size
+        self._low_watermark = low_watermark
+        self._retry_delay = retry_delay
+        # Невалидный ответ или повтор - не ошибка, но тоже платный запрос: попыток на одно пополнение
+        # не больше target_size * attempts_per_item
+        self._attempts_per_item = attempts_per_item
+        self._buffers = {key: deque() for key in self._keys}
+        self._wanted = set(self._keys)
+        self._refill_event = asyncio.Event()
+        self._dirty = False
+        self.hits = 0
+        self.misses = 0
+        self.generated = 0
+        self.failures = 0
+        self.duplicates = 0
+        self._load()
+
+    def _load(self) -> None:
+        if not os.path.exists(self._path):
+            return
+        try:
+            with open(self._path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Не удалось загрузить пул вопросов из {self._path}: {e}")
+            return
+        for key in self._keys:
+            items = data.get("|".join(key), [])
+            self._buffers[key].extend(item for item in items if is_valid_question(item))
+
+    def save(self) -> None:
+        os.makedirs(os.path.dirname(self._path) or ".", exist_ok=True)
+        data = {"|".join(key): list(buffer) for key, buffer in self._buffers.items()}
+        tmp_path = self._path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, self._path)
+        self._dirty = False
+
+    def take(self, scope: str, difficulty: str, exclude=()) -> dict | None:
+        """Достать вопрос из пула, пропуская уже заданные пользователю"""
+        key = (scope, difficulty)
+        buffer = self._buffers.get(key)
+        if buffer is None:
+            self.misses += 1
+            return None
+
+        found = None
+        for item in buffer:
+            if item["question"] not in exclude:
+                found = item
+                break
+
+        if found is None:
+            self.misses += 1
+        else:
+            buffer.remove(found)
+            self.hits += 1
+            self._dirty = True
+
+        if len(buffer) < self._low_watermark or found is None:
+            self.request_refill(key)
+        return found
+
+    def request_refill(self, key) -> None:
+        if key in self._buffers:
+            self._wanted.add(key)
+            self._refill_event.set()
+
+    def size(self, scope: str, difficulty: str) -> int:
+        return len(self._buffers.get((scope, difficulty), ()))
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "generated": self.generated,
+            "failures": self.failures,
+            "duplicates": self.duplicates,
+            "sizes": {"|".join(key): len(buffer) for key, buffer in self._buffers.items()},
+        }
+
+    async def _fill(self, key) -> None:
+        buffer = self._buffers[key]
+        for _ in range(self._target_size * self._attempts_per_item):
+            if len(buffer) >= self._target_size:
+                return
+            try:
+                item = await self._generate(*key, [existing["question"] for existing in buffer])
+            except Exception as e:
+                self.failures += 1
+                print(f"Не удалось сгенерировать вопрос для пула {key}: {e}")
+                await asyncio.sleep(self._retry_delay)
+                continue
+            if not is_valid_question(item):
+                self.failures += 1
+                await asyncio.sleep(self._retry_delay)
+                continue
+            if any(existing["question"] == item["question"] for existing in buffer):
+                self.duplicates += 1
+                await asyncio.sleep(self._retry_delay)
+                continue
+            buffer.append({"question": item["question"], "answer": item["answer"]})
+            self.generated += 1
+            self.save()
+        if len(buffer) < self._target_size:
+            # Ключ снова попадет в очередь при следующем take
+            print(f"Пул {key} не пополнен до {self._target_size}: закончились попытки")
+
+    async def run(self) -> None:
+        """Фоновый воркер: пополняет пулы, опустившиеся ниже порога"""
+        self._refill_event.set()
+        try:
+            while True:
+                await self._refill_event.wait()
+                self._refill_event.clear()
+                if self._dirty:
+                    self.save()
+                while self._wanted:
+                    await self._fill(self._wanted.pop())
+        finally:
+            if self._dirty:
+                self.save()
@@ -1,26 +1,85 @@
+import asyncio
+import functools
 import json
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 from mistralai import Mistral
-from langchain_community.retrievers import ArxivRetriever
 from langchain_mistralai import ChatMistralAI
 from langchain_community.embeddings import HuggingFaceEmbeddings
 
-from llama_index import VectorStoreIndex, ServiceContext
+from llama_index import ServiceContext
 from llama_index.embeddings import LangchainEmbedding
 
+from src.answer_lookup import DatasetAnswerLookup
+from src.asked_questions import normalize_question
+from src.external_docs import ExternalDocsBackend, create_docs_backend
+from src.index_store import DEFAULT_PERSIST_DIR, index_is_current, load_embedding_store, load_or_build_index
+from src.interview_profile import InterviewProfile
+from src.metrics import record_cache, record_event, record_span, record_usage, timed
+from src.resilience import CircuitOpenError, call_with_retry, circuit_breaker, is_transient
+from src.response_cache import SemanticCache, text_key
+from src.retrieval import HybridRetriever, format_context
+from src.scheduler import LLMScheduler, estimate_tokens
+from src.singleflight import SingleFlight, buffered
+
+
+# Уточняющие вопросы, смысл которых задает предыдущий диалог ("объясните подробнее", "а почему так?"):
+# ответ на них нельзя отдавать из кеша другому кандидату
+_FOLLOW_UP = re.compile(
+    r"\b(подробнее|поподробнее|это|этого|этом|этим|эту|этот|эта|выше|ранее|предыдущ\w*|почему так|"
+    r"мой ответ\w*|моем ответе|your answer|previous|more detail\w*|above|this|that)\b", re.IGNORECASE
+)
+
+
+def is_follow_up(question: str) -> bool:
+    """Вопрос, который без истории диалога понять нельзя"""
+    return bool(_FOLLOW_UP.search(question))
+
 
 class RagAgent:
-    def __init__(self, docs, mistral_api_key: str, model: str = "mistral-small-latest"):
-        self._client = Mistral(api_key=mistral_api_key)
+    def __init__(self, data_dir: str, mistral_api_key: str, model: str = "mistral-small-latest",
+                 persist_dir: str = DEFAULT_PERSIST_DIR, rebuild_index: bool = False,
+                 max_concurrency: int = 8, tokens_per_minute: int = 0, executor_workers: int = 4,
+                 docs_backend: ExternalDocsBackend | None = None, docs_timeout: float = 15.0, docs_workers: int = 4,
+                 retrieval_mode: str = "vector", retrieval_top_k: int = 4,
+                 vector_backend: str = "memory", embedding_dtype: str = "float16",
+                 response_cache: SemanticCache | None = None, dataset_answers: bool = True,
+                 embed_model=None, mistral_client=None, llm_max_attempts: int = 3,
+                 circuit_failure_threshold: int = 5, circuit_reset_timeout: float = 30.0):
+        # embed_model и mistral_client можно подменить (например, локальными заглушками в бенчмарке)
+        self._client = mistral_client if mistral_client is not None else Mistral(api_key=mistral_api_key)
         self._model = model
+        self.docs_backend = docs_backend if docs_backend is not None else create_docs_backend()
+        self._docs_timeout = docs_timeout
+        self.response_cache = response_cache
+        # Повторы запросов к Mistral делает только _chat_complete/_chat_stream/_query в рамках общего бюджета
+        # запроса пользователя; размыкатели общие для процесса
+        self._llm_max_attempts = llm_max_attempts
+        self.mistral_breaker = circuit_breaker("mistral", circuit_failure_threshold, circuit_reset_timeout)
+        self.docs_breaker = circuit_breaker(self.docs_backend.name, circuit_failure_threshold, circuit_reset_timeout)
+        # Общий лимит одновременных запросов и токенов в минуту к Mistral, чтобы не упираться в rate limit API;
+        # очередность - по приоритету и по кругу между пользователями
+        self.scheduler = LLMScheduler(max_concurrency, tokens_per_minute)
+        # Одинаковые одновременные запросы (например, на групповом собеседовании) выполняются один раз
+        self._flights = {name: SingleFlight(name) for name in
+                         ("embedding", "retrieval", "external_docs", "query_engine", "completion", "answer",
+                          "answer_stream")}
+        # Синхронные части (query engine, arxiv, эмбеддинги) выполняются в ограниченном пуле потоков
+        self._executor = ThreadPoolExecutor(max_workers=executor_workers, thread_name_prefix="rag")
+        # У внешнего источника свой пул: таймаут не останавливает поток, и зависшие запросы к arxiv не должны
+        # занимать потоки query engine и эмбеддингов
+        self._docs_executor = ThreadPoolExecutor(max_workers=docs_workers, thread_name_prefix="docs")
 
         self.llm = ChatMistralAI(
             model=model,
-            max_retries=2,
+            max_retries=0,
             api_key=mistral_api_key
         )
 
-        self.embed_model = LangchainEmbedding(HuggingFaceEmbeddings(model_name="sentence-transformers/all-mpnet-base-v2"))
+        self.embed_model = embed_model if embed_model is not None else \
+            LangchainEmbedding(HuggingFaceEmbeddings(model_name="sentence-transformers/all-mpnet-base-v2"))
 
         self.service_context = ServiceContext.from_defaults(
             chunk_size=1024,
@@ -28,20 +87,262 @@ class RagAgent:
             embed_model=self.embed_model
         )
 
-        self.index=VectorStoreIndex.from_documents(docs, service_context=self.service_context)
-        self.query_engine=self.index.as_query_engine()
+        # vector - query engine llama_index по всему корпусу; hybrid - фильтр по теме/сложности, BM25 + вектор
+        if retrieval_mode not in ("vector", "hybrid"):
+            raise ValueError(f"Неизвестный режим поиска: {retrieval_mode}")
+        self._retrieval_top_k = retrieval_top_k
+
+        # memory - индекс llama_index целиком в памяти процесса;
+        # mmap - только узлы и компактный массив эмбеддингов, открытый через memory map (только для hybrid)
+        if vector_backend == "mmap":
+            if retrieval_mode != "hybrid":
+                raise ValueError("Хранилище эмбеддингов mmap поддерживается только в режиме поиска hybrid")
+            if rebuild_index or not index_is_current(data_dir, persist_dir, embedding_dtype):
+                load_or_build_index(data_dir, self.service_context, persist_dir, rebuild=rebuild_index,
+                                    embedding_dtype=embedding_dtype)
+            self.index = None
+            self.query_engine = None
+            docstore, store = load_embedding_store(persist_dir)
+            self.retriever = HybridRetriever.from_store(docstore, store, self.embed_model)
+        elif vector_backend == "memory":
+            self.index = load_or_build_index(data_dir, self.service_context, persist_dir, rebuild=rebuild_index)
+            self.query_engine=self.index.as_query_engine()
+            self.retriever = HybridRetriever.from_index(self.index, self.embed_model) if retrieval_mode == "hybrid" else None
+        else:
+            raise ValueError(f"Неизвестное хранилище эмбеддингов: {vector_backend}")
+
+        # Готовые эталонные ответы из строк rag_data вместо второго запроса к LLM и arxiv
+        self.answer_lookup = DatasetAnswerLookup.load_or_build(data_dir, self.embed_model) if dataset_answers else None
+
+    async def _run_sync(self, func, *args, executor=None, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor or self._executor, functools.partial(func, *args, **kwargs))
+
+    async def _complete_once(self, messages: list[dict], operation: str):
+        # Место в планировщике занимается на время одной попытки, а не на паузу перед повтором
+        with timed(f"llm.{operation}.wait"):
+            ticket = await self.scheduler.acquire(estimate_tokens(messages))
+        used_tokens = None
+        try:
+            with timed(f"llm.{operation}"):
+                response = await self._client.chat.complete_async(model=self._model, messages=messages)
+            used_tokens = response.usage.total_tokens if response.usage is not None else None
+            return response
+        finally:
+            self.scheduler.release(ticket, used_tokens)
+
+    async def _chat_complete(self, messages: list[dict], operation: str = "chat") -> str:
+        key = (operation, json.dumps(messages, ensure_ascii=False, sort_keys=True))
+        return await self._flights["completion"].do(key, self._chat_complete_once, messages, operation)
+
+    async def _chat_complete_once(self, messages: list[dict], operation: str) -> str:
+        response = await call_with_retry(f"llm.{operation}", self.mistral_breaker, self._complete_once, messages,
+                                         operation, max_attempts=self._llm_max_attempts)
+        record_usage(operation, response.usage)
+        return response.choices[0].message.content
+
+    async def _open_stream(self, messages: list[dict], operation: str):
+        """Место в планировщике остается занятым до конца чтения потока, его освобождает _read_chat_stream"""
+        with timed(f"llm.{operation}.wait"):
+            ticket = await self.scheduler.acquire(estimate_tokens(messages))
+        try:
+            return ticket, await self._client.chat.stream_async(model=self._model, messages=messages)
+        except BaseException:
+            self.scheduler.release(ticket)
+            raise
+
+    def _chat_stream(self, messages: list[dict], operation: str = "chat"):
+        """Куски ответа Mistral по мере генерации; повторяется только открытие потока. Поток дочитывается
+        в буфер отдельной задачей, поэтому место в планировщике освобождается, как только модель закончила,
+        а не когда потребитель отправил последнюю правку в Telegram"""
+        return buffered(self._read_chat_stream(messages, operation))
+
+    async def _read_chat_stream(self, messages: list[dict], operation: str):
+        started = time.monotonic()
+        ticket, stream = await call_with_retry(f"llm.{operation}", self.mistral_breaker, self._open_stream,
+                                               messages, operation, max_attempts=self._llm_max_attempts)
+        used_tokens = None
+        try:
+            with timed(f"llm.{operation}.stream"):
+                first_token = True
+                async with stream:
+                    async for event in stream:
+                        # Последний кусок потока Mistral содержит usage всего ответа
+                        record_usage(operation, event.data.usage)
+                        if event.data.usage is not None:
+                            used_tokens = event.data.usage.total_tokens
+                        if not event.data.choices:
+                            continue
+                        content = event.data.choices[0].delta.content
+                        if isinstance(content, str) and content:
+                            if first_token:
+                                first_token = False
+                                record_span(f"llm.{operation}.first_token", time.monotonic() - started)
+                            yield content
+        except Exception as e:
+            if is_transient(e):
+                self.mistral_breaker.record_failure()
+            raise
+        finally:
+            self.scheduler.release(ticket, used_tokens)
+
+    async def _query_once(self, prompt: str):
+        ticket = await self.scheduler.acquire(estimate_tokens([{"content": prompt}]))
+        try:
+            with timed("retrieval.query_engine"):
+                return await self._run_sync(self.query_engine.query, prompt)
+        finally:
+            self.scheduler.release(ticket)
+
+    async def _query(self, prompt: str):
+        # LangChainLLM внутри query engine не имеет настоящего async API, поэтому запрос уходит в пул потоков
+        return await self._flights["query_engine"].do(
+            prompt, call_with_retry, "llm.query_engine", self.mistral_breaker, self._query_once, prompt,
+            max_attempts=self._llm_max_attempts
+        )
+
+    async def _retrieve(self, query: str, profile: InterviewProfile, exclude=(), diversify: bool = False) -> list:
+        if diversify:
+            # Случайная выборка нужна, чтобы разные кандидаты получали разные вопросы: такие вызовы не объединяем
+            return await self._retrieve_once(query, profile, exclude, diversify)
+        key = (query, profile.interview_scope, profile.difficulty, tuple(exclude))
+        return await self._flights["retrieval"].do(key, self._retrieve_once, query, profile, exclude, diversify)
+
+    async def _retrieve_once(self, query: str, profile: InterviewProfile, exclude, diversify: bool) -> list:
+        with timed("retrieval.hybrid"):
+            return await self._run_sync(self.retriever.retrieve, query, profile.interview_scope, profile.difficulty,
+                                        self._retrieval_top_k, exclude, diversify)
+
+    async def embed_text(self, text: str) -> list[float]:
+        return await self._flights["embedding"].do(text, self._embed_once, text)
+
+    async def _embed_once(self, text: str) -> list[float]:
+        with timed("embedding"):
+            return await self._run_sync(self.embed_model.get_text_embedding, text)
+
+    async def _search_external_docs(self, question: str) -> list[str]:
+        return await self._flights["external_docs"].do(normalize_question(question), self._search_external_docs_once,
+                                                       question)
+
+    async def _search_external_docs_once(self, question: str) -> list[str]:
+        """Справочные тексты из внешнего источника; при таймауте, ошибке или разомкнутом размыкателе ответ
+        строится без них. Повторов нет: справка не стоит задержки ответа"""
+        try:
+            self.docs_breaker.before_call()
+        except CircuitOpenError:
+            record_event("external_docs.skipped", upstream=self.docs_backend.name)
+            return []
+        try:
+            with timed("external_docs"):
+                search = self._run_sync(self.docs_backend.search, question, executor=self._docs_executor)
+                docs = await asyncio.wait_for(search, self._docs_timeout)
+            self.docs_breaker.record_success()
+            return docs
+        except asyncio.TimeoutError:
+            print(f"Источник {self.docs_backend.name} не ответил за {self._docs_timeout} с, отвечаю без него")
+        except Exception as e:
+            print(f"Ошибка источника {self.docs_backend.name}, отвечаю без него: {e}")
+        self.docs_breaker.record_failure()
+        return []
+
+    async def _cache_lookup(self, kind: str, profile: InterviewProfile, question: str, extra_key: str = ""):
+        """Эмбеддинг вопроса и ответ из семантического кеша, если похожий вопрос для той же темы и сложности
+        уже задавался"""
+        embedding = await self.embed_text(normalize_question(question))
+        cached = await self._run_sync(self.response_cache.lookup, kind, profile.interview_scope, profile.difficulty,
+                                      embedding, extra_key)
+        record_cache(f"response_{kind}", cached is not None)
+        return embedding, cached
 
-    def set_user_info(self, name, interview_scope, difficulty):
-        self.name = name
-        self.interview_scope = interview_scope
-        self.difficulty = difficulty
+    async def _cache_store(self, kind: str, profile: InterviewProfile, question: str, embedding, response: str,
+                           started: float, extra_key: str = "") -> None:
+        await self._run_sync(self.response_cache.store, kind, profile.interview_scope, profile.difficulty,
+                             question, embedding, response, time.monotonic() - started, extra_key)
 
-    def get_detailed_answer(self, question: str, message_history=""):
-        retriever = ArxivRetriever(load_max_docs=2)
-        docs = retriever.invoke(question)
-        docs_text = "\n\n".join([doc.page_content for doc in docs])
+    @staticmethod
+    def _flight_key(kind: str, profile: InterviewProfile, question: str, extra_key: str) -> tuple:
+        return kind, profile.interview_scope, profile.difficulty, normalize_question(question), extra_key
 
-        prompt = f"""Ты - эксперт IT в области {self.interview_scope}, который подробно и \
+    async def _cached(self, kind: str, profile: InterviewProfile, question: str, make_messages, extra_key: str = "",
+                      use_cache: bool = True):
+        """use_cache=False - ответ зависит не только от ключа (например, от истории диалога): без кеша
+        и без объединения одновременных вызовов"""
+        if self.response_cache is None or not use_cache:
+            return await self._chat_complete(await make_messages(), kind)
+        embedding, cached = await self._cache_lookup(kind, profile, question, extra_key)
+        if cached is not None:
+            return cached
+        # Ответ на тот же вопрос для той же темы, сложности и extra_key и так общий через кеш, поэтому
+        # одновременные промахи кеша ждут один запрос
+        return await self._flights["answer"].do(self._flight_key(kind, profile, question, extra_key),
+                                                self._generate, kind, profile, question, embedding, make_messages,
+                                                extra_key)
+
+    async def _generate(self, kind: str, profile: InterviewProfile, question: str, embedding, make_messages,
+                        extra_key: str) -> str:
+        started = time.monotonic()
+        response = await self._chat_complete(await make_messages(), kind)
+        await self._cache_store(kind, profile, question, embedding, response, started, extra_key)
+        return response
+
+    async def _cached_stream(self, kind: str, profile: InterviewProfile, question: str, make_messages,
+                             extra_key: str = "", use_cache: bool = True):
+        """Потоковая версия _cached: ответ из кеша отдается одним куском"""
+        if self.response_cache is None or not use_cache:
+            chunks = self._chat_stream(await make_messages(), kind)
+        else:
+            embedding, cached = await self._cache_lookup(kind, profile, question, extra_key)
+            if cached is not None:
+                yield cached
+                return
+            chunks = self._flights["answer_stream"].stream(
+                self._flight_key(kind, profile, question, extra_key),
+                lambda: self._generate_stream(kind, profile, question, embedding, make_messages, extra_key)
+            )
+        async for chunk in chunks:
+            yield chunk
+
+    async def _generate_stream(self, kind: str, profile: InterviewProfile, question: str, embedding, make_messages,
+                               extra_key: str):
+        started = time.monotonic()
+        parts = []
+        async for chunk in self._chat_stream(await make_messages(), kind):
+            parts.append(chunk)
+            yield chunk
+        await self._cache_store(kind, profile, question, embedding, "".join(parts), started, extra_key)
+
+    def singleflight_stats(self) -> dict:
+        """Сколько вызовов выполнено и сколько ожидающих получили чужой результат (сэкономленные вызовы)"""
+        return {
+            "calls": {name: flight.calls for name, flight in self._flights.items()},
+            "shared": {name: flight.shared for name, flight in self._flights.items()},
+        }
+
+    async def get_detailed_answer(self, profile: InterviewProfile, question: str, message_history=""):
+        # Ключ кеша - вопрос, тема и сложность; история диалога только дополняет промпт. Уточняющий вопрос без
+        # истории не имеет смысла, его ответ не кешируется
+        return await self._cached(
+            "detailed_answer", profile, question,
+            lambda: self._detailed_answer_messages(profile, question, message_history),
+            use_cache=not (message_history and is_follow_up(question))
+        )
+
+    def stream_detailed_answer(self, profile: InterviewProfile, question: str, message_history=""):
+        """Ответ get_detailed_answer по мере генерации (асинхронный генератор кусков текста)"""
+        return self._cached_stream(
+            "detailed_answer", profile, question,
+            lambda: self._detailed_answer_messages(profile, question, message_history),
+            use_cache=not (message_history and is_follow_up(question))
+        )
+
+    async def _detailed_answer_messages(self, profile: InterviewProfile, question: str, message_history=""):
+        docs = await self._search_external_docs(question)
+        docs_text = "\n\n".join(docs)
+        if self.retriever is not None:
+            local_docs = format_context(await self._retrieve(question, profile))
+            docs_text = f"{local_docs}\n\n{docs_text}" if docs_text else local_docs
+
+        prompt = f"""Ты - эксперт IT в области {profile.interview_scope}, который подробно и \
                   и полно, доступным языком отвечает на вопросы технических собеседований и дает справочную информацию.\
                   Твоя задача - дать полный развернутый ответ на задаваемый вопрос или дополнить ответ, если он уже есть в запросе.\
                   Отвечай только на вопросы по теме собеседования!\
@@ -52,63 +353,96 @@ class RagAgent:
 
                   ЗАМЕЧАНИЕ: Если тебя спросят на НЕ ОТНОСЯЩУЮСЯ К IT, К ТЕМЕ СОБЕСЕДОВАНИЯ ИЛИ ТЕХНИЧЕСКИМ СОБЕСЕДОВАНИЯМ И ИХ ФОРМАТУ В ЦЕЛОМ тему,\
                    вежливо ПРЕДЛОЖИ ВЕРНУТЬСЯ К СОБЕСЕДОВАНИЮ и расскажи про какую-нибудь другую полезную IT штуку, \
-                  связанную с {self.interview_scope} \
+                  связанную с {profile.interview_scope} \
                   (В такой ситуации ВЕЖЛИВО ПРЕДЛОЖИ ВЕРНУТЬСЯ К СОБЕСЕДОВАНИЮ, а потом используй слова: Давайте я лучше расскажу вам про...) \
                   ## Docs {docs_text} \
 
                   Если для ответа на вопрос нужно обратиться к истории сообщений: \
                   ## Message_history {message_history}"""
-        response = self._client.chat.complete(
-            model=self._model,
-            messages=[
-                {"role": "system", "content": prompt},
-                {"role": "user", "content": question}
-            ]
-        )
-
-        return response.choices[0].message.content
+        return [
+            {"role": "system", "content": prompt},
+            {"role": "user", "content": question}
+        ]
     
 
-    def get_next_interview_question(self, question="", message_history=""):
+    async def get_next_interview_question(self, profile: InterviewProfile, question="", message_history="",
+                                          exclude=()):
+        excluded = "; ".join(exclude) if exclude else "нет"
+
         prompt = f"Теперь ты выступаешь в роли системы-интервьюера, в которой хранится много вопросов с технических собеседований. \
-          Задай мне вопрос из сферы {self.interview_scope} со сложностью {self.difficulty}. \
+          Задай мне вопрос из сферы {profile.interview_scope} со сложностью {profile.difficulty}. \
           Если возможно - приведи ПОДРОБНЫЙ, но ЛАКОНИЧНЫЙ ответ на этот вопрос, который ожидает интервьюер. \
           Будь максимально аккуратен и не добавляй лишний текст. Важно, чтобы вопросы собеседования не повторялись! \
           Можно задавать уточняющие вопросы, но смысл должен отличаться! Прежде, чем выбрать вопрос, проверь, не задавал ли ты его раньше в истории сообщений \
           ## ИСТОРИЯ СООБЩЕНИЙ: {message_history} \
+          ## УЖЕ ЗАДАННЫЕ ВОПРОСЫ (не задавай их и их перефразировки): {excluded} \
           ФОРМАТ: json с полями question и answer. \
           Оставь в поле answer "", если у тебя нет ответа на заданный вопрос. \
           Вопрос нужно задать на РУССКОМ языке (общеупотребимые термины сферы можно оставить на английском)"
         
         question = question if question else prompt
-        response = self.query_engine.query(question)
-        clean_response = response.response.replace('```json', '').replace('```', '').strip()
-        json_response = json.loads(clean_response)
+        if self.retriever is not None:
+            nodes = await self._retrieve(f"{profile.interview_scope} interview question", profile,
+                                         exclude=exclude, diversify=True)
+            response_text = await self._chat_complete([
+                {"role": "system", "content": f"Вопросы из базы знаний:\n{format_context(nodes)}"},
+                {"role": "user", "content": question}
+            ], "question")
+        else:
+            response_text = (await self._query(question)).response
+        with timed("question.parse"):
+            clean_response = response_text.replace('```json', '').replace('```', '').strip()
+            json_response = json.loads(clean_response)
 
         question = json_response["question"]
         answer = json_response["answer"]
 
         flag = 0 if answer != "" else 1
+        if flag and self.answer_lookup is not None:
+            with timed("answer_lookup"):
+                reference = await self._run_sync(self.answer_lookup.find, question)
+            record_cache("answer_lookup", reference is not None)
+            if reference is not None:
+                json_response["answer"] = reference
+                flag = 0
         if flag:
-            max_attempts = 3
-            for attempt in range(max_attempts):
-                try:
-                    detailed_answer = self.get_detailed_answer(question)
-                    json_response["answer"] = detailed_answer
-                    break
-
-                except Exception as e:
-                    print(f"Попытка {attempt + 1} не удалась: {e}")
-                    if attempt == max_attempts - 1:
-                        json_response["answer"] = "Не удалось получить ответ"
-                        raise
+            # Повторы запроса к Mistral уже внутри get_detailed_answer, в рамках общего бюджета
+            with timed("question.fallback_answer"):
+                json_response["answer"] = await self.get_detailed_answer(profile, question)
 
         return json_response
 
-    def check_answer_correctness(self, question, rag_answer, user_answer):
-        prompt = f"Ты - эксперт IT в области {self.interview_scope}, который проверяет правильность \
+    async def summarize_history(self, previous_summary: str, new_turns: str) -> str:
+        prompt = "Ты ведешь краткое резюме технического собеседования. Дополни текущее резюме новыми репликами: \
+                  какие темы и вопросы обсуждались, как кандидат с ними справился, какие пробелы в знаниях видны. \
+                  Не более 5 предложений. Весь ответ на РУССКОМ языке, НЕ используй формат MARKDOWN."
+        request = f"## Текущее резюме: {previous_summary or 'пусто'}\n## Новые реплики:\n{new_turns}"
+
+        return await self._chat_complete([
+            {"role": "system", "content": prompt},
+            {"role": "user", "content": request}
+        ], "summary")
+
+    async def check_answer_correctness(self, profile: InterviewProfile, question, rag_answer, user_answer):
+        # Оценка зависит от ответа пользователя, поэтому он входит в ключ кеша точным совпадением
+        return await self._cached(
+            "answer_check", profile, question,
+            lambda: self._answer_check_messages(profile, question, rag_answer, user_answer),
+            extra_key=text_key(user_answer)
+        )
+
+    def stream_answer_check(self, profile: InterviewProfile, question, rag_answer, user_answer):
+        """Оценка check_answer_correctness по мере генерации (асинхронный генератор кусков текста)"""
+        return self._cached_stream(
+            "answer_check", profile, question,
+            lambda: self._answer_check_messages(profile, question, rag_answer, user_answer),
+            extra_key=text_key(user_answer)
+        )
+
+    async def _answer_check_messages(self, profile: InterviewProfile, question, rag_answer, user_answer):
+        prompt = f"Ты - эксперт IT в области {profile.interview_scope}, который проверяет правильность \
                   и полноту ответов на вопросы собеседований. Тебе следует проверить, насколько качественный ответ для \
-                  уровня сложности {self.difficulty} был дан пользователем на вопрос. Сравни ответ пользователя и ответ rag. \
+                  уровня сложности {profile.difficulty} был дан пользователем на вопрос. Сравни ответ пользователя и ответ rag. \
                   Дай оценку, укажи на ошибки, если они есть, а затем приведи эталонный ответ на основе ответа rag и дополнительную \
                   справочную информацию, если она есть. \
                   ОБЯЗАТЕЛЬНО давай оценку так, как будто говоришь напрямую с учеником, обращаясь на вы. \
@@ -119,13 +453,8 @@ class RagAgent:
                   Весь ответ должен быть дан на РУССКОМ языке (общеупотребимые термины сферы можно оставить на английском)."
         
         request = f"""'question': {question}, 'rag_answer': {rag_answer}, 'user_answer': {user_answer}"""
-                   
-        response = self._client.chat.complete(
-            model=self._model,
-            messages=[
-                {"role": "system", "content": prompt},
-                {"role": "user", "content": request}
-            ]
-        )
 
-        return response.choices[0].message.content
+        return [
+            {"role": "system", "content": prompt},
+            {"role": "user", "content": request}
+        ]
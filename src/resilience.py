@@ -0,0 +1,200 @@
+import asyncio
+import contextvars
+import random
+import time
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+
+from src.metrics import REGISTRY, record_event, record_retry
+
+# Коды ответа, после которых запрос имеет смысл повторить
+RETRYABLE_STATUSES = {408, 409, 425, 429, 500, 502, 503, 504}
+
+
+class CircuitOpenError(Exception):
+    """Вызов не выполнялся: внешний сервис недавно подряд отвечал ошибками"""
+
+    def __init__(self, name: str, retry_in: float):
+        super().__init__(f"{name} временно недоступен, следующая попытка через {retry_in:.0f} с")
+        self.name = name
+        self.retry_in = retry_in
+
+
+class CircuitBreaker:
+    """Размыкатель для одного внешнего сервиса: после failure_threshold ошибок подряд вызовы сразу
+    завершаются CircuitOpenError, через reset_timeout секунд пропускается один пробный вызов"""
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self._failures = 0
+        self._opened_until = 0.0
+        self.opened = 0
+        self.rejected = 0
+
+    def before_call(self) -> None:
+        if self.state == "closed":
+            return
+        now = time.monotonic()
+        if now < self._opened_until:
+            self.rejected += 1
+            raise CircuitOpenError(self.name, self._opened_until - now)
+        # Пробный вызов; пока он выполняется, остальные ждут его результата не дольше reset_timeout
+        self.state = "half_open"
+        self._opened_until = now + self.reset_timeout
+
+    def record_success(self) -> None:
+        if self.state != "closed":
+            print(f"Сервис {self.name} снова отвечает")
+        self.state = "closed"
+        self._failures = 0
+
+    def record_failure(self, retry_after: float | None = None) -> None:
+        self._failures += 1
+        if self.state == "half_open" or self._failures >= self.failure_threshold:
+            pause = max(self.reset_timeout, retry_after or 0)
+            if self.state != "open":
+                self.opened += 1
+                record_event("circuit_open", upstream=self.name)
+                print(f"Сервис {self.name} недоступен, запросы к нему приостановлены на {pause:.1f} с")
+            self.state = "open"
+            self._opened_until = time.monotonic() + pause
+
+    def stats(self) -> dict:
+        return {"open": int(self.state != "closed"), "failures": self._failures, "opened": self.opened,
+                "rejected": self.rejected}
+
+
+_breakers: dict[str, CircuitBreaker] = {}
+
+
+def circuit_breaker(name: str, failure_threshold: int = 5, reset_timeout: float = 30.0) -> CircuitBreaker:
+    """Общий на процесс размыкатель сервиса name (mistral, arxiv и т.п.)"""
+    breaker = _breakers.get(name)
+    if breaker is None:
+        breaker = _breakers[name] = CircuitBreaker(name, failure_threshold, reset_timeout)
+        REGISTRY.register_collector(f"circuit_{name}", breaker.stats)
+    return breaker
+
+
+class RetryBudget:
+    """Лимит повторов на одно сообщение пользователя, общий для всех вложенных вызовов: повтор не начинается,
+    если закончились попытки или ожидание не укладывается в оставшееся время"""
+
+    def __init__(self, retries: int = 4, seconds: float = 30.0):
+        self.retries = retries
+        self.deadline = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        return max(0.0, self.deadline - time.monotonic())
+
+    def take(self, delay: float) -> bool:
+        if self.retries <= 0 or delay > self.remaining():
+            return False
+        self.retries -= 1
+        return True
+
+
+_current_budget: contextvars.ContextVar[RetryBudget | None] = contextvars.ContextVar("retry_budget", default=None)
+_default_budget = {"retries": 4, "seconds": 30.0}
+
+
+def configure_retry_budget(retries: int, seconds: float) -> None:
+    """Бюджет по умолчанию для retry_budget() и для вызовов вне него"""
+    _default_budget.update(retries=retries, seconds=seconds)
+
+
+@contextmanager
+def retry_budget(retries: int | None = None, seconds: float | None = None):
+    """Бюджет повторов для кода внутри блока (и созданных в нем задач); вложенный блок использует внешний бюджет"""
+    if _current_budget.get() is not None:
+        yield _current_budget.get()
+        return
+    budget = RetryBudget(_default_budget["retries"] if retries is None else retries,
+                         _default_budget["seconds"] if seconds is None else seconds)
+    token = _current_budget.set(budget)
+    try:
+        yield budget
+    finally:
+        _current_budget.reset(token)
+
+
+def _status_code(error: BaseException) -> int | None:
+    # mistralai.models.SDKError хранит код в status_code, httpx.HTTPStatusError - в response
+    status = getattr(error, "status_code", None)
+    if status is None and getattr(error, "response", None) is not None:
+        status = getattr(error.response, "status_code", None)
+    return status if isinstance(status, int) else None
+
+
+def is_transient(error: BaseException) -> bool:
+    """Ошибка сети, таймаут или ответ 429/5xx; ошибки в самом запросе повторять бесполезно"""
+    status = _status_code(error)
+    if status is not None:
+        return status in RETRYABLE_STATUSES
+    if isinstance(error, (asyncio.TimeoutError, ConnectionError, TimeoutError)):
+        return True
+    # httpx.TransportError и его наследники без импорта httpx
+    return any(cls.__name__ in ("TransportError", "RequestError") for cls in type(error).__mro__)
+
+
+def retry_after(error: BaseException) -> float | None:
+    """Значение заголовка Retry-After ответа (секунды или HTTP-дата)"""
+    headers = getattr(error, "headers", None)
+    if headers is None and getattr(error, "response", None) is not None:
+        headers = getattr(error.response, "headers", None)
+    value = headers.get("retry-after") if headers is not None else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(error: BaseException, attempt: int, base: float = 1.0, max_delay: float = 10.0) -> float:
+    """Пауза перед повтором: Retry-After, если сервис его прислал, иначе экспонента со случайным разбросом"""
+    delay = retry_after(error)
+    if delay is not None:
+        return delay
+    return min(max_delay, base * 2 ** (attempt - 1)) * random.uniform(0.5, 1.0)
+
+
+async def call_with_retry(operation: str, breaker: CircuitBreaker | None, func, *args, max_attempts: int = 3,
+                          **kwargs):
+    """await func(*args, **kwargs) с повторами временных ошибок в рамках текущего бюджета и через размыкатель"""
+    budget = _current_budget.get() or RetryBudget(_default_budget["retries"], _default_budget["seconds"])
+    attempt = 0
+    while True:
+        attempt += 1
+        if breaker is not None:
+            breaker.before_call()
+        try:
+            result = await func(*args, **kwargs)
+        except Exception as e:
+            transient = is_transient(e)
+            if breaker is not None:
+                if transient:
+                    breaker.record_failure(retry_after(e))
+                else:
+                    # Сервис ответил, ошибка в самом запросе
+                    breaker.record_success()
+            if not transient or attempt >= max_attempts:
+                raise
+            delay = backoff_delay(e, attempt)
+            if not budget.take(delay):
+                print(f"{operation}: бюджет повторов исчерпан, последняя ошибка: {e}")
+                raise
+            record_retry(operation, attempt, e)
+            print(f"{operation}: попытка {attempt} не удалась ({e}), повтор через {delay:.1f} с")
+            await asyncio.sleep(delay)
+            continue
+        if breaker is not None:
+            breaker.record_success()
+        return result
@@ -0,0 +1,184 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+
+import numpy as np
+
+from src.asked_questions import normalize_question
+
+DEFAULT_CACHE_PATH = os.path.join("storage", "response_cache.sqlite")
+
+
+def text_key(text: str) -> str:
+    """Короткий ключ нормализованного текста, например ответа пользователя"""
+    return hashlib.sha1(normalize_question(text).encode("utf-8")).hexdigest()
+
+
+@dataclass
+class CacheEntry:
+    entry_id: int
+    group: tuple
+    vector: np.ndarray
+    response: str
+    created: float
+    accessed: float
+    cost_seconds: float
+
+
+class SemanticCache:
+    """Кеш ответов LLM: эмбеддинг нормализованного вопроса + тема и сложность,
+    попадание при косинусной близости не ниже порога. Методы блокируются на запись в SQLite, поэтому из
+    асинхронного кода их вызывают в пуле потоков"""
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, threshold: float = 0.92,
+                 ttl_seconds: float = 7 * 24 * 3600, max_entries: int = 5000, report_every: int = 100,
+                 flush_every: int = 100):
+        self.threshold = threshold
+        self._ttl = ttl_seconds
+        self._max_entries = max_entries
+        self._report_every = report_every
+        self._flush_every = flush_every
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        # WAL: файл пишут несколько процессов-обработчиков (start.py --workers)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, kind TEXT NOT NULL, scope TEXT NOT NULL, "
+            "difficulty TEXT NOT NULL, extra_key TEXT NOT NULL, question TEXT NOT NULL, embedding BLOB NOT NULL, "
+            "response TEXT NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL, cost_seconds REAL NOT NULL)"
+        )
+        self._db.commit()
+        self._entries: dict[int, CacheEntry] = {}
+        self._groups: dict[tuple, list[int]] = {}
+        self._matrices: dict[tuple, np.ndarray] = {}
+        # Время последнего попадания пишется в SQLite пачкой, а не коммитом на каждое попадание
+        self._touched: dict[int, float] = {}
+        self.hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+        self._load()
+
+    def _load(self) -> None:
+        self._db.execute("DELETE FROM responses WHERE created < ?", (time.time() - self._ttl,))
+        self._db.commit()
+        rows = self._db.execute(
+            "SELECT id, kind, scope, difficulty, extra_key, embedding, response, created, accessed, cost_seconds "
+            "FROM responses ORDER BY id"
+        )
+        for entry_id, kind, scope, difficulty, extra_key, blob, response, created, accessed, cost in rows:
+            self._add_entry(CacheEntry(entry_id, (kind, scope, difficulty, extra_key),
+                                       np.frombuffer(blob, dtype=np.float32), response, created, accessed, cost))
+
+    def _add_entry(self, entry: CacheEntry) -> None:
+        self._entries[entry.entry_id] = entry
+        self._groups.setdefault(entry.group, []).append(entry.entry_id)
+        self._matrices.pop(entry.group, None)
+
+    def _remove_entries(self, entry_ids) -> None:
+        entry_ids = list(entry_ids)
+        for entry_id in entry_ids:
+            entry = self._entries.pop(entry_id)
+            self._groups[entry.group].remove(entry_id)
+            self._matrices.pop(entry.group, None)
+            self._touched.pop(entry_id, None)
+        self._db.executemany("DELETE FROM responses WHERE id = ?", [(entry_id,) for entry_id in entry_ids])
+        self._db.commit()
+
+    def _flush_touched(self) -> None:
+        if self._touched:
+            self._db.executemany("UPDATE responses SET accessed = ? WHERE id = ?",
+                                 [(accessed, entry_id) for entry_id, accessed in self._touched.items()])
+            self._db.commit()
+            self._touched.clear()
+
+    def flush(self) -> None:
+        with self._lock:
+            self._flush_touched()
+
+    @staticmethod
+    def _unit(embedding) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _report(self) -> None:
+        lookups = self.hits + self.misses
+        if self._report_every and lookups % self._report_every == 0:
+            stats = self.stats()
+            print(f"Кеш ответов: {stats['hits']}/{lookups} попаданий ({stats['hit_rate']:.0%}), "
+                  f"сэкономлено {stats['saved_seconds']:.0f} с")
+
+    def lookup(self, kind: str, scope: str, difficulty: str, embedding, extra_key: str = "") -> str | None:
+        with self._lock:
+            return self._lookup((kind, scope, difficulty, extra_key), embedding)
+
+    def _lookup(self, group: tuple, embedding) -> str | None:
+        entry_ids = self._groups.get(group)
+        found = None
+        if entry_ids:
+            if group not in self._matrices:
+                self._matrices[group] = np.vstack([self._entries[entry_id].vector for entry_id in entry_ids])
+            similarities = self._matrices[group] @ self._unit(embedding)
+            now = time.time()
+            expired = []
+            # Устаревшая ближайшая запись не должна скрывать следующую подходящую
+            for position in np.argsort(-similarities):
+                if similarities[position] < self.threshold:
+                    break
+                entry = self._entries[entry_ids[position]]
+                if now - entry.created > self._ttl:
+                    expired.append(entry.entry_id)
+                    continue
+                found = entry
+                break
+            if expired:
+                self._remove_entries(expired)
+            if found is not None:
+                found.accessed = now
+                self._touched[found.entry_id] = now
+                if len(self._touched) >= self._flush_every:
+                    self._flush_touched()
+
+        if found is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.saved_seconds += found.cost_seconds
+        self._report()
+        return found.response if found is not None else None
+
+    def store(self, kind: str, scope: str, difficulty: str, question: str, embedding, response: str,
+              cost_seconds: float, extra_key: str = "") -> None:
+        with self._lock:
+            self._store(kind, scope, difficulty, question, self._unit(embedding), response, cost_seconds, extra_key)
+
+    def _store(self, kind: str, scope: str, difficulty: str, question: str, vector: np.ndarray, response: str,
+               cost_seconds: float, extra_key: str) -> None:
+        now = time.time()
+        self._flush_touched()
+        cursor = self._db.execute(
+            "INSERT INTO responses (kind, scope, difficulty, extra_key, question, embedding, response, created, "
+            "accessed, cost_seconds) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (kind, scope, difficulty, extra_key, question, vector.tobytes(), response, now, now, cost_seconds)
+        )
+        self._db.commit()
+        self._add_entry(CacheEntry(cursor.lastrowid, (kind, scope, difficulty, extra_key), vector, response,
+                                   now, now, cost_seconds))
+        if len(self._entries) > self._max_entries:
+            by_access = sorted(self._entries.values(), key=lambda item: item.accessed)
+            self._remove_entries(item.entry_id for item in by_access[:len(self._entries) - self._max_entries])
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "saved_seconds": self.saved_seconds,
+        }
@@ -0,0 +1,151 @@
+import math
+import random
+import re
+from collections import Counter
+
+import numpy as np
+from llama_index.schema import MetadataMode
+
+from src.asked_questions import normalize_question
+from src.embedding_store import EmbeddingStore
+
+_WORD = re.compile(r"\w+")
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "be", "by", "can", "do", "does", "for", "how", "in", "is", "it", "of",
+    "on", "or", "that", "the", "to", "what", "when", "which", "why", "with", "you", "your",
+}
+
+# Категории (поле category/role схемы rag_data), подходящие каждой теме собеседования
+SCOPE_CATEGORIES = {
+    "Data Science": {"data science", "machine learning", "deep learning", "artificial intelligence",
+                     "data engineering"},
+    "Machine Learning": {"machine learning", "deep learning", "artificial intelligence", "data science"},
+    "Data Analysis": {"data science", "database and sql", "database systems", "data engineering"},
+    "Software Engineering": {"software engineer", "general programming", "data structures", "algorithms",
+                             "languages and frameworks", "database and sql", "web development",
+                             "software testing", "version control", "system design", "security", "devops",
+                             "front-end", "back-end", "full-stack", "distributed systems", "networking",
+                             "low-level systems", "database systems"},
+}
+
+# Сложность вопросов датасетов, подходящая уровню кандидата; строки без сложности подходят всем
+LEVEL_DIFFICULTIES = {
+    "Junior": {"easy", "medium"},
+    "Middle": {"medium", "hard"},
+    "Senior": {"hard", "medium"},
+}
+
+
+def tokenize(text: str) -> list[str]:
+    return [word for word in _WORD.findall(text.lower()) if len(word) > 1 and word not in STOPWORDS]
+
+
+class BM25Index:
+    """Лексический индекс Okapi BM25 с векторизованным подсчетом оценок"""
+
+    def __init__(self, texts: list[str], k1: float = 1.5, b: float = 0.75):
+        self._size = len(texts)
+        lengths = np.zeros(self._size, dtype=np.float32)
+        postings = {}
+        for row, text in enumerate(texts):
+            counts = Counter(tokenize(text))
+            lengths[row] = sum(counts.values())
+            for term, count in counts.items():
+                postings.setdefault(term, ([], []))
+                postings[term][0].append(row)
+                postings[term][1].append(count)
+        average_length = float(lengths.mean()) if self._size else 0.0
+        norm = k1 * (1 - b + b * lengths / (average_length or 1.0))
+        self._postings = {}
+        for term, (rows, counts) in postings.items():
+            rows = np.asarray(rows, dtype=np.int64)
+            counts = np.asarray(counts, dtype=np.float32)
+            idf = math.log(1 + (self._size - len(rows) + 0.5) / (len(rows) + 0.5))
+            self._postings[term] = (rows, idf * counts * (k1 + 1) / (counts + norm[rows]))
+
+    def scores(self, query: str) -> np.ndarray:
+        scores = np.zeros(self._size, dtype=np.float32)
+        for term in set(tokenize(query)):
+            if term in self._postings:
+                rows, weights = self._postings[term]
+                scores[rows] += weights
+        return scores
+
+
+class HybridRetriever:
+    """Гибридный поиск по узлам индекса: фильтр по теме/сложности, BM25 + вектор, слияние рангов (RRF)"""
+
+    def __init__(self, nodes: list, store: EmbeddingStore, embed_model, candidate_k: int = 30, rrf_k: int = 60):
+        # nodes[i] соответствует строке i хранилища эмбеддингов
+        self._nodes = nodes
+        self._store = store
+        self._embed_model = embed_model
+        self._candidate_k = candidate_k
+        self._rrf_k = rrf_k
+        self._bm25 = BM25Index([node.get_content(metadata_mode=MetadataMode.NONE) for node in nodes])
+        self._categories = [
+            {str(node.metadata.get(key, "")).strip().lower() for key in ("category", "role")} - {""}
+            for node in nodes
+        ]
+        self._difficulties = [str(node.metadata.get("difficulty", "")).lower() for node in nodes]
+        self._questions = [normalize_question(node.get_content(metadata_mode=MetadataMode.NONE)
+                                              .split("\n")[0].removeprefix("Question:"))
+                           for node in nodes]
+        self._filter_cache = {}
+
+    @classmethod
+    def from_index(cls, index, embed_model, **kwargs) -> "HybridRetriever":
+        nodes = list(index.docstore.docs.values())
+        embeddings = np.asarray([index.vector_store.get(node.node_id) for node in nodes], dtype=np.float32)
+        return cls(nodes, EmbeddingStore.from_embeddings([node.node_id for node in nodes], embeddings),
+                   embed_model, **kwargs)
+
+    @classmethod
+    def from_store(cls, docstore, store: EmbeddingStore, embed_model, **kwargs) -> "HybridRetriever":
+        nodes = [docstore.get_node(node_id) for node_id in store.node_ids]
+        return cls(nodes, store, embed_model, **kwargs)
+
+    def _candidate_rows(self, scope: str | None, difficulty: str | None) -> np.ndarray:
+        key = (scope, difficulty)
+        if key not in self._filter_cache:
+            categories = SCOPE_CATEGORIES.get(scope)
+            difficulties = LEVEL_DIFFICULTIES.get(difficulty)
+            rows = [
+                row for row in range(len(self._nodes))
+                if (categories is None or not self._categories[row] or self._categories[row] & categories)
+                and (difficulties is None or not self._difficulties[row] or self._difficulties[row] in difficulties)
+            ]
+            self._filter_cache[key] = np.asarray(rows, dtype=np.int64)
+        return self._filter_cache[key]
+
+    def _ranks(self, scores: np.ndarray) -> np.ndarray:
+        order = np.argsort(-scores, kind="stable")
+        ranks = np.empty(len(scores), dtype=np.float32)
+        ranks[order] = np.arange(len(scores), dtype=np.float32)
+        return ranks
+
+    def retrieve(self, query: str, scope: str | None = None, difficulty: str | None = None, top_k: int = 4,
+                 exclude=(), diversify: bool = False) -> list:
+        """Узлы, подходящие теме и сложности, отсортированные по слиянию лексического и векторного рангов"""
+        rows = self._candidate_rows(scope, difficulty)
+        excluded = {normalize_question(question) for question in exclude}
+        if excluded:
+            rows = rows[[self._questions[row] not in excluded for row in rows]]
+        if len(rows) < top_k:
+            rows = np.arange(len(self._nodes))
+        if len(rows) == 0:
+            return []
+
+        vector_scores = self._store.similarities(self._embed_model.get_query_embedding(query), rows)
+        lexical_scores = self._bm25.scores(query)[rows]
+        fused = 1 / (self._rrf_k + self._ranks(vector_scores)) + 1 / (self._rrf_k + self._ranks(lexical_scores))
+
+        best = np.argsort(-fused, kind="stable")[:self._candidate_k]
+        if diversify:
+            # Для генерации вопросов берем случайную выборку из лучших кандидатов, чтобы контекст не повторялся
+            best = np.asarray(random.sample(list(best), min(top_k, len(best))), dtype=np.int64)
+        return [self._nodes[rows[i]] for i in best[:top_k]]
+
+
+def format_context(nodes: list) -> str:
+    return "\n\n".join(node.get_content(metadata_mode=MetadataMode.LLM) for node in nodes)
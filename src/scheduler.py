@@ -0,0 +1,248 @@
+import asyncio
+import contextvars
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+# Приоритеты запросов к LLM: меньше - важнее
+PRIORITY_INTERACTIVE = 0  # пользователь ждет ответа прямо сейчас: оценка ответа, ответ на вопрос по теории
+PRIORITY_QUESTION = 1  # следующий вопрос собеседования, в том числе подготовленный заранее
+PRIORITY_BACKGROUND = 2  # пополнение пула вопросов
+PRIORITY_NAMES = {PRIORITY_INTERACTIVE: "interactive", PRIORITY_QUESTION: "question",
+                  PRIORITY_BACKGROUND: "background"}
+
+# (user_id, приоритет) запросов к LLM из текущей задачи
+_llm_context: contextvars.ContextVar[tuple[int | None, int]] = contextvars.ContextVar(
+    "llm_context", default=(None, PRIORITY_QUESTION)
+)
+
+
+class SharedCall:
+    """Вызов, результат которого могут ждать несколько пользователей (SingleFlight): его запросы к LLM идут
+    от имени начавшего вызов, но с самым важным приоритетом из приоритетов ожидающих"""
+
+    def __init__(self, user_id: int | None, priority: int):
+        self.user_id = user_id
+        self.priority = priority
+        # Запросы вызова, которые еще ждут в очереди планировщика
+        self._queued: dict = {}
+
+    def join(self, priority: int) -> None:
+        """Присоединился еще один ожидающий: уже стоящие в очереди запросы поднимаются до его приоритета"""
+        if priority < self.priority:
+            self.priority = priority
+            for ticket, scheduler in list(self._queued.items()):
+                scheduler.promote(ticket, priority)
+
+
+# Общий вызов, внутри которого выполняется текущая задача
+_shared_call: contextvars.ContextVar[SharedCall | None] = contextvars.ContextVar("shared_call", default=None)
+
+
+def current_priority() -> int:
+    shared = _shared_call.get()
+    return shared.priority if shared is not None else _llm_context.get()[1]
+
+
+def shared_call_context() -> tuple[contextvars.Context, SharedCall]:
+    """Контекст для задачи общего вызова: копия текущего с приоритетом, который повышают присоединившиеся.
+    Вложенный общий вызов остается частью внешнего"""
+    context = contextvars.copy_context()
+    shared = _shared_call.get()
+    if shared is None:
+        shared = SharedCall(*_llm_context.get())
+        context.run(_shared_call.set, shared)
+    return context, shared
+
+
+@contextmanager
+def llm_context(user_id: int | None = None, priority: int | None = None):
+    """От чьего имени и с каким приоритетом выполняются запросы к LLM внутри блока; не заданное
+    значение берется из внешнего блока"""
+    current_user, current_priority = _llm_context.get()
+    token = _llm_context.set((current_user if user_id is None else user_id,
+                              current_priority if priority is None else priority))
+    try:
+        yield
+    finally:
+        _llm_context.reset(token)
+
+
+def estimate_tokens(messages: list[dict], completion_tokens: int = 600) -> int:
+    """Оценка токенов запроса до ответа (~4 символа на токен), уточняется по usage после ответа"""
+    return sum(len(str(message["content"])) for message in messages) // 4 + completion_tokens
+
+
+class Ticket:
+    __slots__ = ("key", "priority", "tokens", "future")
+
+    def __init__(self, key, priority: int, tokens: int, future: asyncio.Future):
+        self.key = key
+        self.priority = priority
+        self.tokens = tokens
+        self.future = future
+
+
+class LLMScheduler:
+    """Допуск запросов к LLM: не больше max_concurrency одновременно, у каждого пользователя не больше одного
+    запроса в работе, очереди пользователей обслуживаются по кругу, более важный приоритет - всегда раньше.
+    tokens_per_minute - общий бюджет токенов в минуту (квота Mistral), 0 - без ограничения"""
+
+    def __init__(self, max_concurrency: int = 8, tokens_per_minute: int = 0):
+        self._max_concurrency = max_concurrency
+        self._tokens_per_minute = tokens_per_minute
+        self._tokens = float(tokens_per_minute)
+        self._refilled = time.monotonic()
+        self._refill_timer: asyncio.TimerHandle | None = None
+        # приоритет -> пользователь -> очередь его запросов; порядок пользователей - очередность обслуживания
+        self._queues: dict[int, OrderedDict] = {priority: OrderedDict() for priority in PRIORITY_NAMES}
+        self._active = 0
+        self._active_users: dict[int, int] = {}
+        self.granted = 0
+        self.throttled = 0
+
+    async def acquire(self, tokens: int) -> Ticket:
+        user_id, priority = _llm_context.get()
+        shared = _shared_call.get()
+        if shared is not None:
+            user_id, priority = shared.user_id, shared.priority
+        # Запросы без пользователя (фоновые и спекулятивные) не ограничиваются местом в работе на пользователя
+        key = None if priority == PRIORITY_BACKGROUND else user_id
+        ticket = Ticket(key, priority, tokens, asyncio.get_running_loop().create_future())
+        self._queues[priority].setdefault(key, deque()).append(ticket)
+        if shared is not None:
+            shared._queued[ticket] = self
+        self._dispatch()
+        try:
+            await ticket.future
+        except asyncio.CancelledError:
+            if ticket.future.done() and not ticket.future.cancelled():
+                self.release(ticket, 0)
+            else:
+                self._remove(ticket)
+            raise
+        finally:
+            if shared is not None:
+                shared._queued.pop(ticket, None)
+        return ticket
+
+    def promote(self, ticket: Ticket, priority: int) -> None:
+        """Перенести ждущий запрос в очередь более важного приоритета"""
+        if ticket.future.done() or priority >= ticket.priority:
+            return
+        self._remove(ticket)
+        ticket.priority = priority
+        self._queues[priority].setdefault(ticket.key, deque()).append(ticket)
+        self._dispatch()
+
+    def release(self, ticket: Ticket, used_tokens: int | None = None) -> None:
+        """used_tokens - фактический расход по usage ответа; разница с оценкой возвращается в бюджет"""
+        self._active -= 1
+        if ticket.key is not None:
+            self._active_users[ticket.key] -= 1
+            if not self._active_users[ticket.key]:
+                del self._active_users[ticket.key]
+        if used_tokens is not None and self._tokens_per_minute:
+            self._refill()
+            self._tokens = min(self._tokens + ticket.tokens - used_tokens, self._tokens_per_minute)
+        self._dispatch()
+
+    def _remove(self, ticket: Ticket) -> None:
+        queues = self._queues[ticket.priority]
+        queue = queues.get(ticket.key)
+        if queue is not None and ticket in queue:
+            queue.remove(ticket)
+            if not queue:
+                del queues[ticket.key]
+
+    def _next(self) -> Ticket | None:
+        for queues in self._queues.values():
+            for key, queue in queues.items():
+                if key is None or key not in self._active_users:
+                    return queue[0]
+        return None
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self._tokens_per_minute,
+                           self._tokens + (now - self._refilled) * self._tokens_per_minute / 60)
+        self._refilled = now
+
+    def _take_tokens(self, tokens: int) -> bool:
+        if not self._tokens_per_minute:
+            return True
+        # Запрос больше минутной квоты иначе ждал бы вечно
+        tokens = min(tokens, self._tokens_per_minute)
+        self._refill()
+        if self._tokens >= tokens:
+            self._tokens -= tokens
+            return True
+        if self._refill_timer is None:
+            delay = (tokens - self._tokens) * 60 / self._tokens_per_minute
+            self._refill_timer = asyncio.get_running_loop().call_later(delay, self._on_refill)
+        return False
+
+    def _on_refill(self) -> None:
+        self._refill_timer = None
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        while self._active < self._max_concurrency:
+            ticket = self._next()
+            if ticket is None:
+                return
+            # Первый в очереди ждет токенов, а не пропускает вперед запросы поменьше: иначе большие не пройдут никогда
+            if not self._take_tokens(ticket.tokens):
+                self.throttled += 1
+                return
+            queues = self._queues[ticket.priority]
+            queue = queues[ticket.key]
+            queue.popleft()
+            if queue:
+                queues.move_to_end(ticket.key)
+            else:
+                del queues[ticket.key]
+            self._active += 1
+            if ticket.key is not None:
+                self._active_users[ticket.key] = self._active_users.get(ticket.key, 0) + 1
+            self.granted += 1
+            ticket.future.set_result(None)
+
+    def stats(self) -> dict:
+        stats = {
+            "active": self._active,
+            "queued": {PRIORITY_NAMES[priority]: sum(len(queue) for queue in queues.values())
+                       for priority, queues in self._queues.items()},
+            "granted": self.granted,
+            "throttled": self.throttled,
+        }
+        if self._tokens_per_minute:
+            self._refill()
+            stats["tokens_available"] = self._tokens
+        return stats
+
+
+class UserRequests:
+    """Запросы, которые сейчас выполняются для пользователя: повторное нажатие той же кнопки, пока первое
+    не обработано, не запускает вторую цепочку запросов к LLM"""
+
+    def __init__(self):
+        self._active: set[tuple[int, str]] = set()
+        self.dropped = 0
+
+    @contextmanager
+    def claim(self, user_id: int, kind: str):
+        """Внутри блока True, если запрос можно выполнять, и False, если такой же уже выполняется"""
+        key = (user_id, kind)
+        if key in self._active:
+            self.dropped += 1
+            yield False
+            return
+        self._active.add(key)
+        try:
+            yield True
+        finally:
+            self._active.discard(key)
+
+    def stats(self) -> dict:
+        return {"active": len(self._active), "dropped": self.dropped}
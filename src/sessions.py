@@ -0,0 +1,278 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from src.asked_questions import AskedQuestionIndex
+from src.history import ConversationHistory
+
+DEFAULT_SESSIONS_PATH = os.path.join("storage", "sessions.sqlite")
+
+
+def encode_session(session: dict) -> str:
+    """Сессия в JSON: история и заданные вопросы сериализуются своими методами"""
+    data = dict(session)
+    data["conversation_history"] = session["conversation_history"].to_dict()
+    user_data = dict(session["user_data"])
+    if "asked_questions" in user_data:
+        user_data["asked_questions"] = user_data["asked_questions"].to_dict()
+    data["user_data"] = user_data
+    return json.dumps(data, ensure_ascii=False)
+
+
+def decode_session(payload: str) -> dict:
+    session = json.loads(payload)
+    session["conversation_history"] = ConversationHistory.from_dict(session["conversation_history"])
+    user_data = session["user_data"]
+    if "asked_questions" in user_data:
+        user_data["asked_questions"] = AskedQuestionIndex.from_dict(user_data["asked_questions"])
+    return session
+
+
+class MemorySessionStore:
+    """Сессии в памяти процесса: LRU с ограничением числа сессий и вытеснением после простоя idle_ttl секунд"""
+
+    def __init__(self, max_sessions: int = 1000, idle_ttl: float = 3600):
+        self._max_sessions = max_sessions
+        self._idle_ttl = idle_ttl
+        # user_id -> (сессия, время последнего обращения), порядок - от давно не использованных к свежим
+        self._sessions: OrderedDict[int, tuple[dict, float]] = OrderedDict()
+        self._loading: dict[int, asyncio.Future] = {}
+        # Сессии, с которыми сейчас работают обработчики: их не вытесняем, иначе изменения потеряются
+        self._pinned: dict[int, int] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evicted_idle = 0
+        self.evicted_capacity = 0
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    async def get(self, user_id: int) -> dict | None:
+        entry = self._sessions.get(user_id)
+        if entry is not None and time.monotonic() - entry[1] > self._idle_ttl:
+            self._evict(user_id)
+            self.evicted_idle += 1
+            entry = None
+        if entry is not None:
+            self.hits += 1
+            self._remember(user_id, entry[0])
+            return entry[0]
+
+        self.misses += 1
+        # Параллельные сообщения пользователя ждут одну загрузку и получают один и тот же объект сессии
+        task = self._loading.get(user_id)
+        if task is None:
+            task = self._loading[user_id] = asyncio.ensure_future(self._load(user_id))
+            task.add_done_callback(lambda _: self._loading.pop(user_id, None))
+        session = await task
+        if session is not None and user_id not in self._sessions:
+            self._remember(user_id, session)
+        return session
+
+    async def set(self, user_id: int, session: dict) -> None:
+        self._remember(user_id, session)
+        self.mark_dirty(user_id)
+
+    async def delete(self, user_id: int) -> None:
+        self._sessions.pop(user_id, None)
+
+    def pin(self, user_id: int) -> None:
+        """Начало обработки сообщения пользователя"""
+        self._pinned[user_id] = self._pinned.get(user_id, 0) + 1
+
+    def release(self, user_id: int) -> None:
+        """Конец обработки сообщения: сессия могла измениться"""
+        self._pinned[user_id] -= 1
+        if not self._pinned[user_id]:
+            del self._pinned[user_id]
+        self.mark_dirty(user_id)
+
+    def mark_dirty(self, user_id: int) -> None:
+        """Сессия изменена обработчиком; хранилищам с диском нужно ее записать"""
+
+    async def flush(self) -> None:
+        pass
+
+    async def close(self) -> None:
+        await self.flush()
+
+    async def run(self, interval: float = 60) -> None:
+        """Фоновое вытеснение простаивающих сессий и запись изменений"""
+        while True:
+            await asyncio.sleep(interval)
+            self.evict_idle()
+            await self.flush()
+
+    def evict_idle(self) -> None:
+        deadline = time.monotonic() - self._idle_ttl
+        for user_id, (_, accessed) in list(self._sessions.items()):
+            if accessed > deadline:
+                break
+            if user_id not in self._pinned:
+                self._evict(user_id)
+                self.evicted_idle += 1
+
+    async def _load(self, user_id: int) -> dict | None:
+        return None
+
+    def _remember(self, user_id: int, session: dict) -> None:
+        self._sessions[user_id] = (session, time.monotonic())
+        self._sessions.move_to_end(user_id)
+        if len(self._sessions) <= self._max_sessions:
+            return
+        for candidate in list(self._sessions):
+            if len(self._sessions) <= self._max_sessions:
+                break
+            if candidate not in self._pinned:
+                self._evict(candidate)
+                self.evicted_capacity += 1
+
+    def _evict(self, user_id: int) -> None:
+        self._sessions.pop(user_id, None)
+
+    def stats(self) -> dict:
+        return {
+            "sessions": len(self._sessions),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evicted_idle": self.evicted_idle,
+            "evicted_capacity": self.evicted_capacity,
+        }
+
+
+class SqliteSessionStore(MemorySessionStore):
+    """Сессии в SQLite с кешем в памяти: сессия загружается при первом сообщении пользователя,
+    изменения пишутся пачками раз в flush_interval секунд (write-behind). Файл в режиме WAL можно
+    открывать из нескольких процессов, если сообщения одного пользователя обрабатывает один процесс"""
+
+    def __init__(self, path: str = DEFAULT_SESSIONS_PATH, max_sessions: int = 1000, idle_ttl: float = 3600,
+                 session_ttl: float = 30 * 24 * 3600, flush_interval: float = 2.0):
+        super().__init__(max_sessions, idle_ttl)
+        self._session_ttl = session_ttl
+        self._flush_interval = flush_interval
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "user_id INTEGER PRIMARY KEY, payload TEXT NOT NULL, updated REAL NOT NULL)"
+        )
+        self._db.commit()
+        self._db_lock = threading.Lock()
+        self._dirty: set[int] = set()
+        # Сериализованные сессии, вытесненные из памяти до записи на диск; None - удаление
+        self._pending: dict[int, str | None] = {}
+        # Изменения, которые сейчас пишутся на диск
+        self._writing: dict[int, str | None] = {}
+        self.loads = 0
+        self.writes = 0
+        self.flushes = 0
+
+    def mark_dirty(self, user_id: int) -> None:
+        if user_id in self._sessions:
+            self._dirty.add(user_id)
+
+    async def delete(self, user_id: int) -> None:
+        await super().delete(user_id)
+        self._dirty.discard(user_id)
+        self._pending[user_id] = None
+
+    def _evict(self, user_id: int) -> None:
+        entry = self._sessions.pop(user_id, None)
+        if entry is not None and user_id in self._dirty:
+            self._dirty.discard(user_id)
+            self._pending[user_id] = encode_session(entry[0])
+
+    async def _load(self, user_id: int) -> dict | None:
+        if user_id in self._pending:
+            payload = self._pending[user_id]
+        elif user_id in self._writing:
+            payload = self._writing[user_id]
+        else:
+            payload = await asyncio.to_thread(self._select, user_id)
+            self.loads += 1
+        return decode_session(payload) if payload is not None else None
+
+    def _select(self, user_id: int) -> str | None:
+        with self._db_lock:
+            row = self._db.execute(
+                "SELECT payload FROM sessions WHERE user_id = ? AND updated >= ?",
+                (user_id, time.time() - self._session_ttl)
+            ).fetchone()
+        return row[0] if row else None
+
+    async def flush(self) -> None:
+        changes = dict(self._pending)
+        for user_id in self._dirty:
+            changes[user_id] = encode_session(self._sessions[user_id][0])
+        self._dirty.clear()
+        self._pending.clear()
+        if not changes:
+            return
+        self._writing = changes
+        try:
+            await asyncio.to_thread(self._write, changes)
+        except Exception as e:
+            print(f"Не удалось сохранить сессии: {e}")
+            # Не теряем изменения: повторим при следующей записи, если не пришли более свежие
+            for user_id, payload in changes.items():
+                if user_id in self._sessions and payload is not None:
+                    self._dirty.add(user_id)
+                else:
+                    self._pending.setdefault(user_id, payload)
+            return
+        finally:
+            self._writing = {}
+        self.writes += len(changes)
+        self.flushes += 1
+
+    def _write(self, changes: dict[int, str | None]) -> None:
+        now = time.time()
+        with self._db_lock, self._db:
+            self._db.executemany(
+                "INSERT INTO sessions (user_id, payload, updated) VALUES (?, ?, ?) "
+                "ON CONFLICT(user_id) DO UPDATE SET payload = excluded.payload, updated = excluded.updated",
+                [(user_id, payload, now) for user_id, payload in changes.items() if payload is not None]
+            )
+            self._db.executemany(
+                "DELETE FROM sessions WHERE user_id = ?",
+                [(user_id,) for user_id, payload in changes.items() if payload is None]
+            )
+
+    def _delete_expired(self) -> None:
+        with self._db_lock, self._db:
+            self._db.execute("DELETE FROM sessions WHERE updated < ?", (time.time() - self._session_ttl,))
+
+    async def run(self, interval: float | None = None) -> None:
+        interval = interval or self._flush_interval
+        last_cleanup = time.monotonic()
+        while True:
+            await asyncio.sleep(interval)
+            self.evict_idle()
+            await self.flush()
+            if time.monotonic() - last_cleanup > 3600:
+                await asyncio.to_thread(self._delete_expired)
+                last_cleanup = time.monotonic()
+
+    async def close(self) -> None:
+        await self.flush()
+        with self._db_lock:
+            self._db.close()
+
+    def stats(self) -> dict:
+        return {**super().stats(), "loads": self.loads, "writes": self.writes, "flushes": self.flushes,
+                "pending": len(self._pending) + len(self._dirty)}
+
+
+def create_session_store(kind: str = "sqlite", path: str = DEFAULT_SESSIONS_PATH, max_sessions: int = 1000,
+                         idle_ttl: float = 3600, session_ttl: float = 30 * 24 * 3600,
+                         flush_interval: float = 2.0) -> MemorySessionStore:
+    if kind == "memory":
+        return MemorySessionStore(max_sessions, idle_ttl)
+    if kind == "sqlite":
+        return SqliteSessionStore(path, max_sessions, idle_ttl, session_ttl, flush_interval)
+    raise ValueError(f"Неизвестное хранилище сессий: {kind}")
@@ -0,0 +1,120 @@
+import asyncio
+
+from src.scheduler import current_priority, shared_call_context
+
+
+class _Broadcast:
+    """Куски потокового ответа для всех, кто его ждет: подключившийся позже получает уже пришедшие куски"""
+
+    def __init__(self):
+        self.parts: list = []
+        self.done = False
+        self.error: BaseException | None = None
+        self._changed = asyncio.Event()
+
+    def push(self, part) -> None:
+        self.parts.append(part)
+        self._notify()
+
+    def finish(self, error: BaseException | None = None) -> None:
+        self.done = True
+        self.error = error
+        self._notify()
+
+    def _notify(self) -> None:
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def follow(self):
+        position = 0
+        while True:
+            while position < len(self.parts):
+                yield self.parts[position]
+                position += 1
+            if self.done:
+                if self.error is not None:
+                    raise self.error
+                return
+            await self._changed.wait()
+
+
+async def _pump(chunks, broadcast: _Broadcast) -> None:
+    try:
+        async for chunk in chunks:
+            broadcast.push(chunk)
+    except BaseException as e:
+        broadcast.finish(e)
+        raise
+    broadcast.finish()
+
+
+def _retrieve_error(task: asyncio.Task) -> None:
+    # Ошибку уже получил потребитель через _Broadcast
+    if not task.cancelled():
+        task.exception()
+
+
+async def buffered(chunks):
+    """Асинхронный генератор chunks, который читается отдельной задачей в буфер: медленный потребитель
+    не задерживает источник. Если потребитель прекратил чтение, источник отменяется"""
+    broadcast = _Broadcast()
+    task = asyncio.ensure_future(_pump(chunks, broadcast))
+    task.add_done_callback(_retrieve_error)
+    try:
+        async for chunk in broadcast.follow():
+            yield chunk
+    finally:
+        task.cancel()
+
+
+class SingleFlight:
+    """Одинаковые одновременные вызовы (по ключу из нормализованных аргументов): к внешнему сервису уходит
+    только первый, остальные получают его результат или ошибку. Вызов выполняется отдельной задачей, поэтому
+    отмена одного из ожидающих не прерывает его для остальных; приоритет его запросов к LLM - самый важный
+    из приоритетов ожидающих, а не приоритет первого"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._flights: dict = {}
+        self.calls = 0
+        self.shared = 0
+
+    def _start(self, key, coro) -> asyncio.Task:
+        context, shared = shared_call_context()
+        task = asyncio.get_running_loop().create_task(coro, context=context)
+        task.shared_call = shared
+        self._flights[key] = task
+        task.add_done_callback(lambda done: self._finish(key, done))
+        self.calls += 1
+        return task
+
+    def _finish(self, key, task: asyncio.Task) -> None:
+        if self._flights.get(key) is task:
+            del self._flights[key]
+        # Ошибку могли не забрать, если все ожидающие были отменены
+        if not task.cancelled():
+            task.exception()
+
+    async def do(self, key, func, *args, **kwargs):
+        task = self._flights.get(key)
+        if task is None:
+            task = self._start(key, func(*args, **kwargs))
+        else:
+            self.shared += 1
+            task.shared_call.join(current_priority())
+        return await asyncio.shield(task)
+
+    def stream(self, key, make_chunks):
+        """Асинхронный генератор кусков make_chunks(), общий для одновременных вызовов с одинаковым ключом"""
+        task = self._flights.get(key)
+        if task is None:
+            broadcast = _Broadcast()
+            task = self._start(key, _pump(make_chunks(), broadcast))
+            task.broadcast = broadcast
+        else:
+            self.shared += 1
+            task.shared_call.join(current_priority())
+        return task.broadcast.follow()
+
+    def stats(self) -> dict:
+        return {"calls": self.calls, "shared": self.shared, "in_flight": len(self._flights)}
@@ -0,0 +1,91 @@
+import asyncio
+import time
+
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+from aiogram.types import Message
+
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+
+def split_message(text: str, limit: int = TELEGRAM_MESSAGE_LIMIT) -> list[str]:
+    """Разбиение текста на части не длиннее limit: по абзацам, строкам или словам"""
+    parts = []
+    while len(text) > limit:
+        window = text[:limit]
+        # Разрез ищем во второй половине окна, чтобы не плодить короткие сообщения
+        for separator in ("\n\n", "\n", " "):
+            cut = window.rfind(separator, limit // 2)
+            if cut > 0:
+                break
+        else:
+            cut = limit
+        parts.append(text[:cut])
+        text = text[cut:].lstrip()
+    parts.append(text)
+    return parts
+
+
+class TelegramStreamWriter:
+    """Ответ модели в Telegram по мере генерации: сообщение-заглушка редактируется не чаще раза
+    в min_interval секунд, при переполнении лимита Telegram продолжение уходит новым сообщением"""
+
+    def __init__(self, message: Message, prefix: str = "", min_interval: float = 1.0, min_delta: int = 40,
+                 limit: int = TELEGRAM_MESSAGE_LIMIT):
+        self._message = message
+        self._prefix = prefix
+        self._min_interval = min_interval
+        self._min_delta = min_delta
+        self._limit = limit
+        self._sent: list[Message] = []
+        self._shown: list[str] = []
+        self._rendered_length = 0
+        self._next_edit = 0.0
+        self.text = ""
+
+    async def start(self, placeholder: str) -> None:
+        self._sent.append(await self._message.answer(placeholder))
+        self._shown.append(placeholder)
+
+    async def feed(self, chunk: str) -> None:
+        self.text += chunk
+        if time.monotonic() >= self._next_edit and len(self.text) - self._rendered_length >= self._min_delta:
+            await self._render(final=False)
+
+    async def finish(self) -> None:
+        if not self.text:
+            return
+        await self._render(final=True)
+
+    async def _render(self, final: bool) -> None:
+        self._rendered_length = len(self.text)
+        self._next_edit = time.monotonic() + self._min_interval
+        for i, part in enumerate(split_message(self._prefix + self.text, self._limit)):
+            if i < len(self._shown) and self._shown[i] == part:
+                continue
+            edit = i < len(self._sent)
+            while True:
+                try:
+                    if edit:
+                        await self._sent[i].edit_text(part)
+                    elif i < len(self._sent):
+                        self._sent[i] = await self._message.answer(part)
+                    else:
+                        self._sent.append(await self._message.answer(part))
+                        self._shown.append(part)
+                    self._shown[i] = part
+                    break
+                except TelegramRetryAfter as e:
+                    # Промежуточные правки можно пропустить, финальный текст дожидается разрешения Telegram
+                    self._next_edit = time.monotonic() + e.retry_after
+                    if not final:
+                        return
+                    await asyncio.sleep(e.retry_after)
+                except TelegramBadRequest as e:
+                    if not edit:
+                        raise
+                    if "message is not modified" in str(e):
+                        self._shown[i] = part
+                        break
+                    # Сообщение удалено или его больше нельзя редактировать: эта часть уходит новым сообщением
+                    print(f"Не удалось отредактировать сообщение, отправляю новое: {e}")
+                    edit = False
@@ -1,5 +1,8 @@
 import os
 import asyncio
+import contextvars
+import signal
+import time
 from typing import Any, Coroutine
 
 import aiohttp
@@ -11,58 +14,136 @@ from aiogram.utils.keyboard import ReplyKeyboardBuilder
 from dotenv import load_dotenv
 import json
 import random
-from src.rag_agent import RagAgent
-from llama_index import SimpleDirectoryReader
-from tenacity import retry, stop_after_attempt, wait_exponential
+from src import agent_factory
+from src.agent_factory import EXCLUDED_QUESTIONS_LIMIT, MAX_QUESTION_ATTEMPTS, MISTRAL_API_KEY, create_rag_agent
+from src.asked_questions import AskedQuestionIndex
+from src.history import ConversationHistory
+from src.metrics import (REGISTRY, STARTUP, configure_prices, configure_trace_log, record_cache, record_startup,
+                         start_metrics_server, startup_elapsed, timed, trace)
+from src.question_pool import DEFAULT_POOL_PATH, QuestionPool
+from src.interview_profile import InterviewProfile
+from src.resilience import CircuitOpenError, retry_budget
+from src.scheduler import PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE, PRIORITY_QUESTION, UserRequests, llm_context
+from src.sessions import create_session_store
+from src.webhook import feed_updates, run_webhook
+from src.streaming import TelegramStreamWriter
 
 load_dotenv()
 
 TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
-MISTRAL_API_KEY = os.getenv('MISTRAL_API_KEY')
+QUESTION_POOL_SIZE = int(os.getenv('QUESTION_POOL_SIZE', '5'))
+# Файл пула готовых вопросов; в режиме нескольких процессов у каждого процесса свой
+QUESTION_POOL_PATH = os.getenv('QUESTION_POOL_PATH', DEFAULT_POOL_PATH)
+# Бюджет токенов для дословной части истории диалога в промптах
+HISTORY_TOKEN_BUDGET = int(os.getenv('HISTORY_TOKEN_BUDGET', '2000'))
+# Подготовка следующего вопроса в фоне, пока кандидат отвечает на текущий
+QUESTION_PREFETCH = os.getenv('QUESTION_PREFETCH', '1') == '1'
+# Сколько вопросов процесс готовит заранее одновременно; остальные получат вопрос обычным путем
+QUESTION_PREFETCH_MAX_IN_FLIGHT = int(os.getenv('QUESTION_PREFETCH_MAX_IN_FLIGHT', '8'))
+# Через сколько секунд повторить загрузку базы знаний, если она не удалась
+AGENT_INIT_RETRY_DELAY = float(os.getenv('AGENT_INIT_RETRY_DELAY', '60'))
+# Потоковый вывод ответов: сообщение редактируется по мере генерации не чаще раза в STREAM_EDIT_INTERVAL секунд
+STREAM_RESPONSES = os.getenv('STREAM_RESPONSES', '1') == '1'
+STREAM_EDIT_INTERVAL = float(os.getenv('STREAM_EDIT_INTERVAL', '1.0'))
+# Хранилище сессий: sqlite (переживает перезапуск, общий файл для нескольких процессов) или memory
+SESSION_BACKEND = os.getenv('SESSION_BACKEND', 'sqlite')
+SESSION_DB_PATH = os.getenv('SESSION_DB_PATH', os.path.join('storage', 'sessions.sqlite'))
+# Сколько сессий держать в памяти и через сколько секунд простоя выгружать сессию из памяти
+SESSION_MAX_IN_MEMORY = int(os.getenv('SESSION_MAX_IN_MEMORY', '1000'))
+SESSION_IDLE_TTL = float(os.getenv('SESSION_IDLE_TTL', '3600'))
+# Сколько хранится на диске сессия без активности
+SESSION_TTL = float(os.getenv('SESSION_TTL', str(30 * 24 * 3600)))
+# Получение обновлений: polling (long polling) или webhook (aiohttp-сервер, можно несколько экземпляров за балансировщиком)
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+# Публичный адрес бота для регистрации вебхука; если пустой, вебхук должен быть зарегистрирован заранее
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '')
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8080'))
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET') or None
+WEBHOOK_WORKERS = int(os.getenv('WEBHOOK_WORKERS', '16'))
+WEBHOOK_QUEUE_SIZE = int(os.getenv('WEBHOOK_QUEUE_SIZE', '1000'))
+# Сколько секунд при остановке ждать обработки уже принятых обновлений
+SHUTDOWN_DRAIN_TIMEOUT = float(os.getenv('SHUTDOWN_DRAIN_TIMEOUT', '60'))
+# Локальный HTTP-сервер с метриками в формате Prometheus (GET /metrics); 0 - не запускать
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '9100'))
+# Структурированные трассы обработки сообщений (JSON по строке): путь к файлу или "-" для stdout
+TRACE_LOG = os.getenv('TRACE_LOG', '')
+# Цена Mistral в долларах за миллион входных и выходных токенов для оценки стоимости
+MISTRAL_PROMPT_PRICE = float(os.getenv('MISTRAL_PROMPT_PRICE', '0.1'))
+MISTRAL_COMPLETION_PRICE = float(os.getenv('MISTRAL_COMPLETION_PRICE', '0.3'))
 
 if not TELEGRAM_BOT_TOKEN:
     raise ValueError("TELEGRAM_BOT_TOKEN не найден в .env файле")
 if not MISTRAL_API_KEY:
     raise ValueError("MISTRAL_API_KEY не найден в .env файле")
 
+configure_prices(MISTRAL_PROMPT_PRICE, MISTRAL_COMPLETION_PRICE)
+configure_trace_log(TRACE_LOG)
+
 dp = Dispatcher()
-docs = SimpleDirectoryReader(input_dir="rag_data").load_data()
-interview_sessions = {}
+POSITIONS = ["Data Science", "Machine Learning", "Data Analysis", "Software Engineering"]
+LEVELS = ["Junior", "Middle", "Senior"]
+sessions = create_session_store(SESSION_BACKEND, SESSION_DB_PATH, SESSION_MAX_IN_MEMORY, SESSION_IDLE_TTL,
+                                SESSION_TTL)
+REGISTRY.register_collector("sessions", sessions.stats)
+user_requests = UserRequests()
+REGISTRY.register_collector("user_requests", user_requests.stats)
+
+
+def error_reply(error: Exception) -> str:
+    """Ответ пользователю, когда запрос не удался даже после повторов"""
+    if isinstance(error, CircuitOpenError):
+        return ("Сервис ответов сейчас перегружен или недоступен. Попробуйте снова примерно через "
+                f"{max(1, round(error.retry_in))} с")
+    return ("Произошла техническая ошибка! Проверьте подключение к интернету и попробуйте снова через "
+            "некоторое время")
 
 
 class InterviewAgent:
-    def __init__(self) -> None:
+    def __init__(self, **rag_options) -> None:
+        """rag_options переопределяют параметры RagAgent из настроек окружения"""
         print('Начало инициализации рага')
-        self.rag_agent = RagAgent(docs, MISTRAL_API_KEY)
+        # llama_index, langchain и mistralai импортируются несколько секунд: это происходит в фоне при
+        # инициализации агента, а бот тем временем уже отвечает на сообщения
+        self.rag_agent = create_rag_agent(**rag_options)
+        self.question_pool = QuestionPool(
+            self.generate_pool_question,
+            [(position, level) for position in POSITIONS for level in LEVELS],
+            path=QUESTION_POOL_PATH,
+            target_size=QUESTION_POOL_SIZE,
+            low_watermark=max(1, QUESTION_POOL_SIZE // 2)
+        )
+        # user_id -> задача подготовки следующего вопроса
+        self._prefetch_tasks: dict[int, asyncio.Task] = {}
+        self.prefetch_started = 0
+        self.prefetch_used = 0
+        self.prefetch_discarded = 0
+        self.prefetch_skipped = 0
+        self.prefetch_failed = 0
         print('Инициализация бота завершена')
 
-    @retry(
-        stop=stop_after_attempt(5),
-        wait=wait_exponential(multiplier=1, min=1, max=10)
-    )
-    async def get_question_reliable(self, message_history):
-        return self.rag_agent.get_next_interview_question(message_history=message_history)
+    async def generate_pool_question(self, position: str, level: str, exclude=()):
+        profile = InterviewProfile(interview_scope=position, difficulty=level)
+        # Фоновое пополнение пула не связано с сообщением пользователя, у каждого вопроса свой бюджет
+        with retry_budget(), llm_context(priority=PRIORITY_BACKGROUND):
+            return await self.get_question_reliable(profile, "", exclude)
 
-    @retry(
-        stop=stop_after_attempt(5),
-        wait=wait_exponential(multiplier=1, min=1, max=10)
-    )
-    async def check_correctness_reliable(self, question, rag_ans, ans):
-        return self.rag_agent.check_answer_correctness(question, rag_ans, ans)
+    async def get_question_reliable(self, profile, message_history, exclude=()):
+        return await agent_factory.get_question_reliable(self.rag_agent, profile, message_history, exclude)
 
-    @retry(
-        stop=stop_after_attempt(5),
-        wait=wait_exponential(multiplier=1, min=1, max=10)
-    )
-    async def get_answer_reliable(self, question, message_history):
-        return self.rag_agent.get_detailed_answer(question, message_history)
+    async def check_correctness_reliable(self, profile, question, rag_ans, ans):
+        return await self.rag_agent.check_answer_correctness(profile, question, rag_ans, ans)
+
+    async def get_answer_reliable(self, profile, question, message_history):
+        return await self.rag_agent.get_detailed_answer(profile, question, message_history)
 
     async def start_interview(self, user_data: dict) -> tuple[str, Any] | str:
         """Начало интервью с представлением"""
         position = user_data.get('position', 'Data Science')
         level = user_data.get('level', 'Junior')
         name = user_data.get('name', '')
-        self.rag_agent.set_user_info(name, position, level)
         
         # Локальный шаблон вместо вызова API для надежности
         welcome_templates = {
@@ -89,7 +170,7 @@ class InterviewAgent:
         }
         
         template = welcome_templates.get(position, welcome_templates["Data Science"])
-        user_data["asked_questions"] = []
+        user_data["asked_questions"] = AskedQuestionIndex()
         question = await self.next_question(user_data, "")
 
         return template.get(level, template["Junior"]), question
@@ -97,68 +178,299 @@ class InterviewAgent:
 
 
     
-    async def next_question(self, user_data: dict, message_history) -> Any | str:
+    async def next_question(self, user_data: dict, message_history, user_id: int | None = None) -> Any | str:
         """Следующий вопрос на основе истории"""
 
-        attempts = 500
+        profile = InterviewProfile.from_user_data(user_data)
+        # Сессия, начатая до появления списка заданных вопросов, получает пустой список, а не KeyError
+        asked = user_data.setdefault("asked_questions", AskedQuestionIndex())
         try:
-            for _ in range(attempts):
-                question = await self.get_question_reliable(message_history)
-                if question['question'] not in user_data["asked_questions"]:
-                    user_data["asked_questions"].append(question['question'])
+            question = await self.take_prefetched(user_id, user_data, profile) if user_id is not None else None
+            if question is None:
+                question = self.question_pool.take(profile.interview_scope, profile.difficulty, exclude=asked)
+                record_cache("question_pool", question is not None)
+            # История (и ее сжатие запросом к LLM) нужна, только если вопрос приходится генерировать сейчас
+            history_text = None
+            for _ in range(MAX_QUESTION_ATTEMPTS):
+                if question is None:
+                    if history_text is None:
+                        history_text = await self.render_history(message_history)
+                    question = await self.get_question_reliable(profile, history_text,
+                                                                 asked.recent(EXCLUDED_QUESTIONS_LIMIT))
+                embedding = await self.embed_question(question['question'])
+                if asked.find_duplicate(question['question'], embedding) is None:
+                    asked.add(question['question'], embedding)
                     return question
+                question = None
             else:
                 return "Отлично! Мы обсудили основные темы. Хотите задать свой вопрос или завершить интервью?"
         except Exception as e:
             print(f"Все попытки не удались: {e}")
-            return ("Произошла техническая ошибка! Проверьте подключение к интернету и попробуйте снова через "
-                    "некоторое время")
+            return error_reply(e)
+
+    def prefetch_question(self, user_id: int, user_data: dict, message_history, on_ready=None) -> None:
+        """Начать готовить следующий вопрос, пока кандидат отвечает на текущий. Результат сохраняется в
+        user_data["prefetched_question"] вместе с темой и сложностью, для которых он получен; on_ready()
+        вызывается после сохранения"""
+        if not QUESTION_PREFETCH or user_id in self._prefetch_tasks or "prefetched_question" in user_data:
+            return
+        profile = InterviewProfile.from_user_data(user_data)
+        # Из пула следующий вопрос и так достанется мгновенно
+        if self.question_pool.size(profile.interview_scope, profile.difficulty) > 0:
+            return
+        if len(self._prefetch_tasks) >= QUESTION_PREFETCH_MAX_IN_FLIGHT:
+            self.prefetch_skipped += 1
+            return
+        self.prefetch_started += 1
+        # Пустой контекст: у подготовки свой бюджет повторов и своя трасса, а не те, что у отправившего
+        # вопрос сообщения
+        task = contextvars.Context().run(
+            asyncio.create_task, self._prefetch(user_id, user_data, profile, message_history, on_ready)
+        )
+        self._prefetch_tasks[user_id] = task
+        task.add_done_callback(
+            lambda done: self._prefetch_tasks.pop(user_id) if self._prefetch_tasks.get(user_id) is done else None
+        )
 
+    async def _prefetch(self, user_id: int, user_data: dict, profile: InterviewProfile, message_history,
+                        on_ready) -> None:
+        # Приоритет как у следующего вопроса, но без user_id: спекулятивный запрос не должен занимать место
+        # пользователя и задерживать оценку его ответа
+        with trace("prefetch.question", user_id=user_id), retry_budget(), \
+                llm_context(priority=PRIORITY_QUESTION):
+            try:
+                # История без сжатия: ради спекулятивного вопроса лишний запрос к LLM не делаем
+                history_text = message_history.render() if isinstance(message_history, ConversationHistory) \
+                    else str(message_history)
+                question = await self.get_question_reliable(
+                    profile, history_text, user_data["asked_questions"].recent(EXCLUDED_QUESTIONS_LIMIT)
+                )
+            except Exception as e:
+                self.prefetch_failed += 1
+                print(f"Не удалось заранее подготовить вопрос: {e}")
+                return
+        user_data["prefetched_question"] = {"scope": profile.interview_scope, "difficulty": profile.difficulty,
+                                            "question": question}
+        if on_ready is not None:
+            on_ready()
+
+    async def take_prefetched(self, user_id: int, user_data: dict, profile: InterviewProfile) -> dict | None:
+        """Заранее подготовленный вопрос; если подготовка еще идет, дожидаемся ее вместо нового запроса"""
+        task = self._prefetch_tasks.get(user_id)
+        if task is not None:
+            # wait, а не await: отмена подготовки при смене настроек не должна прерывать хендлер
+            with timed("prefetch.wait"):
+                await asyncio.wait({task})
+        prefetched = user_data.pop("prefetched_question", None)
+        if prefetched is None:
+            return None
+        if (prefetched["scope"], prefetched["difficulty"]) != (profile.interview_scope, profile.difficulty):
+            self.prefetch_discarded += 1
+            return None
+        self.prefetch_used += 1
+        record_cache("question_prefetch", True)
+        return prefetched["question"]
+
+    def cancel_prefetch(self, user_id: int, user_data: dict) -> None:
+        task = self._prefetch_tasks.pop(user_id, None)
+        if task is not None:
+            task.cancel()
+        if user_data.pop("prefetched_question", None) is not None:
+            self.prefetch_discarded += 1
+
+    def prefetch_stats(self) -> dict:
+        return {
+            "in_flight": len(self._prefetch_tasks),
+            "started": self.prefetch_started,
+            "used": self.prefetch_used,
+            "discarded": self.prefetch_discarded,
+            "skipped": self.prefetch_skipped,
+            "failed": self.prefetch_failed,
+        }
 
+    async def render_history(self, message_history) -> str:
+        """Ограниченный по размеру текст истории: старые реплики сворачиваются в резюме"""
+        if isinstance(message_history, ConversationHistory):
+            with timed("history.compact"):
+                await message_history.compact(self.rag_agent.summarize_history)
+            return message_history.render()
+        return str(message_history)
 
-    async def ask_theory_question(self, user_question: str, message_history: dict) -> str:
+    async def embed_question(self, question: str):
+        """Эмбеддинг для поиска перефразированных повторов; без него работает только точное сравнение"""
+        try:
+            return await self.rag_agent.embed_text(question)
+        except Exception as e:
+            print(f"Не удалось получить эмбеддинг вопроса: {e}")
+            return None
+
+    async def ask_theory_question(self, user_data: dict, user_question: str,
+                                  message_history: ConversationHistory) -> str:
         """Ответ на теоретический вопрос пользователя"""
+        profile = InterviewProfile.from_user_data(user_data)
         try:
-            answer = await self.get_answer_reliable(user_question, message_history)
+            # Пользователь ждет ответа: запросы к LLM идут раньше подготовки вопросов
+            with llm_context(priority=PRIORITY_INTERACTIVE):
+                history_text = await self.render_history(message_history)
+                answer = await self.get_answer_reliable(profile, user_question, history_text)
             return answer
 
         except Exception as e:
             print(f"Все попытки не удались: {e}")
-            return ("Произошла техническая ошибка! Проверьте подключение к интернету и попробуйте снова через "
-                    "некоторое время")
+            return error_reply(e)
     
-    async def analyze_answer(self, question: dict, user_answer: str) -> str:
+    async def analyze_answer(self, user_data: dict, question: dict, user_answer: str) -> str:
         """Анализ ответа пользователя"""
+        profile = InterviewProfile.from_user_data(user_data)
         try:
-            analysis = await self.check_correctness_reliable(question['question'], question['answer'], user_answer)
+            with llm_context(priority=PRIORITY_INTERACTIVE):
+                analysis = await self.check_correctness_reliable(profile, question['question'],
+                                                                 question['answer'], user_answer)
             return analysis
 
         except Exception as e:
             print(f"Все попытки не удались: {e}")
-            return ("Произошла техническая ошибка! Проверьте подключение к интернету и попробуйте снова через "
-                    "некоторое время")
-
-    async def change_settings(self, user_data: dict):
-        position = user_data.get('position', 'Data Science')
-        level = user_data.get('level', 'Junior')
-        name = user_data.get('name', '')
-        self.rag_agent.set_user_info(name, position, level)
+            return error_reply(e)
+
+    async def stream_reply(self, make_chunks, fallback, writer: TelegramStreamWriter) -> str:
+        """Вывод ответа по кускам; если поток упал до первого куска - обычный запрос с повторами.
+        Пользователь ждет этого ответа, поэтому запросы к LLM идут с интерактивным приоритетом"""
+        with llm_context(priority=PRIORITY_INTERACTIVE):
+            try:
+                async for chunk in make_chunks():
+                    await writer.feed(chunk)
+            except Exception as e:
+                print(f"Потоковый ответ не удался: {e}")
+                if writer.text:
+                    await writer.feed("\n\n⚠️ Ответ прерван из-за технической ошибки")
+                else:
+                    await writer.feed(await fallback())
+        await writer.finish()
+        return writer.text
+
+    async def stream_theory_answer(self, user_data: dict, user_question: str,
+                                   message_history: ConversationHistory, writer: TelegramStreamWriter) -> str:
+        """Потоковый ответ на теоретический вопрос пользователя"""
+        profile = InterviewProfile.from_user_data(user_data)
+
+        async def chunks():
+            history_text = await self.render_history(message_history)
+            async for chunk in self.rag_agent.stream_detailed_answer(profile, user_question, history_text):
+                yield chunk
+
+        return await self.stream_reply(
+            chunks, lambda: self.ask_theory_question(user_data, user_question, message_history), writer
+        )
 
+    async def stream_answer_analysis(self, user_data: dict, question: dict, user_answer: str,
+                                     writer: TelegramStreamWriter) -> str:
+        """Потоковый анализ ответа пользователя"""
+        profile = InterviewProfile.from_user_data(user_data)
+        return await self.stream_reply(
+            lambda: self.rag_agent.stream_answer_check(profile, question['question'], question['answer'],
+                                                       user_answer),
+            lambda: self.analyze_answer(user_data, question, user_answer),
+            writer
+        )
 
-interview_agent = InterviewAgent()
+    async def change_settings(self, user_data: dict, user_id: int | None = None):
+        """Смена темы или сложности: профиль берется из user_data при каждом запросе, сбрасываем историю вопросов
+        и заранее подготовленный вопрос для старых настроек"""
+        user_data["asked_questions"] = AskedQuestionIndex()
+        if user_id is not None:
+            self.cancel_prefetch(user_id, user_data)
+
+
+interview_agent: InterviewAgent | None = None
+agent_ready = asyncio.Event()
+agent_init_error: Exception | None = None
+# Время (time.monotonic) следующей попытки загрузки после ошибки
+agent_retry_at = 0.0
+background_tasks: set[asyncio.Task] = set()
+
+
+def register_agent_metrics(agent: InterviewAgent) -> None:
+    """Готовая статистика компонентов агента в /metrics"""
+    rag_agent = agent.rag_agent
+    REGISTRY.register_collector("question_pool", agent.question_pool.stats)
+    REGISTRY.register_collector("question_prefetch", agent.prefetch_stats)
+    REGISTRY.register_collector("llm_scheduler", rag_agent.scheduler.stats)
+    REGISTRY.register_collector("singleflight", rag_agent.singleflight_stats)
+    if rag_agent.response_cache is not None:
+        REGISTRY.register_collector("response_cache", rag_agent.response_cache.stats)
+    if rag_agent.answer_lookup is not None:
+        REGISTRY.register_collector("answer_lookup", rag_agent.answer_lookup.stats)
+    if hasattr(rag_agent.docs_backend, "stats"):
+        REGISTRY.register_collector("external_docs_cache", rag_agent.docs_backend.stats)
+
+
+async def warm_up_agent() -> None:
+    """Загрузка базы знаний и индекса в фоне, пока бот уже принимает сообщения; после ошибки - повтор через
+    AGENT_INIT_RETRY_DELAY секунд, а пользователи до тех пор получают сообщение с причиной"""
+    global interview_agent, agent_init_error, agent_retry_at
+    while True:
+        try:
+            agent = await asyncio.to_thread(InterviewAgent)
+            register_agent_metrics(agent)
+            background_tasks.add(asyncio.create_task(agent.question_pool.run()))
+            interview_agent = agent
+            agent_init_error = None
+            agent_ready.set()
+            return
+        except Exception as e:
+            print(f"Ошибка инициализации агента: {e}, повтор через {AGENT_INIT_RETRY_DELAY:.0f} с")
+            agent_init_error = e
+            agent_retry_at = time.monotonic() + AGENT_INIT_RETRY_DELAY
+            agent_ready.set()
+        await asyncio.sleep(AGENT_INIT_RETRY_DELAY)
+        agent_ready.clear()
+
+
+async def wait_for_agent(message: Message) -> InterviewAgent | None:
+    """Ожидание готовности агента для хендлеров, которым он нужен"""
+    if not agent_ready.is_set():
+        await message.answer("⏳ Загружаю базу знаний, это займет немного времени. "
+                             "Продолжу, как только все будет готово...")
+        await agent_ready.wait()
+    if interview_agent is None:
+        retry_in = max(1, round(agent_retry_at - time.monotonic()))
+        await message.answer("Произошла техническая ошибка при загрузке базы знаний: "
+                             f"{type(agent_init_error).__name__}: {str(agent_init_error)[:200]}\n"
+                             f"Повторная загрузка - примерно через {retry_in} с, попробуйте снова после нее")
+    return interview_agent
+
+@dp.message.outer_middleware()
+async def session_middleware(handler, event: Message, data: dict):
+    """Сессия загружается лениво в обработчике; после обработки сообщения она помечается измененной"""
+    user_id = event.from_user.id
+    sessions.pin(user_id)
+    try:
+        return await handler(event, data)
+    finally:
+        sessions.release(user_id)
+
+@dp.message.middleware()
+async def trace_middleware(handler, event: Message, data: dict):
+    """Трасса, общее время обработки сообщения хендлером, бюджет повторов на это сообщение и пользователь,
+    от имени которого планируются запросы к LLM"""
+    handler_object = data.get("handler")
+    name = handler_object.callback.__name__ if handler_object is not None else "message"
+    with trace(f"handler.{name}", user_id=event.from_user.id), retry_budget(), llm_context(event.from_user.id):
+        result = await handler(event, data)
+    if "first_update" not in STARTUP:
+        record_startup("first_update", startup_elapsed())
+    return result
 
 # Клавиатуры
 def get_positions_keyboard():
     keyboard = ReplyKeyboardBuilder()
-    positions = ["Data Science", "Machine Learning", "Data Analysis", "Software Engineering"]
-    for position in positions:
+    for position in POSITIONS:
         keyboard.add(KeyboardButton(text=position))
     return keyboard.as_markup(resize_keyboard=True)
 
 def get_levels_keyboard():
     keyboard = ReplyKeyboardBuilder()
-    levels = ["Junior", "Middle", "Senior"]
-    for level in levels:
+    for level in LEVELS:
         keyboard.add(KeyboardButton(text=level))
     return keyboard.as_markup(resize_keyboard=True)
 
@@ -194,12 +506,12 @@ async def start_interview_command(message: Message) -> None:
     user_id = message.from_user.id
     
     # Сброс сессии
-    interview_sessions[user_id] = {
+    await sessions.set(user_id, {
         "step": "awaiting_name",
-        "conversation_history": [],
+        "conversation_history": ConversationHistory(HISTORY_TOKEN_BUDGET),
         "current_question": None,
         "user_data": {}
-    }
+    })
     
     await message.answer(
         "🎯 Добро пожаловать на техническое собеседование!\n\n"
@@ -213,25 +525,34 @@ async def next_question_handler(message: Message) -> None:
     """Следующий вопрос"""
     user_id = message.from_user.id
     
-    if user_id not in interview_sessions or interview_sessions[user_id]["step"] != "interview":
+    session = await sessions.get(user_id)
+    if session is None or session["step"] != "interview":
         await message.answer("Сначала начните интервью командой /start")
         return
+
+    agent = await wait_for_agent(message)
+    if agent is None:
+        return
+
+    with user_requests.claim(user_id, "next_question") as claimed:
+        if not claimed:
+            await message.answer("⏳ Уже готовлю следующий вопрос, подождите немного")
+            return
+        await message.answer("🔄 Формирую следующий вопрос...")
     
-    session = interview_sessions[user_id]
-    
-    await message.answer("🔄 Формирую следующий вопрос...")
-    
-    next_question = await interview_agent.next_question(
-        session["user_data"], session["conversation_history"]
-    )
+        next_question = await agent.next_question(
+            session["user_data"], session["conversation_history"], user_id
+        )
     
-    session["conversation_history"].append({"role": "interviewer", "content": next_question})
-    session["current_question"] = next_question
+        session["conversation_history"].append({"role": "interviewer", "content": next_question})
+        session["current_question"] = next_question
 
-    if isinstance(next_question, str):
-        await message.answer(next_question, reply_markup=get_interview_keyboard())
-    else:
-        await message.answer(next_question['question'], reply_markup=get_interview_keyboard())
+        if isinstance(next_question, str):
+            await message.answer(next_question, reply_markup=get_interview_keyboard())
+        else:
+            await message.answer(next_question['question'], reply_markup=get_interview_keyboard())
+            agent.prefetch_question(user_id, session["user_data"], session["conversation_history"],
+                                    lambda: sessions.mark_dirty(user_id))
 
 
 @dp.message(F.text == "Задать вопрос ❓")
@@ -240,11 +561,12 @@ async def ask_question_handler(message: Message) -> None:
     """Запрос на вопрос по теории"""
     user_id = message.from_user.id
     
-    if user_id not in interview_sessions:
+    session = await sessions.get(user_id)
+    if session is None:
         await message.answer("Сначала начните интервью командой /start")
         return
     
-    interview_sessions[user_id]["step"] = "awaiting_question"
+    session["step"] = "awaiting_question"
     await message.answer("Какой теоретический вопрос вас интересует?", reply_markup=ReplyKeyboardRemove())
 
 @dp.message(F.text == "Сменить сложность 📊")
@@ -252,11 +574,12 @@ async def change_level_handler(message: Message) -> None:
     """Смена уровня сложности"""
     user_id = message.from_user.id
     
-    if user_id not in interview_sessions:
+    session = await sessions.get(user_id)
+    if session is None:
         await message.answer("Сначала начните интервью командой /start")
         return
     
-    interview_sessions[user_id]["step"] = "awaiting_level_change"
+    session["step"] = "awaiting_level_change"
     await message.answer(
         "Выберите новый уровень сложности:",
         reply_markup=get_levels_keyboard()
@@ -267,11 +590,12 @@ async def change_position_handler(message: Message) -> None:
     """Смена темы/позиции"""
     user_id = message.from_user.id
     
-    if user_id not in interview_sessions:
+    session = await sessions.get(user_id)
+    if session is None:
         await message.answer("Сначала начните интервью командой /start")
         return
     
-    interview_sessions[user_id]["step"] = "awaiting_position_change"
+    session["step"] = "awaiting_position_change"
     await message.answer(
         "Выберите новую тему для собеседования:",
         reply_markup=get_positions_keyboard()
@@ -282,12 +606,12 @@ async def back_to_interview_handler(message: Message) -> None:
     """Возврат к интервью"""
     user_id = message.from_user.id
     
-    if user_id not in interview_sessions:
+    session = await sessions.get(user_id)
+    if session is None:
         await message.answer("Сначала начните интервью командой /start")
         return
     
-    interview_sessions[user_id]["step"] = "interview"
-    session = interview_sessions[user_id]
+    session["step"] = "interview"
     
     # Продолжаем с текущего вопроса или задаем новый
     current_question = session.get("current_question")
@@ -303,11 +627,12 @@ async def finish_interview_handler(message: Message) -> None:
     """Завершение интервью"""
     user_id = message.from_user.id
     
-    if user_id not in interview_sessions:
+    session = await sessions.get(user_id)
+    if session is None:
         await message.answer("Интервью еще не начато")
         return
     
-    user_data = interview_sessions[user_id].get("user_data", {})
+    user_data = session.get("user_data", {})
     name = user_data.get("name", "Кандидат")
     position = user_data.get("position", "технический специалист")
     level = user_data.get("level", "")
@@ -319,18 +644,20 @@ async def finish_interview_handler(message: Message) -> None:
         reply_markup=ReplyKeyboardRemove()
     )
     
-    del interview_sessions[user_id]
+    if interview_agent is not None:
+        interview_agent.cancel_prefetch(user_id, user_data)
+    await sessions.delete(user_id)
 
 @dp.message()
 async def handle_all_messages(message: Message) -> None:
     """Обработка всех сообщений"""
     user_id = message.from_user.id
     
-    if user_id not in interview_sessions:
+    session = await sessions.get(user_id)
+    if session is None:
         await message.answer("Для начала интервью используйте /start")
         return
     
-    session = interview_sessions[user_id]
     current_step = session["step"]
     
     if current_step == "awaiting_name":
@@ -353,24 +680,36 @@ async def handle_all_messages(message: Message) -> None:
     
     elif current_step == "awaiting_level":
         session["user_data"]["level"] = message.text
-        session["step"] = "interview"
         
         user_data = session["user_data"]
+        agent = await wait_for_agent(message)
+        if agent is None:
+            return
         await message.answer("🔄 Начинаем интервью...")
         
-        template, question = await interview_agent.start_interview(user_data)
+        template, question = await agent.start_interview(user_data)
+        # Вместо вопроса может прийти сообщение об ошибке, если Mistral недоступен: пользователь остается
+        # на выборе уровня и может повторить
+        if isinstance(question, str):
+            await message.answer(question, reply_markup=get_levels_keyboard())
+            return
+        session["step"] = "interview"
         welcome_message = template + question['question']
         session["conversation_history"].append({"role": "interviewer", "content": welcome_message})
         session["current_question"] = question
         
         await message.answer(welcome_message, reply_markup=get_interview_keyboard())
+        agent.prefetch_question(user_id, user_data, session["conversation_history"],
+                                lambda: sessions.mark_dirty(user_id))
     
     elif current_step == "awaiting_level_change":
         
         session["user_data"]["level"] = message.text
         session["step"] = "interview"
-        session["user_data"]["asked_questions"] = []
-        await interview_agent.change_settings(session["user_data"])
+        agent = await wait_for_agent(message)
+        if agent is None:
+            return
+        await agent.change_settings(session["user_data"], user_id)
 
         await message.answer(
             f"✅ Уровень сложности изменен на: {message.text}\n"
@@ -383,8 +722,10 @@ async def handle_all_messages(message: Message) -> None:
         
         session["user_data"]["position"] = message.text
         session["step"] = "interview"
-        session["user_data"]["asked_questions"] = []
-        await interview_agent.change_settings(session["user_data"])
+        agent = await wait_for_agent(message)
+        if agent is None:
+            return
+        await agent.change_settings(session["user_data"], user_id)
         
         await message.answer(
             f"✅ Тема изменена на: {message.text}\n"
@@ -396,35 +737,101 @@ async def handle_all_messages(message: Message) -> None:
     elif current_step == "interview":
         user_answer = message.text
         current_question = session["current_question"]
+        if not isinstance(current_question, dict):
+            await message.answer("Сейчас нет вопроса, на который можно ответить. Нажмите «Следующий вопрос ➡️»",
+                                 reply_markup=get_interview_keyboard())
+            return
         
-        session["conversation_history"].append({"role": "candidate", "content": user_answer})
+        with user_requests.claim(user_id, "answer") as claimed:
+            if not claimed:
+                await message.answer("⏳ Еще анализирую ваш предыдущий ответ, подождите немного")
+                return
+            agent = await wait_for_agent(message)
+            if agent is None:
+                return
+            session["conversation_history"].append({"role": "candidate", "content": user_answer})
         
-        await message.answer("🔄 Анализирую ваш ответ...")
-        analysis = await interview_agent.analyze_answer(current_question, user_answer)
+            if STREAM_RESPONSES:
+                writer = TelegramStreamWriter(message, "📝 Обратная связь:\n\n", STREAM_EDIT_INTERVAL)
+                await writer.start("🔄 Анализирую ваш ответ...")
+                analysis = await agent.stream_answer_analysis(session["user_data"], current_question, user_answer, writer)
+            else:
+                await message.answer("🔄 Анализирую ваш ответ...")
+                analysis = await agent.analyze_answer(session["user_data"], current_question, user_answer)
+                await message.answer(f"📝 Обратная связь:\n\n{analysis}")
 
-        session["conversation_history"].append({"role": "interviewer", "content": analysis})
-        
-        await message.answer(f"📝 Обратная связь:\n\n{analysis}")
-        await message.answer("Используйте кнопки для продолжения:", reply_markup=get_interview_keyboard())
+            session["conversation_history"].append({"role": "interviewer", "content": analysis})
+            await message.answer("Используйте кнопки для продолжения:", reply_markup=get_interview_keyboard())
     
     elif current_step == "awaiting_question":
         user_question = message.text
         session["step"] = "interview"
 
+        agent = await wait_for_agent(message)
+        if agent is None:
+            return
         session["conversation_history"].append({"role": "candidate", "content": user_question})
         
-        await message.answer("🔄 Ищу ответ на ваш вопрос...")
-        answer = await interview_agent.ask_theory_question(user_question, session["conversation_history"])
+        if STREAM_RESPONSES:
+            writer = TelegramStreamWriter(message, "📚 Ответ на ваш вопрос:\n\n", STREAM_EDIT_INTERVAL)
+            await writer.start("🔄 Ищу ответ на ваш вопрос...")
+            answer = await agent.stream_theory_answer(session["user_data"], user_question,
+                                                      session["conversation_history"], writer)
+        else:
+            await message.answer("🔄 Ищу ответ на ваш вопрос...")
+            answer = await agent.ask_theory_question(session["user_data"], user_question,
+                                                    session["conversation_history"])
+            await message.answer(f"📚 Ответ на ваш вопрос:\n\n{answer}")
 
         session["conversation_history"].append({"role": "interviewer", "content": answer})
-        
-        await message.answer(f"📚 Ответ на ваш вопрос:\n\n{answer}")
         await message.answer("Продолжаем интервью:", reply_markup=get_interview_keyboard())
 
 
-async def main() -> None:
+def configure_worker(number: int, count: int) -> None:
+    """Настройки процесса-обработчика number из count (start.py --workers), до main(): квоты Mistral и пул
+    вопросов делятся между процессами поровну, порт метрик и файл пула у каждого процесса свои"""
+    global QUESTION_POOL_SIZE, QUESTION_POOL_PATH, METRICS_PORT
+    agent_factory.LLM_MAX_CONCURRENCY = max(1, agent_factory.LLM_MAX_CONCURRENCY // count)
+    if agent_factory.MISTRAL_TOKENS_PER_MINUTE:
+        agent_factory.MISTRAL_TOKENS_PER_MINUTE = max(1, agent_factory.MISTRAL_TOKENS_PER_MINUTE // count)
+    QUESTION_POOL_SIZE = max(1, QUESTION_POOL_SIZE // count)
+    root, extension = os.path.splitext(QUESTION_POOL_PATH)
+    QUESTION_POOL_PATH = f"{root}.{number}{extension}"
+    if METRICS_PORT:
+        METRICS_PORT += 1 + number
+
+
+async def main(updates=None) -> None:
+    """updates - асинхронный итератор обновлений (dict) от супервизора в режиме нескольких процессов;
+    без него бот сам получает обновления через long polling или вебхук"""
     bot = Bot(token=TELEGRAM_BOT_TOKEN)
-    await dp.start_polling(bot)
+    warm_up_task = asyncio.create_task(warm_up_agent())
+    background_tasks.add(asyncio.create_task(sessions.run()))
+    metrics_runner = await start_metrics_server(METRICS_HOST, METRICS_PORT) if METRICS_PORT else None
+    try:
+        if updates is not None:
+            await feed_updates(dp, bot, updates, WEBHOOK_WORKERS, WEBHOOK_QUEUE_SIZE, SHUTDOWN_DRAIN_TIMEOUT)
+        elif BOT_MODE == 'webhook':
+            stop_event = asyncio.Event()
+            loop = asyncio.get_running_loop()
+            for sig in (signal.SIGINT, signal.SIGTERM):
+                loop.add_signal_handler(sig, stop_event.set)
+            await run_webhook(dp, bot, WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET,
+                              WEBHOOK_WORKERS, WEBHOOK_QUEUE_SIZE, SHUTDOWN_DRAIN_TIMEOUT, stop_event)
+        else:
+            # Зарегистрированный ранее вебхук не дает получать обновления через getUpdates
+            await bot.delete_webhook()
+            await dp.start_polling(bot)
+    finally:
+        warm_up_task.cancel()
+        for task in background_tasks:
+            task.cancel()
+        await asyncio.gather(*background_tasks, return_exceptions=True)
+        await sessions.close()
+        if interview_agent is not None and interview_agent.rag_agent.response_cache is not None:
+            interview_agent.rag_agent.response_cache.flush()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
 
 if __name__ == "__main__":
     asyncio.run(main())
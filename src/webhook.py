@@ -0,0 +1,180 @@
+import asyncio
+import hmac
+from typing import Callable
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+from aiohttp import web
+from pydantic import ValidationError
+
+from src.metrics import REGISTRY
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class UpdateQueue:
+    """Обработка обновлений пулом из workers задач через очередь ограниченного размера"""
+
+    def __init__(self, dp: Dispatcher, bot: Bot, workers: int = 16, queue_size: int = 1000, drain_timeout: float = 60):
+        self._dp = dp
+        self._bot = bot
+        self._workers_count = workers
+        self._drain_timeout = drain_timeout
+        self._queue: asyncio.Queue[Update] = asyncio.Queue(maxsize=queue_size)
+        self._workers: list[asyncio.Task] = []
+        self.accepting = False
+        self.active = 0
+        self.received = 0
+        self.rejected = 0
+        self.processed = 0
+        self.failed = 0
+
+    def start(self) -> None:
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self._workers_count)]
+        self.accepting = True
+
+    def submit(self, update: Update) -> bool:
+        """Поставить обновление в очередь без ожидания; False - очередь заполнена или идет остановка"""
+        if not self.accepting:
+            return False
+        try:
+            self._queue.put_nowait(update)
+        except asyncio.QueueFull:
+            self.rejected += 1
+            return False
+        self.received += 1
+        return True
+
+    async def put(self, update: Update) -> None:
+        """Поставить обновление в очередь, дождавшись места"""
+        await self._queue.put(update)
+        self.received += 1
+
+    async def _worker(self) -> None:
+        while True:
+            update = await self._queue.get()
+            self.active += 1
+            try:
+                await self._dp.feed_update(self._bot, update)
+                self.processed += 1
+            except Exception as e:
+                self.failed += 1
+                print(f"Ошибка обработки обновления {update.update_id}: {e}")
+            finally:
+                self.active -= 1
+                self._queue.task_done()
+
+    async def drain(self) -> None:
+        """Перестать принимать обновления и дождаться обработки уже принятых (в том числе запросов к LLM)"""
+        self.accepting = False
+        if self._queue.qsize() or self.active:
+            print(f"Дожидаюсь обработки {self._queue.qsize() + self.active} обновлений...")
+        try:
+            await asyncio.wait_for(self._queue.join(), self._drain_timeout)
+        except asyncio.TimeoutError:
+            print(f"Не дождались обработки обновлений за {self._drain_timeout:.0f} с, осталось {self._queue.qsize()}")
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    def stats(self) -> dict:
+        return {
+            "queued": self._queue.qsize(),
+            "active": self.active,
+            "received": self.received,
+            "rejected": self.rejected,
+            "processed": self.processed,
+            "failed": self.failed,
+        }
+
+
+class WebhookServer:
+    """Прием обновлений Telegram по вебхуку: запрос подтверждается сразу, а обновление передается в
+    submit(dict) -> bool; False - перегрузка (503, Telegram повторит доставку позже), ValueError - некорректное
+    обновление. health() - содержимое GET /healthz"""
+
+    def __init__(self, submit: Callable[[dict], bool], path: str = "/webhook", secret_token: str | None = None,
+                 health: Callable[[], dict] | None = None):
+        self._submit = submit
+        self.path = path
+        self._secret_token = secret_token
+        self._health = health or dict
+
+    def create_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post(self.path, self.handle_update)
+        app.router.add_get("/healthz", self.handle_health)
+        return app
+
+    async def handle_update(self, request: web.Request) -> web.Response:
+        if self._secret_token is not None and \
+                not hmac.compare_digest(request.headers.get(SECRET_HEADER, ""), self._secret_token):
+            return web.Response(status=401)
+        try:
+            accepted = self._submit(await request.json())
+        except ValueError:
+            # pydantic.ValidationError и ошибка разбора JSON - наследники ValueError
+            return web.Response(status=400)
+        return web.Response() if accepted else web.Response(status=503)
+
+    async def handle_health(self, request: web.Request) -> web.Response:
+        return web.json_response(self._health())
+
+
+async def serve_webhook(server: WebhookServer, bot: Bot, host: str, port: int, url: str | None = None,
+                        secret_token: str | None = None, stop_event: asyncio.Event | None = None) -> None:
+    """Веб-сервер вебхука до stop_event; если задан url, регистрирует вебхук в Telegram"""
+    runner = web.AppRunner(server.create_app())
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    print(f"Вебхук слушает {host}:{port}{server.path}")
+    if url:
+        await bot.set_webhook(url.rstrip("/") + server.path, secret_token=secret_token, max_connections=100)
+        print(f"Вебхук зарегистрирован: {url.rstrip('/') + server.path}")
+    try:
+        await (stop_event or asyncio.Event()).wait()
+    finally:
+        # Остановка сайта закрывает прием новых соединений
+        await runner.cleanup()
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot, host: str, port: int, url: str | None = None, path: str = "/webhook",
+                      secret_token: str | None = None, workers: int = 16, queue_size: int = 1000,
+                      drain_timeout: float = 60, stop_event: asyncio.Event | None = None) -> None:
+    """Запуск веб-сервера до stop_event; если задан url, регистрирует вебхук в Telegram"""
+    updates = UpdateQueue(dp, bot, workers, queue_size, drain_timeout)
+    REGISTRY.register_collector("webhook", updates.stats)
+
+    def submit(data) -> bool:
+        return updates.submit(Update.model_validate(data, context={"bot": bot}))
+
+    server = WebhookServer(submit, path, secret_token, lambda: {"accepting": updates.accepting, **updates.stats()})
+    updates.start()
+    try:
+        await serve_webhook(server, bot, host, port, url, secret_token, stop_event)
+    finally:
+        # Новые обновления уже не принимаются, дожидаемся обработки принятых
+        await updates.drain()
+        await bot.session.close()
+
+
+async def feed_updates(dp: Dispatcher, bot: Bot, updates, workers: int = 16, queue_size: int = 1000,
+                       drain_timeout: float = 60) -> None:
+    """Обработка обновлений (dict) из асинхронного итератора до его конца - в режиме нескольких процессов
+    обновления получает супервизор и передает процессу через очередь"""
+    queue = UpdateQueue(dp, bot, workers, queue_size, drain_timeout)
+    REGISTRY.register_collector("updates", queue.stats)
+    queue.start()
+    try:
+        async for data in updates:
+            try:
+                update = Update.model_validate(data, context={"bot": bot})
+            except ValidationError as e:
+                print(f"Некорректное обновление: {e}")
+                continue
+            await queue.put(update)
+    finally:
+        await queue.drain()
+        await bot.session.close()
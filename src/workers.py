@@ -0,0 +1,321 @@
+import asyncio
+import multiprocessing
+import os
+import queue
+import signal
+import time
+from contextlib import suppress
+
+from aiogram import Bot
+from aiogram.methods import GetUpdates
+from aiogram.utils.backoff import Backoff, BackoffConfig
+from dotenv import load_dotenv
+
+from src.metrics import REGISTRY, start_metrics_server
+from src.webhook import WebhookServer, serve_webhook
+
+load_dotenv()
+
+# Настройки получения обновлений те же, что у одного процесса (src/tg_bot.py): их получает только супервизор
+TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '')
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8080'))
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET') or None
+SHUTDOWN_DRAIN_TIMEOUT = float(os.getenv('SHUTDOWN_DRAIN_TIMEOUT', '60'))
+# Метрики супервизора; процесс-обработчик номер i отдает свои на METRICS_PORT + 1 + i
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '9100'))
+# Сколько обновлений может ждать в очереди одного процесса-обработчика
+WORKER_QUEUE_SIZE = int(os.getenv('WORKER_QUEUE_SIZE', '1000'))
+# Процесс, который столько секунд не сообщал о себе (event loop завис), перезапускается
+WORKER_HEARTBEAT_TIMEOUT = float(os.getenv('WORKER_HEARTBEAT_TIMEOUT', '60'))
+HEARTBEAT_INTERVAL = 2.0
+# Пауза перед перезапуском процесса, который падает сразу после запуска, растет до этого значения
+MAX_RESTART_DELAY = 60.0
+
+
+def update_user_id(update: dict) -> int | None:
+    """Пользователь, от которого пришло обновление (сообщение, нажатие кнопки и т.п.)"""
+    for value in update.values():
+        if not isinstance(value, dict):
+            continue
+        user = value.get("from") or value.get("user") or value.get("chat")
+        if isinstance(user, dict) and isinstance(user.get("id"), int):
+            return user["id"]
+    return None
+
+
+async def receive_updates(updates):
+    """Обновления из очереди супервизора до сигнала остановки (None)"""
+    while True:
+        try:
+            update = await asyncio.to_thread(updates.get, True, 1.0)
+        except queue.Empty:
+            continue
+        if update is None:
+            return
+        yield update
+
+
+async def _serve(number: int, updates, heartbeats) -> None:
+    from src import tg_bot
+
+    async def beat() -> None:
+        while True:
+            heartbeats[number] = time.time()
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+
+    heartbeat = asyncio.create_task(beat())
+    try:
+        await tg_bot.main(receive_updates(updates))
+    finally:
+        heartbeat.cancel()
+
+
+def run_worker(number: int, count: int, updates, heartbeats) -> None:
+    """Точка входа процесса-обработчика: свой event loop, агент и кеш сессий, обновления - из очереди"""
+    # Ctrl+C получает вся группа процессов; обработчики останавливает супервизор, когда они дообработают очередь
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    from src import tg_bot
+    tg_bot.configure_worker(number, count)
+    print(f"Процесс-обработчик {number} запущен (pid {os.getpid()})")
+    asyncio.run(_serve(number, updates, heartbeats))
+
+
+def prepare_index() -> None:
+    """Сборка индекса и эталонных ответов до запуска обработчиков (отдельным процессом, чтобы не держать
+    модель эмбеддингов в памяти супервизора): иначе все обработчики начали бы перестраивать их одновременно.
+    Обработчики потом только читают их с диска, при VECTOR_BACKEND=mmap - одну копию эмбеддингов в page cache"""
+    from src import agent_factory, tg_bot
+    from src.answer_lookup import DatasetAnswerLookup
+    from src.index_store import index_is_current
+
+    embedding_dtype = agent_factory.EMBEDDING_DTYPE if agent_factory.VECTOR_BACKEND == "mmap" else None
+    if index_is_current(agent_factory.RAG_DATA_DIR, embedding_dtype=embedding_dtype) and \
+            (not agent_factory.DATASET_ANSWERS_ENABLED or DatasetAnswerLookup.is_current(agent_factory.RAG_DATA_DIR)):
+        print("Индекс и эталонные ответы на диске актуальны")
+        return
+    tg_bot.InterviewAgent()
+
+
+class WorkerSlot:
+    """Место процесса-обработчика: сам процесс (после перезапуска - новый), его очередь и счетчики"""
+
+    def __init__(self, number: int, updates):
+        self.number = number
+        self.updates = updates
+        self.process: multiprocessing.Process | None = None
+        self.restart_at = 0.0
+        self.crashes = 0
+        self.restarts = 0
+        self.routed = 0
+        self.rejected = 0
+
+
+class Supervisor:
+    """Процессы-обработчики бота: обновление передается процессу user_id % count, так что сообщения одного
+    пользователя (и его сессия в памяти) всегда попадают в один процесс. Упавший или переставший сообщать
+    о себе процесс перезапускается, необработанные обновления из его очереди передаются новому.
+    target(number, count, updates, heartbeats) - точка входа процесса"""
+
+    def __init__(self, count: int, queue_size: int = 1000, heartbeat_timeout: float = 60.0, target=run_worker):
+        # spawn: обработчик не наследует потоки и event loop супервизора
+        self._context = multiprocessing.get_context("spawn")
+        self._queue_size = queue_size
+        self._heartbeat_timeout = heartbeat_timeout
+        self._target = target
+        self._heartbeats = self._context.Array("d", count, lock=False)
+        self._slots = [WorkerSlot(number, self._context.Queue(queue_size)) for number in range(count)]
+
+    def start(self) -> None:
+        for slot in self._slots:
+            self._spawn(slot)
+
+    def _spawn(self, slot: WorkerSlot) -> None:
+        self._heartbeats[slot.number] = 0.0
+        slot.restart_at = 0.0
+        slot.process = self._context.Process(
+            target=self._target, args=(slot.number, len(self._slots), slot.updates, self._heartbeats),
+            name=f"bot-worker-{slot.number}"
+        )
+        slot.process.start()
+
+    def _retire(self, slot: WorkerSlot) -> None:
+        """Процесс завершился: новая очередь для следующего процесса и перенос в нее того, что не успели забрать"""
+        old = slot.updates
+        slot.updates = self._context.Queue(self._queue_size)
+        moved = 0
+        # Если процесс умер, ожидая очередь, ее блокировка так и осталась захваченной - тогда переносить нечего
+        with suppress(queue.Empty, queue.Full, OSError, ValueError):
+            while True:
+                item = old.get_nowait()
+                if item is not None:
+                    slot.updates.put_nowait(item)
+                    moved += 1
+        old.cancel_join_thread()
+        old.close()
+        if moved:
+            print(f"Процесс-обработчик {slot.number}: {moved} необработанных обновлений передано новому процессу")
+        # Процесс, не успевший сообщить о себе ни разу, падает при запуске: паузы перед перезапуском растут
+        slot.crashes = 0 if self._heartbeats[slot.number] else slot.crashes + 1
+        delay = min(MAX_RESTART_DELAY, 2 ** slot.crashes - 1)
+        slot.process = None
+        slot.restart_at = time.monotonic() + delay
+        slot.restarts += 1
+
+    async def monitor(self, interval: float = 1.0) -> None:
+        """Проверка процессов: завершившийся или зависший перезапускается"""
+        while True:
+            await asyncio.sleep(interval)
+            for slot in self._slots:
+                try:
+                    await self._check(slot)
+                except Exception as e:
+                    print(f"Ошибка проверки процесса-обработчика {slot.number}: {e}")
+
+    async def _check(self, slot: WorkerSlot) -> None:
+        process = slot.process
+        if process is None:
+            if time.monotonic() >= slot.restart_at:
+                print(f"Перезапускаю процесс-обработчик {slot.number}")
+                self._spawn(slot)
+            return
+        heartbeat = self._heartbeats[slot.number]
+        if not process.is_alive():
+            print(f"Процесс-обработчик {slot.number} завершился с кодом {process.exitcode}")
+            self._retire(slot)
+        elif heartbeat and time.time() - heartbeat > self._heartbeat_timeout:
+            print(f"Процесс-обработчик {slot.number} не отвечает {time.time() - heartbeat:.0f} с, завершаю его")
+            process.kill()
+            await asyncio.to_thread(process.join, 5)
+            self._retire(slot)
+
+    def submit(self, update: dict) -> bool:
+        """Передать обновление процессу его пользователя без ожидания; False - очередь процесса заполнена"""
+        if not isinstance(update, dict) or not isinstance(update.get("update_id"), int):
+            raise ValueError("Некорректное обновление")
+        user_id = update_user_id(update)
+        slot = self._slots[(update["update_id"] if user_id is None else user_id) % len(self._slots)]
+        try:
+            slot.updates.put_nowait(update)
+        except queue.Full:
+            slot.rejected += 1
+            return False
+        slot.routed += 1
+        return True
+
+    async def put(self, update: dict) -> None:
+        """Передать обновление, дождавшись места в очереди процесса"""
+        while not self.submit(update):
+            await asyncio.sleep(0.1)
+
+    async def stop(self, drain_timeout: float = 60) -> None:
+        """Сигнал остановки каждому процессу после уже переданных обновлений и ожидание их завершения"""
+        running = [slot for slot in self._slots if slot.process is not None]
+
+        async def send_stop(slot: WorkerSlot) -> None:
+            # Полная очередь освободится по мере обработки; не дождались - процесс остановим принудительно ниже
+            with suppress(queue.Full):
+                await asyncio.to_thread(slot.updates.put, None, True, drain_timeout)
+
+        await asyncio.gather(*(send_stop(slot) for slot in running))
+        deadline = time.monotonic() + drain_timeout + 10
+        for slot in running:
+            await asyncio.to_thread(slot.process.join, max(0.0, deadline - time.monotonic()))
+            if slot.process.is_alive():
+                print(f"Процесс-обработчик {slot.number} не завершился вовремя, останавливаю принудительно")
+                slot.process.terminate()
+                await asyncio.to_thread(slot.process.join, 5)
+        for slot in self._slots:
+            slot.updates.cancel_join_thread()
+            slot.updates.close()
+
+    def stats(self) -> dict:
+        now = time.time()
+        queued = {}
+        for slot in self._slots:
+            # qsize() не реализован на macOS
+            with suppress(NotImplementedError):
+                queued[str(slot.number)] = slot.updates.qsize()
+        return {
+            "workers": len(self._slots),
+            "alive": sum(slot.process is not None and slot.process.is_alive() for slot in self._slots),
+            "restarts": {str(slot.number): slot.restarts for slot in self._slots},
+            "routed": {str(slot.number): slot.routed for slot in self._slots},
+            "rejected": {str(slot.number): slot.rejected for slot in self._slots},
+            "queued": queued,
+            "heartbeat_age": {str(slot.number): round(now - self._heartbeats[slot.number], 1)
+                              for slot in self._slots if self._heartbeats[slot.number]},
+        }
+
+
+async def poll_updates(bot: Bot, supervisor: Supervisor, polling_timeout: int = 30) -> None:
+    """Long polling в супервизоре; обновление подтверждается в Telegram только после передачи процессу"""
+    await bot.delete_webhook()
+    backoff = Backoff(BackoffConfig(min_delay=1.0, max_delay=30.0, factor=1.5, jitter=0.1))
+    get_updates = GetUpdates(timeout=polling_timeout)
+    try:
+        while True:
+            try:
+                updates = await bot(get_updates, request_timeout=int(bot.session.timeout + polling_timeout))
+            except Exception as e:
+                print(f"Ошибка получения обновлений: {e}, повтор через {backoff.next_delay:.1f} с")
+                await backoff.asleep()
+                continue
+            backoff.reset()
+            for update in updates:
+                await supervisor.put(update.model_dump(mode="json", by_alias=True, exclude_none=True))
+                get_updates.offset = update.update_id + 1
+    finally:
+        # getUpdates со следующим offset подтверждает уже переданные обновления, иначе после перезапуска
+        # Telegram доставил бы их повторно; полученное этим запросом обновление останется неподтвержденным
+        if get_updates.offset is not None:
+            with suppress(Exception):
+                await asyncio.wait_for(bot.get_updates(offset=get_updates.offset, limit=1, timeout=0), 5)
+
+
+async def main(count: int) -> None:
+    """Супервизор: получает обновления Telegram и распределяет их между count процессами-обработчиками"""
+    if not TELEGRAM_BOT_TOKEN:
+        raise ValueError("TELEGRAM_BOT_TOKEN не найден в .env файле")
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop_event.set)
+
+    context = multiprocessing.get_context("spawn")
+    preparing = context.Process(target=prepare_index, name="bot-prepare-index")
+    preparing.start()
+    await asyncio.to_thread(preparing.join)
+    if preparing.exitcode != 0:
+        raise RuntimeError(f"не удалось подготовить индекс (код {preparing.exitcode})")
+    if stop_event.is_set():
+        return
+
+    supervisor = Supervisor(count, WORKER_QUEUE_SIZE, WORKER_HEARTBEAT_TIMEOUT)
+    REGISTRY.register_collector("workers", supervisor.stats)
+    supervisor.start()
+    print(f"Запущено процессов-обработчиков: {count}")
+    monitor = asyncio.create_task(supervisor.monitor())
+    metrics_runner = await start_metrics_server(METRICS_HOST, METRICS_PORT) if METRICS_PORT else None
+    bot = Bot(token=TELEGRAM_BOT_TOKEN)
+    try:
+        if BOT_MODE == 'webhook':
+            server = WebhookServer(supervisor.submit, WEBHOOK_PATH, WEBHOOK_SECRET, supervisor.stats)
+            await serve_webhook(server, bot, WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_URL, WEBHOOK_SECRET, stop_event)
+        else:
+            polling = asyncio.create_task(poll_updates(bot, supervisor))
+            await stop_event.wait()
+            polling.cancel()
+            await asyncio.gather(polling, return_exceptions=True)
+    finally:
+        monitor.cancel()
+        await asyncio.gather(monitor, return_exceptions=True)
+        print("Дожидаюсь завершения процессов-обработчиков...")
+        await supervisor.stop(SHUTDOWN_DRAIN_TIMEOUT)
+        await bot.session.close()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
@@ -1,10 +1,20 @@
+import argparse
 import asyncio
+import hashlib
 import os
+import re
 import subprocess
 import sys
+import time
+from importlib import metadata
 
-SRC_DIR = os.path.join(os.path.dirname(__file__), 'src')
-sys.path.insert(0, SRC_DIR)
+# Точка отсчета времени запуска; импорты выше - только стандартная библиотека
+STARTED = time.monotonic()
+
+REQUIREMENTS_FILE = "requirements.txt"
+# Отпечаток последнего успешно проверенного requirements.txt: пока он совпадает, pip не запускается
+REQUIREMENTS_FINGERPRINT = os.path.join("storage", "requirements.sha256")
+_REQUIREMENT = re.compile(r"^([A-Za-z0-9][A-Za-z0-9._-]*)(?:\[[^\]]*\])?\s*(?:==\s*([^\s;,]+))?")
 
 
 def check_env_file():
@@ -15,21 +25,93 @@ def check_env_file():
     return True
 
 
-def install_requirements():
+def read_requirements(path=REQUIREMENTS_FILE):
+    with open(path, "rb") as f:
+        raw = f.read()
+    encoding = "utf-16" if raw[:2] in (b"\xff\xfe", b"\xfe\xff") else "utf-8"
+    lines = (line.split("#")[0].strip() for line in raw.decode(encoding).splitlines())
+    return [line for line in lines if line and not line.startswith("-")]
+
+
+def requirements_fingerprint(path=REQUIREMENTS_FILE):
+    # Учитываем и интерпретатор: при запуске из другого окружения зависимости проверяются заново
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        digest.update(f.read())
+    digest.update(sys.executable.encode("utf-8"))
+    digest.update(sys.version.encode("utf-8"))
+    return digest.hexdigest()
+
+
+def missing_requirements(requirements):
+    """Зависимости, которые не установлены или установлены не той версии"""
+    missing = []
+    for requirement in requirements:
+        match = _REQUIREMENT.match(requirement)
+        if not match:
+            continue
+        name, version = match.groups()
+        try:
+            installed = metadata.version(name)
+        except metadata.PackageNotFoundError:
+            missing.append(requirement)
+            continue
+        if version and installed != version:
+            missing.append(f"{requirement} (установлена {installed})")
+    return missing
+
+
+def save_requirements_fingerprint(fingerprint):
+    os.makedirs(os.path.dirname(REQUIREMENTS_FINGERPRINT), exist_ok=True)
+    with open(REQUIREMENTS_FINGERPRINT, "w") as f:
+        f.write(fingerprint)
+
+
+def install_requirements(force=False):
+    fingerprint = requirements_fingerprint()
+    if not force:
+        if os.path.exists(REQUIREMENTS_FINGERPRINT):
+            with open(REQUIREMENTS_FINGERPRINT) as f:
+                if f.read().strip() == fingerprint:
+                    return True
+        missing = missing_requirements(read_requirements())
+        if not missing:
+            print("Все зависимости уже установлены")
+            save_requirements_fingerprint(fingerprint)
+            return True
+        print(f"Не хватает зависимостей ({len(missing)}): {', '.join(missing[:5])}{' ...' if len(missing) > 5 else ''}")
     try:
         print("Устанавливаю зависимости...")
-        subprocess.check_call([sys.executable, "-m", "pip", "install", "-r", "requirements.txt"])
+        subprocess.check_call([sys.executable, "-m", "pip", "install", "-r", REQUIREMENTS_FILE])
         print("Зависимости установлены успешно")
+        save_requirements_fingerprint(fingerprint)
         return True
     except subprocess.CalledProcessError:
         print("Ошибка при установке зависимостей")
         return False
 
 
+def rebuild_index():
+    try:
+        print("Пересобираю векторный индекс...")
+        # С теми же VECTOR_BACKEND, EMBEDDING_DTYPE и DATASET_ANSWERS, что и у бота: иначе при mmap бот
+        # при запуске заново выгружал бы эмбеддинги, а эталонные ответы строились бы отдельно
+        from src.agent_factory import create_rag_agent
+        create_rag_agent(rebuild_index=True, response_cache=None)
+        print("Индекс пересобран")
+        return True
+    except Exception as e:
+        print(f"Ошибка при пересборке индекса: {e}")
+        return False
+
+
 async def run_bot():
     try:
         print("Запускаю телеграм бота...")
-        from tg_bot import main as bot_main
+        from src.metrics import record_startup
+        started = time.monotonic()
+        from src.tg_bot import main as bot_main
+        record_startup("import_bot", time.monotonic() - started)
         await bot_main()
     except ImportError as e:
         print(f"Ошибка импорта: {e}")
@@ -40,17 +122,55 @@ async def run_bot():
     return True
 
 
+async def run_workers(count):
+    try:
+        print(f"Запускаю телеграм бота в {count} процессах...")
+        from src.workers import main as workers_main
+        await workers_main(count)
+    except Exception as e:
+        print(f" Ошибка при запуске бота: {e}")
+        return False
+    return True
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Запуск агента для подготовки к собеседованиям")
+    parser.add_argument("--rebuild-index", action="store_true",
+                        help="пересобрать векторный индекс rag_data с нуля и выйти")
+    parser.add_argument("--force-install", action="store_true",
+                        help="переустановить зависимости через pip, даже если requirements.txt не менялся")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="число процессов-обработчиков (сообщения пользователя всегда обрабатывает один и тот же "
+                             "процесс); 0 - по числу ядер процессора")
+    return parser.parse_args()
+
+
 def main():
+    args = parse_args()
     print("Запуск агента...")
 
     if not check_env_file():
-        return
+        sys.exit(1)
+
+    started = time.monotonic()
+    if not install_requirements(force=args.force_install):
+        sys.exit(1)
+    requirements_seconds = time.monotonic() - started
+
+    # Импорт только после проверки зависимостей: в чистом окружении aiohttp еще не установлен
+    from src.metrics import mark_process_start, record_startup
+    mark_process_start(STARTED)
+    record_startup("requirements", requirements_seconds)
 
-    if not install_requirements():
+    if args.rebuild_index:
+        if not rebuild_index():
+            sys.exit(1)
         return
 
+    workers = args.workers if args.workers > 0 else os.cpu_count() or 1
     try:
-        asyncio.run(run_bot())
+        if not asyncio.run(run_workers(workers) if workers > 1 else run_bot()):
+            sys.exit(1)
     except KeyboardInterrupt:
         print("\nЗавершение работы...")
     except Exception as e:
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Модули импортируются как src.xxx, как в start.py и batch.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,78 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from src.interview_profile import InterviewProfile
+from src.rag_agent import RagAgent, is_follow_up
+from src.response_cache import SemanticCache
+from src.singleflight import SingleFlight
+
+
+class FakeEmbedding:
+    def get_text_embedding(self, text):
+        # Одинаковый текст - одинаковый вектор, разный - ортогональный
+        return [1.0 if i == hash(text) % 16 else 0.0 for i in range(16)]
+
+
+def _agent(tmp_path):
+    """RagAgent без индекса и Mistral: только кеш ответов, генерация подменена счетчиком вызовов"""
+    agent = RagAgent.__new__(RagAgent)
+    agent.response_cache = SemanticCache(str(tmp_path / "cache.sqlite"))
+    agent.embed_model = FakeEmbedding()
+    agent._executor = ThreadPoolExecutor(max_workers=2)
+    agent._flights = {name: SingleFlight(name) for name in ("embedding", "answer", "answer_stream")}
+    agent.prompts = []
+
+    async def messages(profile, question, message_history=""):
+        agent.prompts.append(message_history)
+        return [{"role": "user", "content": question}]
+
+    async def complete(messages, operation="chat"):
+        return f"Ответ на {messages[0]['content']}"
+
+    async def stream(messages, operation="chat"):
+        yield "Ответ на "
+        yield messages[0]["content"]
+
+    agent._detailed_answer_messages = messages
+    agent._chat_complete = complete
+    agent._chat_stream = stream
+    return agent
+
+
+def _profile():
+    return InterviewProfile(name="Анна", interview_scope="Machine Learning", difficulty="Middle")
+
+
+def test_repeated_ask_question_hits_cache(tmp_path):
+    agent = _agent(tmp_path)
+
+    async def scenario():
+        # Бот добавляет вопрос кандидата в историю перед ответом, поэтому история у каждого вызова своя
+        first = await agent.get_detailed_answer(_profile(), "Что такое overfitting?", "история 1\nЧто такое overfitting?")
+        second = await agent.get_detailed_answer(_profile(), "что такое  overfitting", "история 2\nчто такое overfitting")
+        streamed = [chunk async for chunk in agent.stream_detailed_answer(_profile(), "Что такое overfitting?",
+                                                                          "история 3")]
+        return first, second, "".join(streamed)
+
+    first, second, streamed = asyncio.run(scenario())
+    assert first == second == streamed == "Ответ на Что такое overfitting?"
+    assert len(agent.prompts) == 1
+    assert agent.response_cache.hits == 2
+
+
+def test_follow_up_is_not_cached(tmp_path):
+    agent = _agent(tmp_path)
+
+    async def scenario():
+        for history in ("история 1", "история 2"):
+            await agent.get_detailed_answer(_profile(), "Объясните подробнее", history)
+
+    asyncio.run(scenario())
+    assert agent.prompts == ["история 1", "история 2"]
+    assert agent.response_cache.hits == 0 and agent.response_cache.stats()["entries"] == 0
+
+
+def test_follow_up_detection():
+    assert is_follow_up("А почему так?")
+    assert is_follow_up("Explain this in more detail")
+    assert not is_follow_up("Чем отличается L1 от L2?")
@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+
+from src.embedding_store import EmbeddingStore, quantize
+
+
+@pytest.fixture
+def embeddings():
+    rng = np.random.default_rng(0)
+    return rng.normal(size=(50, 16)).astype(np.float32)
+
+
+def _exact_top(embeddings, query, top_k):
+    normalized = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return list(np.argsort(-(normalized @ (query / np.linalg.norm(query))))[:top_k])
+
+
+def test_quantize_rejects_unknown_dtype(embeddings):
+    with pytest.raises(ValueError):
+        quantize(embeddings, "float64")
+
+
+@pytest.mark.parametrize("dtype", ["float32", "float16", "int8"])
+def test_search_matches_exact_ranking(embeddings, dtype):
+    store = EmbeddingStore.from_embeddings([f"node-{i}" for i in range(len(embeddings))], embeddings, dtype)
+    query = embeddings[7] + 0.01
+    rows, scores = store.search(query, 3)
+    assert rows[0] == 7
+    assert list(rows) == _exact_top(embeddings, query, 3)
+    assert scores[0] == pytest.approx(1.0, abs=0.02)
+    assert list(scores) == sorted(scores, reverse=True)
+
+
+def test_search_within_rows_and_small_batches(embeddings):
+    store = EmbeddingStore([str(i) for i in range(len(embeddings))], *quantize(embeddings, "float32"), batch_size=4)
+    rows = np.array([3, 10, 20, 30])
+    found, _ = store.search(embeddings[20], 2, rows)
+    assert found[0] == 20
+    assert set(found) <= set(rows)
+    assert len(store.search(embeddings[0], 5, np.array([], dtype=np.int64))[0]) == 0
+
+
+@pytest.mark.parametrize("dtype", ["float16", "int8"])
+def test_write_and_open_memory_map(tmp_path, embeddings, dtype):
+    node_ids = [f"node-{i}" for i in range(len(embeddings))]
+    EmbeddingStore.write(str(tmp_path), node_ids, embeddings, dtype, extra_meta={"source_digest": "abc"})
+    store = EmbeddingStore.open(str(tmp_path))
+    assert store.node_ids == node_ids
+    assert store.dtype == dtype
+    assert store.meta["source_digest"] == "abc"
+    assert isinstance(store._vectors, np.memmap)
+    assert store.search(embeddings[12], 1)[0][0] == 12
+
+
+def test_open_missing_store(tmp_path):
+    assert EmbeddingStore.read_meta(str(tmp_path)) is None
+    with pytest.raises(FileNotFoundError):
+        EmbeddingStore.open(str(tmp_path))
@@ -0,0 +1,78 @@
+import asyncio
+
+from src.history import ConversationHistory, estimate_tokens, render_turn
+
+
+def _question(text):
+    return {"role": "interviewer", "content": {"question": text, "answer": "Эталон"}}
+
+
+def _answer(text):
+    return {"role": "candidate", "content": text}
+
+
+def test_trim_keeps_recent_turns_within_budget():
+    history = ConversationHistory(budget_tokens=60)
+    for i in range(10):
+        history.append(_question(f"Вопрос номер {i} о регуляризации"))
+        history.append(_answer("Ответ кандидата " * 5))
+    assert sum(estimate_tokens(render_turn(turn)) for turn in history) <= 60
+    assert history.turns[-1] == _answer("Ответ кандидата " * 5)
+    # Вытесненные вопросы остаются в списке заданных
+    assert history.asked_titles[0] == "Вопрос номер 0 о регуляризации"
+    assert "Вопрос номер 0 о регуляризации" in history.render()
+
+
+def test_single_long_turn_is_kept_but_truncated_in_render():
+    history = ConversationHistory(budget_tokens=10)
+    history.append(_answer("очень длинный ответ " * 50))
+    assert len(history) == 1
+    assert len(history.render()) < 200
+
+
+def test_asked_titles_are_bounded():
+    history = ConversationHistory(budget_tokens=1, max_titles=3)
+    for i in range(6):
+        history.append(_question(f"Вопрос {i}"))
+    assert history.asked_titles == ["Вопрос 2", "Вопрос 3", "Вопрос 4"]
+
+
+def test_compact_moves_evicted_turns_into_summary():
+    history = ConversationHistory(budget_tokens=12)
+    for i in range(4):
+        history.append(_answer(f"Ответ {i}"))
+    received = []
+
+    async def summarize(previous, new_turns):
+        received.append((previous, new_turns))
+        return "Кандидат ответил на вопросы"
+
+    asyncio.run(history.compact(summarize))
+    assert received and received[0][0] == ""
+    assert received[0][1] == "Кандидат: Ответ 0\nКандидат: Ответ 1"
+    assert history.summary == "Кандидат ответил на вопросы"
+    assert history.render().startswith("Краткое резюме")
+    # Повторный вызов без новых вытесненных реплик не обращается к LLM
+    asyncio.run(history.compact(summarize))
+    assert len(received) == 1
+
+
+def test_failed_compact_keeps_pending_turns():
+    history = ConversationHistory(budget_tokens=20)
+    for i in range(4):
+        history.append(_answer(f"Ответ {i} " * 5))
+
+    async def broken(previous, new_turns):
+        raise ConnectionError("нет сети")
+
+    asyncio.run(history.compact(broken))
+    assert history.summary == ""
+    assert history.to_dict()["pending"]
+
+
+def test_round_trip_through_dict():
+    history = ConversationHistory(budget_tokens=30)
+    history.append(_question("Что такое bias?"))
+    history.append(_answer("Смещение оценки"))
+    restored = ConversationHistory.from_dict(history.to_dict())
+    assert restored.render() == history.render()
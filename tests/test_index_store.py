@@ -0,0 +1,31 @@
+import numpy as np
+
+from src.embedding_store import EmbeddingStore
+from src.index_store import embeddings_are_current, embeddings_path, manifest_digest, nodes_digest, save_manifest
+
+
+def _export(persist_dir, files, node_ids):
+    EmbeddingStore.write(embeddings_path(persist_dir), node_ids, np.eye(len(node_ids), dtype=np.float32), "float16",
+                         extra_meta={"source_digest": manifest_digest(files), "nodes_digest": nodes_digest(node_ids)})
+
+
+def test_embeddings_follow_docstore_nodes(tmp_path):
+    persist_dir = str(tmp_path)
+    files = {"a.csv": {"sha256": "abc", "doc_ids": ["a.csv:1"]}}
+    save_manifest(persist_dir, files, nodes_digest(["node-1", "node-2"]))
+    _export(persist_dir, files, ["node-2", "node-1"])
+    assert embeddings_are_current(persist_dir, files, "float16")
+    assert not embeddings_are_current(persist_dir, files, "int8")
+
+    # Полная пересборка: те же файлы, новые id узлов в docstore
+    save_manifest(persist_dir, files, nodes_digest(["node-3", "node-4"]))
+    assert not embeddings_are_current(persist_dir, files, "float16")
+
+
+def test_export_without_nodes_digest_is_stale(tmp_path):
+    persist_dir = str(tmp_path)
+    files = {"a.csv": {"sha256": "abc", "doc_ids": ["a.csv:1"]}}
+    save_manifest(persist_dir, files, nodes_digest(["node-1"]))
+    EmbeddingStore.write(embeddings_path(persist_dir), ["node-1"], np.ones((1, 4), dtype=np.float32), "float16",
+                         extra_meta={"source_digest": manifest_digest(files)})
+    assert not embeddings_are_current(persist_dir, files, "float16")
@@ -0,0 +1,71 @@
+import csv
+
+from src.ingestion import (documents_digest, is_placeholder_answer, iter_directory_records, iter_records,
+                           load_directory_documents, record_to_document)
+
+
+def _write_csv(path, header, rows):
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        writer.writerows(rows)
+
+
+def test_rows_are_normalized(tmp_path):
+    path = tmp_path / "dataset.csv"
+    _write_csv(path, [" Question ", "Answer"], [
+        ["What is overfitting? 🚀 (Sample 2)", "Model memorizes noise"],
+        ["What is bias?", "Answer here"],
+        ["", "no question"],
+        ["itâ\x80\x99s a question", "-"],
+    ])
+    records = list(iter_records(str(path)))
+    assert len(records) == 3
+    first, second, third = records
+    assert first.question == "What is overfitting?"
+    assert first.difficulty == "hard"
+    # Колонки category в dataset.csv нет, тема берется из значений по умолчанию для файла
+    assert first.category == "Machine Learning"
+    assert first.language == "en"
+    assert first.doc_id == "dataset.csv:1"
+    assert second.answer == ""
+    assert third.question == "it’s a question"
+    assert third.answer == ""
+
+
+def test_placeholder_answers():
+    for text in ("Answer here", " answer here. ", "", "-", "N/A"):
+        assert is_placeholder_answer(text)
+    assert not is_placeholder_answer("Смещение оценки")
+
+
+def test_directory_deduplicates_and_filters_languages(tmp_path):
+    _write_csv(tmp_path / "a.csv", ["question", "answer", "difficulty", "topic"], [
+        ["What is a tensor?", "A multidimensional array", "Easy", "General Program"],
+        ["Что такое тензор?", "Многомерный массив", "Medium", "Machine Learning"],
+    ])
+    _write_csv(tmp_path / "b.csv", ["question", "answer"], [
+        ["what is a TENSOR", "Duplicate"],
+        ["Tensor được dùng để làm gì?", "Vietnamese"],
+    ])
+    (tmp_path / "notes.txt").write_text("ignored")
+    records = list(iter_directory_records(str(tmp_path)))
+    assert [record.question for record in records] == ["What is a tensor?", "Что такое тензор?"]
+    assert records[0].category == "General Programming"
+    assert records[1].language == "ru"
+
+
+def test_documents_and_digest(tmp_path):
+    _write_csv(tmp_path / "a.csv", ["question", "answer"], [["What is bias?", "Answer here"],
+                                                           ["What is variance?", "Spread"]])
+    documents = load_directory_documents(str(tmp_path))["a.csv"]
+    assert documents[0].text == "Question: What is bias?"
+    assert documents[1].text == "Question: What is variance?\nAnswer: Spread"
+    assert "question" not in documents[1].metadata
+    digest = documents_digest(documents)
+
+    _write_csv(tmp_path / "a.csv", ["question", "answer"], [["What is bias?", "Systematic error"],
+                                                           ["What is variance?", "Spread"]])
+    changed = load_directory_documents(str(tmp_path))["a.csv"]
+    assert documents_digest(changed) != digest
+    assert record_to_document(next(iter_records(str(tmp_path / "a.csv")))).doc_id == "a.csv:1"
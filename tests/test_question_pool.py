@@ -0,0 +1,78 @@
+import asyncio
+
+from src.question_pool import QuestionPool, is_valid_question
+
+KEY = ("Data Science", "Junior")
+
+
+def _pool(tmp_path, generate, **kwargs):
+    kwargs.setdefault("retry_delay", 0)
+    return QuestionPool(generate, [KEY], path=str(tmp_path / "pool.json"), **kwargs)
+
+
+def test_is_valid_question():
+    assert is_valid_question({"question": "Что такое bias?", "answer": "Смещение"})
+    assert not is_valid_question({"question": "Что такое bias?", "answer": ""})
+    assert not is_valid_question({"question": " ", "answer": "Смещение"})
+    assert not is_valid_question("Что такое bias?")
+
+
+def test_fill_passes_buffered_questions_as_exclude(tmp_path):
+    seen = []
+
+    async def generate(scope, difficulty, exclude):
+        seen.append(list(exclude))
+        return {"question": f"Вопрос {len(seen)}", "answer": "Ответ"}
+
+    pool = _pool(tmp_path, generate, target_size=3)
+    asyncio.run(pool._fill(KEY))
+    assert pool.size(*KEY) == 3
+    assert seen == [[], ["Вопрос 1"], ["Вопрос 1", "Вопрос 2"]]
+
+
+def test_fill_stops_after_attempt_limit(tmp_path):
+    calls = []
+
+    async def generate(scope, difficulty, exclude):
+        calls.append(1)
+        return {"question": "Всегда один и тот же", "answer": "Ответ"}
+
+    pool = _pool(tmp_path, generate, target_size=2, attempts_per_item=3)
+    asyncio.run(pool._fill(KEY))
+    assert len(calls) == 6
+    assert pool.size(*KEY) == 1
+    assert pool.stats()["duplicates"] == 5
+
+
+def test_fill_backs_off_on_invalid_items(tmp_path, monkeypatch):
+    sleeps = []
+    original_sleep = asyncio.sleep
+
+    async def recording_sleep(delay):
+        sleeps.append(delay)
+        await original_sleep(0)
+
+    async def generate(scope, difficulty, exclude):
+        return {"question": "Вопрос", "answer": ""}
+
+    monkeypatch.setattr(asyncio, "sleep", recording_sleep)
+    pool = _pool(tmp_path, generate, target_size=1, attempts_per_item=2, retry_delay=0.01)
+    asyncio.run(pool._fill(KEY))
+    assert sleeps == [0.01, 0.01]
+    assert pool.stats()["failures"] == 2
+
+
+def test_take_skips_asked_questions_and_persists(tmp_path):
+    async def generate(scope, difficulty, exclude):
+        return {"question": f"Вопрос {len(exclude) + 1}", "answer": "Ответ"}
+
+    pool = _pool(tmp_path, generate, target_size=2, low_watermark=1)
+    asyncio.run(pool._fill(KEY))
+    assert pool.take(*KEY, exclude={"Вопрос 1"})["question"] == "Вопрос 2"
+    assert pool.take("Data Science", "Senior") is None
+    # take только помечает пул измененным, на диск его пишет фоновый воркер
+    pool.save()
+
+    restored = _pool(tmp_path, generate)
+    assert restored.size(*KEY) == 1
+    assert restored.take(*KEY)["question"] == "Вопрос 1"
@@ -0,0 +1,112 @@
+import asyncio
+
+import pytest
+
+from src.resilience import (CircuitBreaker, CircuitOpenError, RetryBudget, call_with_retry, is_transient, retry_after,
+                            retry_budget)
+
+
+class StatusError(Exception):
+    def __init__(self, status_code, headers=None):
+        super().__init__(f"status {status_code}")
+        self.status_code = status_code
+        self.headers = headers or {}
+
+
+def test_breaker_opens_after_threshold_and_recovers():
+    breaker = CircuitBreaker("test", failure_threshold=2, reset_timeout=0.05)
+    breaker.before_call()
+    breaker.record_failure()
+    breaker.before_call()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    with pytest.raises(CircuitOpenError) as error:
+        breaker.before_call()
+    assert 0 < error.value.retry_in <= 0.05
+    assert breaker.rejected == 1
+
+    asyncio.run(asyncio.sleep(0.06))
+    # После паузы пропускается один пробный вызов
+    breaker.before_call()
+    assert breaker.state == "half_open"
+    breaker.record_success()
+    assert breaker.state == "closed"
+    assert breaker.stats()["opened"] == 1
+
+
+def test_failed_probe_reopens_breaker():
+    breaker = CircuitBreaker("test", failure_threshold=5, reset_timeout=0.01)
+    for _ in range(5):
+        breaker.record_failure()
+    asyncio.run(asyncio.sleep(0.02))
+    breaker.before_call()
+    breaker.record_failure()
+    assert breaker.state == "open"
+
+
+def test_retry_budget_limits_count_and_time():
+    budget = RetryBudget(retries=2, seconds=10)
+    assert budget.take(1) and budget.take(1)
+    assert not budget.take(0)
+    assert not RetryBudget(retries=5, seconds=1).take(5)
+
+
+def test_nested_retry_budget_is_shared():
+    with retry_budget(retries=3, seconds=10) as outer:
+        with retry_budget(retries=100) as inner:
+            assert inner is outer
+
+
+def test_transient_errors_and_retry_after():
+    assert is_transient(StatusError(503))
+    assert is_transient(StatusError(429))
+    assert not is_transient(StatusError(400))
+    assert is_transient(ConnectionError())
+    assert not is_transient(ValueError())
+    assert retry_after(StatusError(429, {"retry-after": "3"})) == 3.0
+    assert retry_after(StatusError(429)) is None
+
+
+def test_call_with_retry_recovers_from_transient_error():
+    attempts = []
+
+    async def flaky():
+        attempts.append(1)
+        if len(attempts) < 2:
+            raise StatusError(503, {"retry-after": "0"})
+        return "ok"
+
+    async def scenario():
+        with retry_budget(retries=3, seconds=5):
+            return await call_with_retry("test", CircuitBreaker("test"), flaky)
+
+    assert asyncio.run(scenario()) == "ok"
+    assert len(attempts) == 2
+
+
+def test_call_with_retry_does_not_repeat_request_errors():
+    attempts = []
+
+    async def bad_request():
+        attempts.append(1)
+        raise StatusError(400)
+
+    with pytest.raises(StatusError):
+        asyncio.run(call_with_retry("test", None, bad_request))
+    assert len(attempts) == 1
+
+
+def test_call_with_retry_stops_when_budget_is_spent():
+    attempts = []
+
+    async def down():
+        attempts.append(1)
+        raise StatusError(503, {"retry-after": "0"})
+
+    async def scenario():
+        with retry_budget(retries=1, seconds=5):
+            await call_with_retry("test", None, down, max_attempts=10)
+
+    with pytest.raises(StatusError):
+        asyncio.run(scenario())
+    assert len(attempts) == 2
@@ -0,0 +1,106 @@
+import asyncio
+
+from src.scheduler import (PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE, PRIORITY_QUESTION, LLMScheduler, UserRequests,
+                           llm_context)
+
+
+async def _request(scheduler, order, name, user_id=None, priority=PRIORITY_QUESTION, tokens=1, hold=0.01):
+    with llm_context(user_id, priority):
+        ticket = await scheduler.acquire(tokens)
+    order.append(name)
+    await asyncio.sleep(hold)
+    scheduler.release(ticket, tokens)
+
+
+async def _run_blocked(scheduler, requests):
+    """Запросы встают в очередь, пока единственное место занято, и выполняются после его освобождения"""
+    order = []
+    blocker = await scheduler.acquire(1)
+    tasks = []
+    for kwargs in requests:
+        tasks.append(asyncio.create_task(_request(scheduler, order, **kwargs)))
+        await asyncio.sleep(0)
+    scheduler.release(blocker)
+    await asyncio.gather(*tasks)
+    return order
+
+
+def test_priority_order():
+    order = asyncio.run(_run_blocked(LLMScheduler(1), [
+        {"name": "background", "priority": PRIORITY_BACKGROUND},
+        {"name": "question", "user_id": 1, "priority": PRIORITY_QUESTION},
+        {"name": "interactive", "user_id": 2, "priority": PRIORITY_INTERACTIVE},
+    ]))
+    assert order == ["interactive", "question", "background"]
+
+
+def test_users_served_round_robin():
+    order = asyncio.run(_run_blocked(LLMScheduler(1), [
+        {"name": "a1", "user_id": 1},
+        {"name": "a2", "user_id": 1},
+        {"name": "a3", "user_id": 1},
+        {"name": "b1", "user_id": 2},
+    ]))
+    assert order == ["a1", "b1", "a2", "a3"]
+
+
+def test_concurrency_and_one_request_per_user():
+    async def scenario():
+        scheduler = LLMScheduler(2)
+        with llm_context(1):
+            first = await scheduler.acquire(1)
+            second = asyncio.create_task(scheduler.acquire(1))
+        with llm_context(2):
+            other = await scheduler.acquire(1)
+        await asyncio.sleep(0)
+        # У пользователя 1 уже есть запрос в работе, второй ждет даже при свободном месте
+        assert not second.done()
+        assert scheduler.stats()["active"] == 2
+        scheduler.release(other)
+        await asyncio.sleep(0)
+        assert not second.done()
+        scheduler.release(first)
+        scheduler.release(await second)
+        assert scheduler.stats()["active"] == 0
+
+    asyncio.run(scenario())
+
+
+def test_token_budget_throttles_until_refill():
+    async def scenario():
+        scheduler = LLMScheduler(4, tokens_per_minute=6000)
+        ticket = await scheduler.acquire(6000)
+        waiting = asyncio.create_task(scheduler.acquire(50))
+        await asyncio.sleep(0.1)
+        assert not waiting.done()
+        assert scheduler.throttled >= 1
+        # 50 токенов при 6000 в минуту восполняются за 0.5 с
+        scheduler.release(await asyncio.wait_for(waiting, 2))
+        scheduler.release(ticket)
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_waiter_leaves_queue():
+    async def scenario():
+        scheduler = LLMScheduler(1)
+        blocker = await scheduler.acquire(1)
+        waiting = asyncio.create_task(scheduler.acquire(1))
+        await asyncio.sleep(0)
+        waiting.cancel()
+        await asyncio.gather(waiting, return_exceptions=True)
+        scheduler.release(blocker)
+        assert scheduler.stats()["active"] == 0
+        assert sum(scheduler.stats()["queued"].values()) == 0
+
+    asyncio.run(scenario())
+
+
+def test_user_requests_claim():
+    requests = UserRequests()
+    with requests.claim(1, "next_question") as first:
+        with requests.claim(1, "next_question") as second, requests.claim(2, "next_question") as other:
+            assert first and not second and other
+    with requests.claim(1, "next_question") as again:
+        assert again
+    assert requests.dropped == 1
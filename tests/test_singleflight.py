@@ -0,0 +1,167 @@
+import asyncio
+
+import pytest
+
+from src.scheduler import PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE, PRIORITY_QUESTION, LLMScheduler, llm_context
+from src.singleflight import SingleFlight, buffered
+
+
+def test_concurrent_calls_share_one_result():
+    async def scenario():
+        flight = SingleFlight("test")
+        calls = []
+
+        async def work(value):
+            calls.append(value)
+            await asyncio.sleep(0.01)
+            return value * 2
+
+        results = await asyncio.gather(*(flight.do("key", work, 21) for _ in range(5)))
+        assert results == [42] * 5
+        assert calls == [21]
+        assert flight.stats() == {"calls": 1, "shared": 4, "in_flight": 0}
+        # После завершения следующий вызов выполняется заново
+        assert await flight.do("key", work, 1) == 2
+        assert len(calls) == 2
+
+    asyncio.run(scenario())
+
+
+def test_error_is_shared():
+    async def scenario():
+        flight = SingleFlight("test")
+
+        async def fail():
+            await asyncio.sleep(0.01)
+            raise ValueError("boom")
+
+        results = await asyncio.gather(flight.do("key", fail), flight.do("key", fail), return_exceptions=True)
+        assert all(isinstance(result, ValueError) for result in results)
+        assert flight.calls == 1
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_waiter_does_not_cancel_call():
+    async def scenario():
+        flight = SingleFlight("test")
+
+        async def work():
+            await asyncio.sleep(0.05)
+            return "done"
+
+        first = asyncio.create_task(flight.do("key", work))
+        second = asyncio.create_task(flight.do("key", work))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        assert await second == "done"
+        with pytest.raises(asyncio.CancelledError):
+            await first
+
+    asyncio.run(scenario())
+
+
+def test_stream_is_replayed_to_late_subscriber():
+    async def scenario():
+        flight = SingleFlight("test")
+
+        async def chunks():
+            for chunk in ("a", "b", "c"):
+                await asyncio.sleep(0.01)
+                yield chunk
+
+        async def collect():
+            return [chunk async for chunk in flight.stream("key", chunks)]
+
+        first = asyncio.create_task(collect())
+        await asyncio.sleep(0.015)
+        second = asyncio.create_task(collect())
+        assert await first == ["a", "b", "c"]
+        assert await second == ["a", "b", "c"]
+        assert flight.calls == 1 and flight.shared == 1
+
+    asyncio.run(scenario())
+
+
+def test_shared_call_runs_at_best_waiter_priority():
+    async def scenario():
+        scheduler = LLMScheduler(1)
+        flight = SingleFlight("test")
+        order = []
+
+        async def call(name):
+            ticket = await scheduler.acquire(1)
+            order.append(name)
+            await asyncio.sleep(0.01)
+            scheduler.release(ticket)
+            return name
+
+        async def request(user_id, priority, coro):
+            with llm_context(user_id, priority):
+                return await coro()
+
+        blocker = await scheduler.acquire(1)
+        refill = asyncio.create_task(request(None, PRIORITY_BACKGROUND, lambda: flight.do("key", call, "shared")))
+        await asyncio.sleep(0)
+        question = asyncio.create_task(request(1, PRIORITY_QUESTION, lambda: call("question")))
+        await asyncio.sleep(0)
+        interactive = asyncio.create_task(request(2, PRIORITY_INTERACTIVE, lambda: flight.do("key", call, "unused")))
+        await asyncio.sleep(0)
+        scheduler.release(blocker)
+        assert await asyncio.gather(refill, question, interactive) == ["shared", "question", "shared"]
+        # Фоновый вызов, к которому присоединился пользователь, обгоняет следующий вопрос
+        assert order == ["shared", "question"]
+
+    asyncio.run(scenario())
+
+
+def test_buffered_source_finishes_before_slow_consumer():
+    async def scenario():
+        finished = asyncio.Event()
+
+        async def source():
+            for chunk in ("a", "b", "c"):
+                yield chunk
+            finished.set()
+
+        received = []
+        async for chunk in buffered(source()):
+            received.append(chunk)
+            if chunk == "a":
+                # Потребитель еще на первом куске, а источник уже дочитан
+                await asyncio.wait_for(finished.wait(), 1)
+        assert received == ["a", "b", "c"]
+
+    asyncio.run(scenario())
+
+
+def test_buffered_cancels_source_when_consumer_stops():
+    async def scenario():
+        closed = asyncio.Event()
+
+        async def source():
+            try:
+                while True:
+                    yield "chunk"
+                    await asyncio.sleep(0.01)
+            finally:
+                closed.set()
+
+        chunks = buffered(source())
+        assert await chunks.__anext__() == "chunk"
+        await chunks.aclose()
+        await asyncio.wait_for(closed.wait(), 1)
+
+    asyncio.run(scenario())
+
+
+def test_buffered_propagates_errors():
+    async def source():
+        yield "a"
+        raise ConnectionError("обрыв")
+
+    async def scenario():
+        return [chunk async for chunk in buffered(source())]
+
+    with pytest.raises(ConnectionError):
+        asyncio.run(scenario())
@@ -0,0 +1,93 @@
+import asyncio
+
+from aiogram.exceptions import TelegramBadRequest
+
+from src.streaming import TelegramStreamWriter, split_message
+
+
+def test_short_text_is_one_part():
+    assert split_message("Привет", limit=100) == ["Привет"]
+
+
+def test_split_prefers_paragraphs():
+    text = "а" * 60 + "\n\n" + "б" * 60
+    assert split_message(text, limit=100) == ["а" * 60, "б" * 60]
+
+
+def test_split_falls_back_to_words_and_hard_cut():
+    words = " ".join(["слово"] * 50)
+    parts = split_message(words, limit=40)
+    assert all(len(part) <= 40 for part in parts)
+    assert " ".join(parts).split() == words.split()
+
+    solid = "x" * 250
+    assert split_message(solid, limit=100) == ["x" * 100, "x" * 100, "x" * 50]
+
+
+def test_split_does_not_cut_early_in_window():
+    # Разделитель в первой половине окна игнорируется, чтобы не плодить короткие сообщения
+    text = "ab " + "c" * 200
+    parts = split_message(text, limit=100)
+    assert len(parts[0]) == 100
+
+
+class FakeMessage:
+    def __init__(self, chat, text, fail_edit=None):
+        self.chat = chat
+        self.text = text
+        self.fail_edit = fail_edit
+
+    async def answer(self, text):
+        message = FakeMessage(self.chat, text)
+        self.chat.append(message)
+        return message
+
+    async def edit_text(self, text):
+        if self.fail_edit is not None:
+            raise TelegramBadRequest(method=None, message=self.fail_edit)
+        self.text = text
+
+
+def _writer():
+    chat = []
+    incoming = FakeMessage(chat, "вопрос")
+    return chat, TelegramStreamWriter(incoming, prefix="Ответ: ", min_interval=0, min_delta=1)
+
+
+def test_writer_edits_placeholder():
+    chat, writer = _writer()
+
+    async def scenario():
+        await writer.start("...")
+        await writer.feed("первая часть")
+        await writer.feed(", вторая")
+        await writer.finish()
+
+    asyncio.run(scenario())
+    assert [message.text for message in chat] == ["Ответ: первая часть, вторая"]
+
+
+def test_writer_sends_new_message_when_edit_fails():
+    chat, writer = _writer()
+
+    async def scenario():
+        await writer.start("...")
+        chat[0].fail_edit = "Bad Request: message to edit not found"
+        await writer.feed("текст")
+        await writer.finish()
+
+    asyncio.run(scenario())
+    assert [message.text for message in chat] == ["...", "Ответ: текст"]
+
+
+def test_writer_ignores_not_modified():
+    chat, writer = _writer()
+
+    async def scenario():
+        await writer.start("...")
+        chat[0].fail_edit = "Bad Request: message is not modified"
+        await writer.feed("текст")
+        await writer.finish()
+
+    asyncio.run(scenario())
+    assert len(chat) == 1
@@ -0,0 +1,22 @@
+from src.workers import update_user_id
+
+
+def test_message_sender():
+    update = {"update_id": 1, "message": {"message_id": 5, "from": {"id": 42, "is_bot": False},
+                                          "chat": {"id": -100, "type": "group"}, "text": "/start"}}
+    assert update_user_id(update) == 42
+
+
+def test_callback_query_and_reaction():
+    assert update_user_id({"update_id": 2, "callback_query": {"id": "q", "from": {"id": 7}}}) == 7
+    assert update_user_id({"update_id": 3, "message_reaction": {"user": {"id": 8}, "chat": {"id": 9}}}) == 8
+
+
+def test_channel_post_uses_chat():
+    assert update_user_id({"update_id": 4, "channel_post": {"chat": {"id": -5, "type": "channel"}}}) == -5
+
+
+def test_update_without_user():
+    assert update_user_id({"update_id": 5}) is None
+    assert update_user_id({"update_id": 6, "poll": {"id": "p", "question": "?"}}) is None
+    assert update_user_id({"update_id": 7, "message": {"from": {"id": "not-an-int"}}}) is None